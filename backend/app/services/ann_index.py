@@ -0,0 +1,273 @@
+# eidbi-query-system/backend/app/services/ann_index.py
+
+"""
+Approximate nearest-neighbor search with an inverted-file (IVF) index.
+
+The corpus is partitioned into ``nlist`` clusters with spherical k-means on
+CPU. A query is compared with the cluster centroids first and only the rows of
+the ``nprobe`` closest clusters are scored exactly, so the work per query grows
+with ``nprobe / nlist`` of the corpus instead of all of it. Raising ``nprobe``
+trades latency for recall.
+
+The index is built offline and stored inside the corpus artifact directory:
+
+    python -m app.services.ann_index local_scraped_data_with_embeddings.jsonl --nlist 256
+
+Building the corpus artifact with VECTOR_SEARCH_ENGINE=ivf builds it too. The
+index records the artifact's source stamp and is ignored once the corpus changes.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .corpus_artifact import CorpusArtifact
+from .vector_index import VectorIndex, top_k_indices
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+IVF_INDEX_FILE = 'ivf_index.npz'
+
+DEFAULT_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+DEFAULT_KMEANS_ITERATIONS = 20
+DEFAULT_TRAIN_SAMPLE = 100_000
+
+
+def default_nlist(rows: int) -> int:
+    """Rule-of-thumb cluster count: about sqrt(rows), at least 1."""
+    return max(1, int(round(np.sqrt(rows))))
+
+
+class IVFIndex:
+    """Inverted-file index over the rows of a normalized embedding matrix."""
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, list_offsets: np.ndarray,
+                 nprobe: int = DEFAULT_NPROBE, metadata: Optional[dict] = None):
+        """
+        Args:
+            centroids: float32 [nlist x dim] normalized cluster centroids
+            order: Matrix rows sorted by cluster
+            list_offsets: int64 [nlist + 1]; rows of cluster c are order[list_offsets[c]:list_offsets[c + 1]]
+            nprobe: Default number of clusters scanned per query
+            metadata: Build settings stored with the index (see save())
+        """
+        self.centroids = centroids
+        self.order = order
+        self.list_offsets = list_offsets
+        self.nprobe = nprobe
+        self.metadata = metadata or {}
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def rows(self) -> int:
+        return int(self.order.shape[0])
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, nlist: Optional[int] = None, iterations: int = DEFAULT_KMEANS_ITERATIONS,
+              train_sample: int = DEFAULT_TRAIN_SAMPLE, seed: int = 0, nprobe: int = DEFAULT_NPROBE) -> 'IVFIndex':
+        """
+        Cluster a normalized matrix with spherical k-means and assign every row to its closest centroid.
+
+        Args:
+            matrix: float32 [rows x dim] L2-normalized embeddings
+            nlist: Number of clusters (defaults to about sqrt(rows))
+            iterations: k-means iterations
+            train_sample: Maximum number of rows used to fit the centroids
+            seed: Random seed for sampling and initialization
+            nprobe: Default number of clusters scanned per query
+        """
+        rows = matrix.shape[0]
+        if rows == 0:
+            raise ValueError("Cannot train an IVF index on an empty matrix")
+        nlist = min(nlist or default_nlist(rows), rows)
+        rng = np.random.default_rng(seed)
+
+        sample = matrix
+        if rows > train_sample:
+            sample = matrix[np.sort(rng.choice(rows, train_sample, replace=False))]
+        sample = np.asarray(sample, dtype=np.float32)
+
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), centroids).astype(np.float32)
+
+        assignment = cls._assign(matrix, centroids)
+        order = np.argsort(assignment, kind='stable').astype(np.int64)
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=nlist), out=list_offsets[1:])
+        return cls(centroids, order, list_offsets, nprobe=nprobe)
+
+    @staticmethod
+    def _assign(matrix: np.ndarray, centroids: np.ndarray, block: int = 65536) -> np.ndarray:
+        """Closest centroid of every row, computed in blocks to bound memory."""
+        assignment = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], block):
+            assignment[start:start + block] = np.argmax(matrix[start:start + block] @ centroids.T, axis=1)
+        return assignment
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """Matrix rows in the nprobe clusters closest to a normalized query."""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        lists = top_k_indices(self.centroids @ query, nprobe)
+        return np.concatenate([self.order[self.list_offsets[c]:self.list_offsets[c + 1]] for c in lists])
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, k: int,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k search.
+
+        Args:
+            matrix: The normalized matrix the index was built over
+            query: Normalized query vector
+            k: Number of results
+            nprobe: Clusters to scan (defaults to the index setting)
+
+        Returns:
+            Tuple of (matrix rows, scores), best first
+        """
+        rows = self.candidates(query, nprobe)
+        if rows.size == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        rows.sort()  # Sequential access into a memory-mapped matrix
+        scores = matrix[rows] @ query
+        best = top_k_indices(scores, k)
+        return rows[best], scores[best]
+
+    def save(self, path: str, metadata: Optional[dict] = None) -> None:
+        """Persist the index to an .npz file."""
+        np.savez(
+            path,
+            centroids=self.centroids,
+            order=self.order,
+            list_offsets=self.list_offsets,
+            metadata=np.array(json.dumps(metadata or {}))
+        )
+
+    @classmethod
+    def load(cls, path: str, nprobe: int = DEFAULT_NPROBE) -> 'IVFIndex':
+        """Load an index written by save()."""
+        with np.load(path) as data:
+            return cls(data['centroids'], data['order'], data['list_offsets'], nprobe=nprobe,
+                       metadata=json.loads(str(data['metadata'])))
+
+
+def measure_recall(matrix: np.ndarray, ivf: IVFIndex, k: int = 10, queries: int = 200,
+                   nprobe: Optional[int] = None, seed: int = 1) -> Tuple[float, float, float]:
+    """
+    Estimate recall@k of the IVF index against exact search, using corpus rows as queries.
+
+    Returns:
+        Tuple of (recall, exact ms per query, approximate ms per query)
+    """
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(matrix.shape[0], min(queries, matrix.shape[0]), replace=False)
+    hits = 0
+    exact_time = approx_time = 0.0
+    for row in sample:
+        query = np.asarray(matrix[row], dtype=np.float32)
+        start = time.perf_counter()
+        exact = set(top_k_indices(matrix @ query, k).tolist())
+        exact_time += time.perf_counter() - start
+        start = time.perf_counter()
+        approx, _ = ivf.search(matrix, query, k, nprobe)
+        approx_time += time.perf_counter() - start
+        hits += len(exact.intersection(approx.tolist()))
+    total = len(sample)
+    return hits / (total * min(k, matrix.shape[0])), 1000 * exact_time / total, 1000 * approx_time / total
+
+
+def build_ivf_index(artifact: CorpusArtifact, nlist: Optional[int] = None,
+                    iterations: int = DEFAULT_KMEANS_ITERATIONS, nprobe: int = DEFAULT_NPROBE) -> IVFIndex:
+    """
+    Train an IVF index over an artifact's matrix and store it in the artifact directory.
+
+    Returns:
+        The new index
+    """
+    index = VectorIndex.from_artifact(artifact)
+    ivf = IVFIndex.train(index.matrix, nlist=nlist, iterations=iterations, nprobe=nprobe)
+    recall, exact_ms, approx_ms = measure_recall(index.matrix, ivf, nprobe=nprobe)
+    logger.info(f"IVF nlist={ivf.nlist} nprobe={nprobe}: recall@10={recall:.3f}, "
+                f"exact {exact_ms:.2f} ms/query, ivf {approx_ms:.2f} ms/query")
+
+    output_path = os.path.join(artifact.path, IVF_INDEX_FILE)
+    ivf.metadata = {'nlist': ivf.nlist, 'nprobe': nprobe, 'recall_at_10': recall,
+                    'source_stamp': artifact.manifest.get('source_stamp')}
+    ivf.save(output_path, ivf.metadata)
+    logger.info(f"Wrote IVF index to {output_path}")
+    return ivf
+
+
+def load_ivf_index(artifact_path: str, rows: int, source_stamp: Optional[dict] = None) -> Optional[IVFIndex]:
+    """
+    Load the IVF index stored in an artifact directory, if present and built for the same corpus.
+
+    Args:
+        artifact_path: Corpus artifact directory
+        rows: Rows of the matrix the index must cover
+        source_stamp: The artifact manifest's source_stamp; an index built from another corpus file is ignored
+
+    Returns:
+        The index, or None (with a warning) if it is missing or stale
+    """
+    path = os.path.join(artifact_path, IVF_INDEX_FILE)
+    if not os.path.exists(path):
+        logger.warning(f"No IVF index at {path}; using exact search. Build it with "
+                       f"python -m app.services.ann_index <corpus.jsonl>")
+        return None
+    try:
+        ivf = IVFIndex.load(path)
+    except Exception as e:
+        logger.warning(f"Could not load IVF index {path}: {e}")
+        return None
+    if source_stamp is not None and ivf.metadata.get('source_stamp') != source_stamp:
+        logger.warning(f"IVF index {path} was built from a different corpus file; rebuild it to use it")
+        return None
+    if ivf.rows != rows:
+        logger.warning(f"IVF index {path} covers {ivf.rows} rows but the corpus has {rows}; rebuild it to use it")
+        return None
+    logger.info(f"Loaded IVF index with {ivf.nlist} lists (nprobe={ivf.nprobe}) from {path}")
+    return ivf
+
+
+def ensure_ivf_index(artifact: CorpusArtifact) -> IVFIndex:
+    """Load the artifact's IVF index, building it first if it is missing or stale."""
+    if os.path.exists(os.path.join(artifact.path, IVF_INDEX_FILE)):
+        ivf = load_ivf_index(artifact.path, int(artifact.has_embedding.sum()), artifact.manifest.get('source_stamp'))
+        if ivf is not None:
+            return ivf
+    logger.info(f"Building IVF index for {artifact.path}")
+    return build_ivf_index(artifact)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from .corpus_artifact import build_corpus_artifact, load_corpus_artifact
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s')
+
+    parser = argparse.ArgumentParser(description="Build an IVF approximate nearest-neighbor index next to a corpus.")
+    parser.add_argument("input_file", help="Path to the JSONL corpus file.")
+    parser.add_argument("--nlist", type=int, default=None, help="Number of clusters (default: sqrt(rows)).")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="Clusters scanned per query when measuring recall.")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_KMEANS_ITERATIONS, help="k-means iterations.")
+    args = parser.parse_args()
+
+    artifact = load_corpus_artifact(args.input_file)
+    if artifact is None:
+        artifact = CorpusArtifact(build_corpus_artifact(args.input_file))
+    build_ivf_index(artifact, nlist=args.nlist, iterations=args.iterations, nprobe=args.nprobe)
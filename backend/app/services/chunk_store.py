@@ -0,0 +1,252 @@
+# eidbi-query-system/backend/app/services/chunk_store.py
+
+"""
+Compact columnar store for chunk text and metadata.
+
+A chunk held as a nested dict pays Python object overhead for every field,
+yet the full metadata (including extraction_info) is only read for the few
+chunks that are reranked and rendered into the prompt. The store keeps:
+
+    ids           one list of strings
+    content       zlib-compressed bytes per chunk, or the corpus artifact's
+                  memory-mapped (already compressed) content
+    hot fields    URLs, titles and source names interned in one string
+                  table and referenced from array('i') columns
+    positions     chunk offsets in their page, in array('q') columns
+    other fields  zlib-compressed JSON per chunk
+
+Rows come back as ChunkRecord mappings that decompress the chunk only when
+a field other than its id is read.
+"""
+
+import json
+import logging
+import sys
+import zlib
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import List, Dict, Any, Optional, Iterator, Iterable
+
+from .corpus_artifact import CorpusArtifact
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# (section, key) of string fields interned in the string table; section None is the top level.
+# Besides the hot display fields these are the fields partitions and filters read at build time.
+INTERNED_FIELDS = (
+    (None, 'title'),
+    ('metadata', 'url'),
+    ('metadata', 'title'),
+    ('metadata', 'doc_id'),
+    ('metadata', 'type'),
+    ('metadata', 'last_updated'),
+    ('source_metadata', 'url'),
+    ('source_metadata', 'source_name'),
+    ('source_metadata', 'source_type'),
+    ('source_metadata', 'document_type'),
+    ('source_metadata', 'last_modified'),
+    ('source_metadata', 'crawl_date'),
+)
+
+# (section, key) of integer fields kept in their own columns (-1 where missing)
+INTEGER_FIELDS = (
+    ('metadata', 'start_char'),
+    ('metadata', 'end_char'),
+)
+
+# Stored in their own columns, never in the compressed remainder
+_RESERVED_FIELDS = ('id', 'content', 'embedding')
+
+
+class ChunkRecord(Mapping):
+    """Read-only chunk view; everything but the id is decompressed on first access."""
+
+    __slots__ = ('_store', '_row', '_chunk')
+
+    def __init__(self, store: 'ChunkStore', row: int):
+        self._store = store
+        self._row = row
+        self._chunk: Optional[Dict[str, Any]] = None
+
+    def _materialize(self) -> Dict[str, Any]:
+        if self._chunk is None:
+            self._chunk = self._store.materialize(self._row)
+        return self._chunk
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'id':
+            return self._store.ids[self._row]
+        return self._materialize()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._materialize())
+
+    def __len__(self) -> int:
+        return len(self._materialize())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain dictionary copy of the chunk."""
+        return dict(self._materialize())
+
+    def __repr__(self) -> str:
+        return f"ChunkRecord(id={self._store.ids[self._row]!r})"
+
+
+class ChunkStore(Sequence):
+    """Columnar, compressed storage for the chunks of one index segment."""
+
+    def __init__(self, artifact: Optional[CorpusArtifact] = None):
+        """
+        Args:
+            artifact: Corpus artifact to read content from; without one, content is stored compressed here
+        """
+        self._artifact = artifact
+        self.ids: List[str] = []
+        self._content: List[bytes] = []
+        self._strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+        self._interned = [array('i') for _ in INTERNED_FIELDS]
+        self._integers = [array('q') for _ in INTEGER_FIELDS]
+        self._extra: List[Optional[bytes]] = []
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Dict[str, Any]]) -> 'ChunkStore':
+        """Build a store from chunk dictionaries."""
+        store = cls()
+        for chunk in chunks:
+            store.append(chunk)
+        logger.info(f"Built chunk store with {len(store)} chunks ({store.memory_usage()['total_bytes'] / 1e6:.1f} MB)")
+        return store
+
+    @classmethod
+    def from_artifact(cls, artifact: CorpusArtifact) -> 'ChunkStore':
+        """Build a store over a corpus artifact; content stays in the artifact's mapped file."""
+        store = cls(artifact)
+        fields = artifact.load_fields()
+        for row, chunk_id in enumerate(artifact.ids):
+            chunk = {'id': chunk_id}
+            for field, values in fields.items():
+                if values[row] is not None:
+                    chunk[field] = values[row]
+            store.append(chunk)
+        logger.info(f"Built chunk store with {len(store)} chunks over {artifact.path} "
+                    f"({store.memory_usage()['total_bytes'] / 1e6:.1f} MB)")
+        return store
+
+    def _intern(self, value: str) -> int:
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._strings.append(value)
+            self._string_ids[value] = string_id
+        return string_id
+
+    def append(self, chunk: Dict[str, Any]) -> None:
+        """Add a chunk at the end of the store."""
+        self.ids.append(chunk['id'])
+        if self._artifact is None:
+            self._content.append(zlib.compress((chunk.get('content') or '').encode('utf-8')))
+
+        rest = {field: value for field, value in chunk.items() if field not in _RESERVED_FIELDS}
+        copied = set()
+        for column, (section, key) in zip(self._interned, INTERNED_FIELDS):
+            container = rest if section is None else rest.get(section)
+            value = container.get(key) if isinstance(container, dict) else None
+            if not isinstance(value, str):
+                column.append(-1)
+                continue
+            if section is not None and section not in copied:
+                # Copy before removing interned keys so the caller's dict is untouched
+                container = rest[section] = dict(container)
+                copied.add(section)
+            del container[key]
+            column.append(self._intern(value))
+        for column, (section, key) in zip(self._integers, INTEGER_FIELDS):
+            container = rest.get(section)
+            value = container.get(key) if isinstance(container, dict) else None
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                column.append(-1)
+                continue
+            if section not in copied:
+                container = rest[section] = dict(container)
+                copied.add(section)
+            del container[key]
+            column.append(value)
+        for section in copied:
+            # Rebuilt from the interned columns on read
+            if not rest[section]:
+                del rest[section]
+        self._extra.append(zlib.compress(json.dumps(rest, ensure_ascii=False).encode('utf-8')) if rest else None)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [ChunkRecord(self, i) for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return ChunkRecord(self, row)
+
+    def content(self, row: int) -> str:
+        """Decompress the content of a single row."""
+        if self._artifact is not None:
+            return self._artifact.content(row)
+        return zlib.decompress(self._content[row]).decode('utf-8')
+
+    def title(self, row: int) -> str:
+        """Title of a row (top-level or metadata title), without decompressing the row."""
+        for column, (section, key) in zip(self._interned, INTERNED_FIELDS):
+            if key == 'title' and column[row] >= 0:
+                return self._strings[column[row]]
+        return ''
+
+    def field_values(self, section: Optional[str], key: str) -> List[Optional[str]]:
+        """Values of one interned field for every row (None where missing), without decompressing rows."""
+        column = self._interned[INTERNED_FIELDS.index((section, key))]
+        return [self._strings[string_id] if string_id >= 0 else None for string_id in column]
+
+    def integer_values(self, section: str, key: str) -> array:
+        """Column of one integer field (-1 where missing), without decompressing rows."""
+        return self._integers[INTEGER_FIELDS.index((section, key))]
+
+    def materialize(self, row: int) -> Dict[str, Any]:
+        """Rebuild the chunk dictionary of a row."""
+        chunk: Dict[str, Any] = {'id': self.ids[row], 'content': self.content(row)}
+        extra = self._extra[row]
+        if extra is not None:
+            chunk.update(json.loads(zlib.decompress(extra)))
+        for column, (section, key) in zip(self._interned, INTERNED_FIELDS):
+            string_id = column[row]
+            if string_id < 0:
+                continue
+            container = chunk if section is None else chunk.setdefault(section, {})
+            container[key] = self._strings[string_id]
+        for column, (section, key) in zip(self._integers, INTEGER_FIELDS):
+            if column[row] >= 0:
+                chunk.setdefault(section, {})[key] = column[row]
+        return chunk
+
+    def iter_search_fields(self) -> Iterator[Dict[str, Any]]:
+        """Yield the id, content and title of every row, e.g. for building a KeywordIndex."""
+        for row, chunk_id in enumerate(self.ids):
+            yield {'id': chunk_id, 'content': self.content(row), 'title': self.title(row)}
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Approximate heap bytes per component (mapped artifact content is reported separately)."""
+        usage = {
+            'ids_bytes': sys.getsizeof(self.ids) + sum(sys.getsizeof(chunk_id) for chunk_id in self.ids),
+            'content_bytes': sys.getsizeof(self._content) + sum(sys.getsizeof(data) for data in self._content),
+            'interned_bytes': (sys.getsizeof(self._strings) + sys.getsizeof(self._string_ids)
+                               + sum(sys.getsizeof(value) for value in self._strings)
+                               + sum(column.buffer_info()[1] * column.itemsize for column in self._interned)),
+            'integer_bytes': sum(column.buffer_info()[1] * column.itemsize for column in self._integers),
+            'extra_bytes': sys.getsizeof(self._extra) + sum(sys.getsizeof(data) for data in self._extra if data is not None)
+        }
+        usage['total_bytes'] = sum(usage.values())
+        if self._artifact is not None:
+            usage['content_mapped_bytes'] = int(self._artifact.offsets[-1]) if len(self._artifact.offsets) else 0
+        return usage
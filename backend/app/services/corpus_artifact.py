@@ -0,0 +1,424 @@
+# eidbi-query-system/backend/app/services/corpus_artifact.py
+
+"""
+Columnar binary corpus artifact.
+
+Converts a ``local_scraped_data_with_embeddings*.jsonl`` file into a directory
+that can be loaded without parsing 768 floats of JSON text per chunk:
+
+    <name>.corpus/
+        manifest.json     format version, row count, dimension, source file stamp
+        embeddings.npy    float32 [rows x dim], L2-normalized, memory-mappable
+        offsets.npy       int64 [rows + 1] byte offsets into content.bin
+        content.bin       zlib-compressed UTF-8 chunk contents, concatenated
+        columns.json      ids and embedding mask
+        fields.json       one column per remaining field (loaded only when needed)
+
+Usage:
+    python -m app.services.corpus_artifact local_scraped_data_with_embeddings.jsonl
+
+With several uvicorn workers, a loader step publishes the artifact to a
+memory-backed filesystem (``/dev/shm`` is where POSIX shared memory lives on
+Linux) and every worker memory-maps the same physical pages read-only:
+
+    python -m app.services.corpus_artifact local_scraped_data_with_embeddings.jsonl --shared-memory /dev/shm
+
+A rebuild replaces the whole directory, side indexes included, so the command
+also (re)builds the side index of VECTOR_SEARCH_ENGINE (--search-engine): the
+IVF index for "ivf", the projection for "pca".
+"""
+
+import json
+import logging
+import mmap
+import os
+import shutil
+import zlib
+from collections.abc import Sequence
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterator
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+ARTIFACT_FORMAT_VERSION = 2
+# Version 1 stored uncompressed content and the field columns inside columns.json
+SUPPORTED_FORMAT_VERSIONS = (1, 2)
+ARTIFACT_SUFFIX = '.corpus'
+
+MANIFEST_FILE = 'manifest.json'
+EMBEDDINGS_FILE = 'embeddings.npy'
+OFFSETS_FILE = 'offsets.npy'
+CONTENT_FILE = 'content.bin'
+COLUMNS_FILE = 'columns.json'
+FIELDS_FILE = 'fields.json'
+
+# Fields stored in their own files rather than as field columns
+_RESERVED_FIELDS = ('id', 'content', 'embedding')
+
+
+def artifact_path_for(jsonl_path: str) -> str:
+    """Return the artifact directory that corresponds to a JSONL corpus file."""
+    base, ext = os.path.splitext(jsonl_path)
+    return (base if ext == '.jsonl' else jsonl_path) + ARTIFACT_SUFFIX
+
+
+def _source_stamp(path: str) -> Dict[str, Any]:
+    """Size and modification time used to detect a stale artifact."""
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def _replace_directory(staging: str, target: str) -> None:
+    """Rename a fully written staging directory over target; processes mapping the old files keep them."""
+    if os.path.exists(target):
+        retired = f"{target.rstrip(os.sep)}.old-{os.getpid()}"
+        shutil.rmtree(retired, ignore_errors=True)
+        os.rename(target, retired)
+        os.rename(staging, target)
+        shutil.rmtree(retired, ignore_errors=True)
+    else:
+        os.rename(staging, target)
+
+
+def build_corpus_artifact(jsonl_path: str, output_dir: Optional[str] = None) -> str:
+    """
+    Build a columnar artifact from a JSONL corpus file.
+
+    The files are written to a staging directory that is then renamed into
+    place, so a rebuild never rewrites files other processes have mapped.
+
+    Args:
+        jsonl_path: Path to the JSONL file with one chunk per line
+        output_dir: Artifact directory to write (defaults to artifact_path_for(jsonl_path))
+
+    Returns:
+        The artifact directory path
+    """
+    output_dir = output_dir or artifact_path_for(jsonl_path)
+    logger.info(f"Building corpus artifact from {jsonl_path} into {output_dir}")
+
+    ids: List[str] = []
+    contents: List[bytes] = []
+    embeddings: List[Optional[np.ndarray]] = []
+    columns: Dict[str, List[Any]] = {}
+    dimension = 0
+
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                chunk = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Error decoding JSON line: {line[:50]}...")
+                continue
+            if 'id' not in chunk:
+                continue
+
+            row = len(ids)
+            ids.append(chunk['id'])
+            contents.append(zlib.compress((chunk.get('content') or '').encode('utf-8')))
+
+            embedding = chunk.get('embedding')
+            vector = np.asarray(embedding, dtype=np.float32) if embedding else None
+            if vector is not None and not dimension:
+                dimension = vector.shape[0]
+            if vector is not None and vector.shape[0] != dimension:
+                logger.warning(f"Dropping embedding of chunk {chunk['id']}: dimension {vector.shape[0]} != {dimension}")
+                vector = None
+            embeddings.append(vector)
+
+            for field, value in chunk.items():
+                if field in _RESERVED_FIELDS:
+                    continue
+                if field not in columns:
+                    columns[field] = [None] * row
+                columns[field].append(value)
+            for field, values in columns.items():
+                if len(values) < row + 1:
+                    values.append(None)
+
+    matrix = np.zeros((len(ids), dimension), dtype=np.float32)
+    for row, vector in enumerate(embeddings):
+        if vector is not None:
+            matrix[row] = vector
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum([len(content) for content in contents], out=offsets[1:])
+
+    staging = f"{output_dir.rstrip(os.sep)}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    np.save(os.path.join(staging, EMBEDDINGS_FILE), matrix)
+    np.save(os.path.join(staging, OFFSETS_FILE), offsets)
+    with open(os.path.join(staging, CONTENT_FILE), 'wb') as f:
+        for content in contents:
+            f.write(content)
+    with open(os.path.join(staging, COLUMNS_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'ids': ids,
+            'has_embedding': [vector is not None for vector in embeddings]
+        }, f, ensure_ascii=False)
+    with open(os.path.join(staging, FIELDS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(columns, f, ensure_ascii=False)
+
+    # The manifest is written last so a partially written artifact is never loaded
+    manifest = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'rows': len(ids),
+        'dimension': dimension,
+        'normalized': True,
+        'content_encoding': 'zlib',
+        'source_file': os.path.basename(jsonl_path),
+        'source_stamp': _source_stamp(jsonl_path),
+        'created_at': datetime.now().isoformat()
+    }
+    with open(os.path.join(staging, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    _replace_directory(staging, output_dir)
+
+    logger.info(f"Wrote corpus artifact with {len(ids)} chunks (dim={dimension}) to {output_dir}")
+    return output_dir
+
+
+class CorpusArtifact:
+    """Read-only view of a corpus artifact directory."""
+
+    def __init__(self, path: str, mmap_embeddings: bool = True):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format_version') not in SUPPORTED_FORMAT_VERSIONS:
+            raise ValueError(f"Unsupported corpus artifact version {self.manifest.get('format_version')} in {path}")
+
+        with open(os.path.join(path, COLUMNS_FILE), 'r', encoding='utf-8') as f:
+            columns = json.load(f)
+        self.ids: List[str] = columns['ids']
+        self.has_embedding = np.asarray(columns['has_embedding'], dtype=bool)
+        self._fields: Optional[Dict[str, List[Any]]] = columns.get('fields')
+        self._compressed = self.manifest.get('content_encoding') == 'zlib'
+
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode='r' if mmap_embeddings else None)
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE))
+
+        content_path = os.path.join(path, CONTENT_FILE)
+        if os.path.getsize(content_path) > 0:
+            with open(content_path, 'rb') as f:
+                self._content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._content = b''
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dimension(self) -> int:
+        return int(self.manifest.get('dimension', 0))
+
+    def is_current(self, jsonl_path: str) -> bool:
+        """Check whether the artifact was built from the current version of a JSONL file."""
+        if not os.path.exists(jsonl_path):
+            return True
+        return self.manifest.get('source_stamp') == _source_stamp(jsonl_path)
+
+    @property
+    def fields(self) -> Dict[str, List[Any]]:
+        """Field columns, loaded and kept on first use."""
+        if self._fields is None:
+            self._fields = self.load_fields()
+        return self._fields
+
+    def load_fields(self) -> Dict[str, List[Any]]:
+        """Read the field columns without keeping them on the artifact."""
+        if self._fields is not None:
+            return self._fields
+        with open(os.path.join(self.path, FIELDS_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def content(self, row: int) -> str:
+        """Decode (and decompress) the content of a single row."""
+        data = self._content[self.offsets[row]:self.offsets[row + 1]]
+        return (zlib.decompress(data) if self._compressed else data).decode('utf-8')
+
+    def chunk(self, row: int, include_embedding: bool = False) -> Dict[str, Any]:
+        """Materialize a row as a chunk dictionary in the JSONL layout."""
+        chunk = {'id': self.ids[row], 'content': self.content(row)}
+        for field, values in self.fields.items():
+            if values[row] is not None:
+                chunk[field] = values[row]
+        if include_embedding and self.has_embedding[row]:
+            chunk['embedding'] = self.embeddings[row].tolist()
+        return chunk
+
+    def iter_chunks(self, include_embedding: bool = False) -> Iterator[Dict[str, Any]]:
+        """Iterate over all rows as chunk dictionaries."""
+        for row in range(len(self.ids)):
+            yield self.chunk(row, include_embedding)
+
+    def find_row(self, chunk_id: str) -> Optional[int]:
+        """Return the row of a chunk id, or None if it is not in the artifact."""
+        try:
+            return self.ids.index(chunk_id)
+        except ValueError:
+            return None
+
+
+class ArtifactChunks(Sequence):
+    """
+    Read-only sequence view of an artifact's chunks.
+
+    Rows are materialized on access, so the text stays in the shared
+    memory-mapped content file instead of a per-process list of dicts.
+    """
+
+    def __init__(self, artifact: CorpusArtifact):
+        self.artifact = artifact
+
+    def __len__(self) -> int:
+        return len(self.artifact)
+
+    @property
+    def ids(self) -> List[str]:
+        return self.artifact.ids
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self.artifact.chunk(i) for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self.artifact.chunk(row)
+
+
+def shared_artifact_path(artifact_path: str, shared_dir: str) -> str:
+    """Location of an artifact's copy in a shared-memory directory."""
+    return os.path.join(shared_dir, os.path.basename(os.path.normpath(artifact_path)))
+
+
+def publish_shared_artifact(artifact_path: str, shared_dir: str) -> str:
+    """
+    Copy an artifact into a memory-backed directory (e.g. /dev/shm) for worker processes to attach to.
+
+    The copy is written to a temporary directory and renamed into place, so a
+    worker never maps a partial artifact; workers still attached to a previous
+    copy keep their mappings until they reload.
+
+    Returns:
+        The shared artifact directory
+    """
+    target = shared_artifact_path(artifact_path, shared_dir)
+    with open(os.path.join(artifact_path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    target_manifest = os.path.join(target, MANIFEST_FILE)
+    if os.path.exists(target_manifest):
+        with open(target_manifest, 'r', encoding='utf-8') as f:
+            # Side indexes are added after the manifest is written, so compare the file lists too
+            if json.load(f) == manifest and sorted(os.listdir(target)) == sorted(os.listdir(artifact_path)):
+                logger.info(f"Shared corpus artifact {target} is current")
+                return target
+
+    os.makedirs(shared_dir, exist_ok=True)
+    staging = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.copytree(artifact_path, staging)
+    _replace_directory(staging, target)
+    logger.info(f"Published corpus artifact {artifact_path} to shared memory at {target}")
+    return target
+
+
+def build_search_index(artifact_path: str, engine: str) -> None:
+    """
+    Build the side index a vector search engine reads from the artifact directory, if it is missing or stale.
+
+    Args:
+        artifact_path: Corpus artifact directory
+        engine: VECTOR_SEARCH_ENGINE value; "exact" needs no side index
+    """
+    # Imported here: the index modules import this one
+    if engine == 'ivf':
+        from .ann_index import ensure_ivf_index
+        ensure_ivf_index(CorpusArtifact(artifact_path))
+    elif engine == 'pca':
+        from .projection_index import ensure_projection
+        ensure_projection(CorpusArtifact(artifact_path))
+
+
+def load_corpus_artifact(jsonl_path: str, artifact_path: Optional[str] = None) -> Optional[CorpusArtifact]:
+    """
+    Load the artifact that belongs to a JSONL corpus, if one exists and is current.
+
+    Returns None when there is no artifact, it is stale, or it cannot be read,
+    so callers can fall back to parsing the JSONL file.
+    """
+    artifact_path = artifact_path or artifact_path_for(jsonl_path)
+    if not os.path.exists(os.path.join(artifact_path, MANIFEST_FILE)):
+        return None
+    try:
+        artifact = CorpusArtifact(artifact_path)
+    except Exception as e:
+        logger.warning(f"Could not load corpus artifact {artifact_path}: {e}")
+        return None
+    if not artifact.is_current(jsonl_path):
+        logger.warning(f"Corpus artifact {artifact_path} is older than {jsonl_path}; rebuild it to use it")
+        return None
+    logger.info(f"Loaded corpus artifact with {len(artifact)} chunks from {artifact_path}")
+    return artifact
+
+
+def read_chunks(jsonl_path: str, include_embedding: bool = True) -> List[Dict[str, Any]]:
+    """
+    Read all chunks of a corpus, from its artifact when available, otherwise from the JSONL file.
+
+    Offline scripts use this so they share the backend's fast load path. Only
+    read-only consumers should: artifact embeddings come back L2-normalized and
+    float32-rounded, so a script that writes chunks back must parse the JSONL.
+    """
+    artifact = load_corpus_artifact(jsonl_path)
+    if artifact is not None:
+        return list(artifact.iter_chunks(include_embedding))
+
+    chunks = []
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                chunk = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Error decoding JSON line: {line[:50]}...")
+                continue
+            if not include_embedding:
+                chunk.pop('embedding', None)
+            chunks.append(chunk)
+    return chunks
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s')
+
+    parser = argparse.ArgumentParser(description="Build a columnar corpus artifact from a JSONL corpus file.")
+    parser.add_argument("input_file", help="Path to the JSONL file with chunks and embeddings.")
+    parser.add_argument("-o", "--output-dir", help="Artifact directory (defaults to <input>.corpus).", default=None)
+    parser.add_argument("--shared-memory", metavar="DIR", default=None,
+                        help="Publish the artifact to this memory-backed directory (e.g. /dev/shm), "
+                             "rebuilding it only if it is missing or stale.")
+    parser.add_argument("--search-engine", default=os.getenv("VECTOR_SEARCH_ENGINE", "exact").lower(),
+                        help="Also build the side index this vector search engine needs (default: $VECTOR_SEARCH_ENGINE).")
+    args = parser.parse_args()
+
+    if args.shared_memory:
+        artifact = load_corpus_artifact(args.input_file, args.output_dir)
+        artifact_path = artifact.path if artifact is not None else build_corpus_artifact(args.input_file, args.output_dir)
+    else:
+        artifact_path = build_corpus_artifact(args.input_file, args.output_dir)
+    build_search_index(artifact_path, args.search_engine)
+    if args.shared_memory:
+        publish_shared_artifact(artifact_path, args.shared_memory)
@@ -20,7 +20,7 @@ from enum import Enum
 
 from .provider_scraper import ProviderDirectoryScraper
 from .structured_data_service import StructuredDataService
-from .vector_db_service import update_provider_data, get_provider_statistics
+from .vector_db_service import update_provider_data, get_provider_statistics, refresh_index, compact_index
 
 logger = logging.getLogger(__name__)
 
@@ -83,6 +83,14 @@ class DataRefreshScheduler:
             function=self._cleanup_cache,
             enabled=True
         )
+        
+        # Daily merge of the index delta segments
+        self.add_job(
+            name="index_compaction",
+            frequency=RefreshFrequency.DAILY,
+            function=self._compact_index,
+            enabled=True
+        )
     
     def add_job(
         self, 
@@ -298,9 +306,9 @@ class DataRefreshScheduler:
         logger.info("Performing cache cleanup...")
         
         try:
-            # Clear vector database cache to force reload of fresh data
-            import backend.app.services.vector_db_service as vector_db
-            vector_db._cached_data = None
+            # Rebuild the vector database index in the background; queries keep
+            # using the current snapshot until the new one is swapped in
+            refresh_index()
             
             # Clean up old export files (keep last 10)
             import os
@@ -318,13 +326,25 @@ class DataRefreshScheduler:
                 except OSError:
                     pass
             
-            logger.info(f"Cache cleanup complete: cleared vector cache, removed {cleaned_files} old files")
+            logger.info(f"Cache cleanup complete: scheduled vector index rebuild, removed {cleaned_files} old files")
             return {"status": "success", "files_cleaned": cleaned_files}
             
         except Exception as e:
             logger.error(f"Cache cleanup failed: {e}")
             raise
     
+    def _compact_index(self) -> Dict[str, Any]:
+        """Merge the delta segments of the vector database index"""
+        logger.info("Compacting index delta segments...")
+        
+        try:
+            compact_index(background=False)
+            return {"status": "success"}
+            
+        except Exception as e:
+            logger.error(f"Index compaction failed: {e}")
+            raise
+    
     def run_job_manually(self, job_name: str) -> Dict[str, Any]:
         """Manually run a specific job"""
         if job_name not in self.jobs:
@@ -0,0 +1,218 @@
+# eidbi-query-system/backend/app/services/document_index.py
+
+"""
+Document-level view of an index segment for hierarchical retrieval.
+
+Chunks of the same page share metadata.doc_id, a uuid5 of the page URL (see
+scraper/utils/chunking.chunk_text). Per document the index keeps:
+
+    centroid   normalized mean of its chunk embeddings
+    length     summed BM25 length of its chunks
+    rows       its vector rows, grouped like the lists of an IVF index
+
+so a query can rank the documents first and then score only the chunks of
+the best ones (see IndexSnapshot.document_search).
+
+DocumentChunkOrder keeps the chunks of each document in page order
+(metadata.start_char), so the neighbors of a hit are found in O(1) and
+their overlapping text merged into one passage (see merge_overlapping_text).
+"""
+
+import logging
+import uuid
+from typing import List, Dict, Any, Optional, Tuple, Mapping, Sequence
+
+import numpy as np
+
+from .chunk_store import ChunkStore
+from .keyword_index import KeywordIndex
+from .vector_index import VectorIndex, normalize_rows
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Rows per block when summing chunk embeddings into document centroids
+CENTROID_BLOCK = 65536
+
+# Shortest suffix/prefix match accepted as the overlap of two adjacent chunks, and the longest
+# one searched when the chunk offsets are unknown (twice the scraper's DEFAULT_OVERLAP)
+MIN_MERGE_OVERLAP = 20
+MAX_MERGE_OVERLAP = 400
+
+
+def document_id(chunk_id: str, doc_id: Optional[str] = None, url: Optional[str] = None) -> str:
+    """Document of a chunk: its doc_id, else the uuid5 of its URL (as the scraper derives it), else the chunk itself."""
+    if doc_id:
+        return doc_id
+    if url:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, url))
+    return chunk_id
+
+
+def chunk_document_id(chunk: Mapping[str, Any]) -> str:
+    """Document id of a chunk dictionary."""
+    metadata = chunk.get('metadata') or {}
+    return document_id(chunk.get('id'), metadata.get('doc_id'), metadata.get('url') or chunk.get('url'))
+
+
+def segment_document_ids(chunks: Sequence[Mapping[str, Any]]) -> List[str]:
+    """Document id of every chunk of a segment; interned columns of a ChunkStore, so no chunk is decompressed."""
+    if isinstance(chunks, ChunkStore):
+        return [document_id(chunk_id, doc_id, url) for chunk_id, doc_id, url in
+                zip(chunks.ids, chunks.field_values('metadata', 'doc_id'), chunks.field_values('metadata', 'url'))]
+    return [chunk_document_id(chunk) for chunk in chunks]
+
+
+def merge_overlapping_text(first: str, second: str, max_overlap: int) -> str:
+    """
+    Join two adjacent chunks of a page, dropping the text they share.
+
+    The longest suffix of first that is a prefix of second (at most
+    max_overlap characters, at least MIN_MERGE_OVERLAP) is kept once; without
+    such an overlap the chunks are joined with a space.
+    """
+    for size in range(min(max_overlap, len(first), len(second)), MIN_MERGE_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first} {second}"
+
+
+class DocumentIndex:
+    """Document centroids, lengths and row groupings over the chunks of one segment."""
+
+    def __init__(self, doc_ids: List[str], vector_docs: np.ndarray, keyword_docs: np.ndarray,
+                 centroids: np.ndarray, doc_lengths: np.ndarray):
+        """
+        Args:
+            doc_ids: Id of each document number
+            vector_docs: Document number of each vector index row
+            keyword_docs: Document number of each keyword index row
+            centroids: float32 [documents x dim] normalized centroid embeddings
+            doc_lengths: Summed BM25 length of each document
+        """
+        self.doc_ids = doc_ids
+        self.vector_docs = vector_docs
+        self.keyword_docs = keyword_docs
+        self.centroids = centroids
+        self.doc_lengths = doc_lengths
+
+        self._vector_order = np.argsort(vector_docs, kind='stable')
+        self._vector_offsets = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(vector_docs, minlength=len(doc_ids)), out=self._vector_offsets[1:])
+
+    @classmethod
+    def from_segment(cls, chunks: Sequence[Mapping[str, Any]], row_by_id: Dict[str, int],
+                     vector_index: VectorIndex, keyword_index: KeywordIndex) -> 'DocumentIndex':
+        """Group the chunks of a segment into documents and build their centroids and lengths."""
+        per_row = segment_document_ids(chunks)
+
+        numbering: Dict[str, int] = {}
+        chunk_docs = np.fromiter((numbering.setdefault(doc, len(numbering)) for doc in per_row),
+                                 dtype=np.int64, count=len(per_row))
+        vector_docs = np.fromiter((chunk_docs[row_by_id[chunk_id]] for chunk_id in vector_index.ids),
+                                  dtype=np.int64, count=len(vector_index.ids))
+        keyword_docs = np.fromiter((chunk_docs[row_by_id[chunk_id]] for chunk_id in keyword_index.ids),
+                                   dtype=np.int64, count=len(keyword_index.ids))
+
+        centroids = np.zeros((len(numbering), vector_index.dimension), dtype=np.float32)
+        for start in range(0, len(vector_index), CENTROID_BLOCK):
+            np.add.at(centroids, vector_docs[start:start + CENTROID_BLOCK],
+                      vector_index.matrix[start:start + CENTROID_BLOCK])
+        normalize_rows(centroids)
+        doc_lengths = np.bincount(keyword_docs, weights=np.asarray(keyword_index.doc_lengths, dtype=np.float64),
+                                  minlength=len(numbering))
+
+        logger.info(f"Built document index with {len(numbering)} documents over {len(per_row)} chunks")
+        return cls(list(numbering), vector_docs, keyword_docs, centroids, doc_lengths)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def document_scores(self, queries: np.ndarray) -> np.ndarray:
+        """Best centroid similarity of every document over normalized query variants [m x dim]."""
+        return (self.centroids @ queries.T).max(axis=1)
+
+    def document_matches(self, matches: Dict[str, Dict[int, Tuple[int, int]]]) -> Dict[str, Dict[int, Tuple[int, int]]]:
+        """Sum KeywordIndex.match() frequencies of the chunks of each document: keyword -> {document: (content, title)}."""
+        documents = {}
+        for keyword, keyword_matches in matches.items():
+            totals: Dict[int, Tuple[int, int]] = {}
+            for row, (content_tf, title_tf) in keyword_matches.items():
+                doc = int(self.keyword_docs[row])
+                content_total, title_total = totals.get(doc, (0, 0))
+                totals[doc] = (content_total + content_tf, title_total + title_tf)
+            documents[keyword] = totals
+        return documents
+
+    def vector_rows(self, docs: Sequence[int]) -> np.ndarray:
+        """Sorted vector rows of the chunks of the given documents."""
+        parts = [self._vector_order[self._vector_offsets[doc]:self._vector_offsets[doc + 1]] for doc in docs]
+        return np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+    def memory_usage(self) -> int:
+        """Approximate bytes of the arrays (document id strings are not counted)."""
+        return int(self.vector_docs.nbytes + self.keyword_docs.nbytes + self.centroids.nbytes
+                   + self.doc_lengths.nbytes + self._vector_order.nbytes + self._vector_offsets.nbytes)
+
+
+class DocumentChunkOrder:
+    """Chunk rows of each document in page order, for fetching the neighbors of a chunk."""
+
+    def __init__(self, order: np.ndarray, positions: np.ndarray, chunk_docs: np.ndarray,
+                 starts: np.ndarray, ends: np.ndarray):
+        """
+        Args:
+            order: Chunk rows grouped by document, each group sorted by start offset
+            positions: Index of each chunk row in order
+            chunk_docs: Document number of each chunk row
+            starts: Start offset of each chunk row in its page (-1 if unknown)
+            ends: End offset of each chunk row in its page (-1 if unknown)
+        """
+        self.order = order
+        self.positions = positions
+        self.chunk_docs = chunk_docs
+        self.starts = starts
+        self.ends = ends
+
+    @classmethod
+    def from_segment(cls, chunks: Sequence[Mapping[str, Any]]) -> 'DocumentChunkOrder':
+        """Order the chunks of a segment by document and start offset (row order where the offset is unknown)."""
+        numbering: Dict[str, int] = {}
+        chunk_docs = np.fromiter((numbering.setdefault(doc, len(numbering)) for doc in segment_document_ids(chunks)),
+                                 dtype=np.int64, count=len(chunks))
+        if isinstance(chunks, ChunkStore):
+            starts = np.asarray(chunks.integer_values('metadata', 'start_char'), dtype=np.int64)
+            ends = np.asarray(chunks.integer_values('metadata', 'end_char'), dtype=np.int64)
+        else:
+            offsets = [((chunk.get('metadata') or {}).get('start_char'), (chunk.get('metadata') or {}).get('end_char'))
+                       for chunk in chunks]
+            starts = np.fromiter((start if isinstance(start, int) else -1 for start, _ in offsets),
+                                 dtype=np.int64, count=len(offsets))
+            ends = np.fromiter((end if isinstance(end, int) else -1 for _, end in offsets),
+                               dtype=np.int64, count=len(offsets))
+        order = np.lexsort((starts, chunk_docs))
+        positions = np.empty_like(order)
+        positions[order] = np.arange(order.shape[0])
+        return cls(order, positions, chunk_docs, starts, ends)
+
+    def neighbors(self, row: int, before: int = 1, after: int = 1) -> List[int]:
+        """Rows of up to `before` preceding and `after` following chunks of the same document, plus the row, in page order."""
+        position = int(self.positions[row])
+        doc = self.chunk_docs[row]
+        first = position
+        while first > 0 and position - first < before and self.chunk_docs[self.order[first - 1]] == doc:
+            first -= 1
+        last = position
+        while last + 1 < self.order.shape[0] and last - position < after and self.chunk_docs[self.order[last + 1]] == doc:
+            last += 1
+        return self.order[first:last + 1].tolist()
+
+    def max_overlap(self, row: int, next_row: int) -> int:
+        """Upper bound of the characters two adjacent rows share, from their offsets (MAX_MERGE_OVERLAP if unknown)."""
+        if self.ends[row] < 0 or self.starts[next_row] < 0:
+            return MAX_MERGE_OVERLAP
+        return max(int(self.ends[row] - self.starts[next_row]), 0)
+
+    def memory_usage(self) -> int:
+        """Approximate bytes of the arrays."""
+        return int(self.order.nbytes + self.positions.nbytes + self.chunk_docs.nbytes + self.starts.nbytes + self.ends.nbytes)
@@ -0,0 +1,163 @@
+# eidbi-query-system/backend/app/services/embedding_batcher.py
+
+"""
+Micro-batching of query embeddings across concurrent requests.
+
+Every /query embeds up to three short texts, and each of them used to be its
+own model round trip although the API takes MAX_BATCH_SIZE texts per call.
+The batcher collects the texts requested by all coroutines for at most
+EMBEDDING_BATCH_MAX_WAIT_MS, sends them as one batch once it is full or the
+wait is over, and hands every waiter its own embedding. Under load batches
+fill up before the wait ends, so throughput per quota unit rises while a
+single request never waits longer than the bound.
+
+A text that is already queued or being embedded is not sent again; its
+waiters share the pending result. Recently embedded texts are kept in a small
+in-process LRU map in front of the persistent embedding cache.
+
+All state is touched from the event loop only, so no locks are needed; the
+blocking generator runs in a worker thread.
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Texts per dispatched batch (the embedding API's batch limit)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "5"))
+# Longest time a text waits for its batch to fill before it is sent anyway
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+# Batches in flight at once; further texts queue up and form fuller batches
+EMBEDDING_BATCH_CONCURRENCY = int(os.getenv("EMBEDDING_BATCH_CONCURRENCY", "4"))
+
+EmbeddingGenerator = Callable[[List[str]], Optional[List[Optional[List[float]]]]]
+
+
+class EmbeddingBatcher:
+    """Coalesces embedding requests of concurrent coroutines into full batches."""
+
+    def __init__(self,
+                 generate: EmbeddingGenerator,
+                 max_batch_size: int = EMBEDDING_BATCH_SIZE,
+                 max_wait_ms: float = EMBEDDING_BATCH_MAX_WAIT_MS,
+                 max_concurrency: int = EMBEDDING_BATCH_CONCURRENCY,
+                 cache_size: int = 0):
+        """
+        Args:
+            generate: Blocking function embedding a list of texts, e.g. embedding_service.generate_embeddings
+            max_batch_size: Texts per call of generate
+            max_wait_ms: Longest time a text waits for its batch to fill
+            max_concurrency: Calls of generate running at once
+            cache_size: Embeddings kept in the in-process LRU map (0 disables it)
+        """
+        self._generate = generate
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_concurrency = max(1, max_concurrency)
+        self.cache_size = max(0, cache_size)
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._pending: List[str] = []
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._stats = {"requests": 0, "cache_hits": 0, "coalesced": 0, "batches": 0, "texts_sent": 0, "failures": 0}
+
+    async def embed(self, text: str) -> Optional[List[float]]:
+        """Embedding of one text (None if it failed)."""
+        return (await self.embed_many([text]))[0]
+
+    async def embed_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Embeddings of the texts, batched together with the texts of concurrent callers.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            Embeddings in the order of texts; None where a text is empty or failed
+        """
+        loop = asyncio.get_running_loop()
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        waiting: List[Tuple[int, asyncio.Future]] = []
+        for index, text in enumerate(texts):
+            if not isinstance(text, str) or not text.strip():
+                continue
+            self._stats["requests"] += 1
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                self._stats["cache_hits"] += 1
+                results[index] = cached
+                continue
+            future = self._futures.get(text)
+            if future is not None:
+                self._stats["coalesced"] += 1
+            else:
+                future = self._futures[text] = loop.create_future()
+                self._enqueue(loop, text)
+            waiting.append((index, future))
+
+        for index, future in waiting:
+            # shield: one cancelled request must not fail the others waiting on the text
+            results[index] = await asyncio.shield(future)
+        return results
+
+    def _enqueue(self, loop: asyncio.AbstractEventLoop, text: str) -> None:
+        self._pending.append(text)
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            asyncio.ensure_future(self._dispatch(batch))
+
+    async def _dispatch(self, batch: List[str]) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        embeddings: Optional[List[Optional[List[float]]]] = None
+        async with self._semaphore:
+            self._stats["batches"] += 1
+            self._stats["texts_sent"] += len(batch)
+            try:
+                embeddings = await asyncio.to_thread(self._generate, batch)
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(batch)} texts failed: {e}", exc_info=True)
+        if embeddings is None or len(embeddings) != len(batch):
+            self._stats["failures"] += 1
+            embeddings = [None] * len(batch)
+
+        for text, embedding in zip(batch, embeddings):
+            if embedding is not None and self.cache_size:
+                self._cache[text] = embedding
+                self._cache.move_to_end(text)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            future = self._futures.pop(text, None)
+            if future is not None and not future.done():
+                future.set_result(embedding)
+
+    def clear_cache(self) -> None:
+        """Drop the in-process embeddings (queued and in-flight texts are unaffected)."""
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters of requests, cache hits, coalesced texts and dispatched batches."""
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["cache_size"] = len(self._cache)
+        stats["cache_max_size"] = self.cache_size
+        stats["average_batch_size"] = stats["texts_sent"] / stats["batches"] if stats["batches"] else 0.0
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_wait_ms"] = self.max_wait * 1000.0
+        return stats
@@ -0,0 +1,263 @@
+# eidbi-query-system/backend/app/services/embedding_cache.py
+
+"""
+Persistent embedding cache shared by processes and restarts.
+
+Embeddings are stored in one SQLite file as float32 blobs, keyed by the
+SHA-256 of the model name and the normalized text, so every uvicorn worker,
+every backend instance on the host and the scraper reuse each other's
+embeddings. WAL journaling lets readers proceed while another process
+writes.
+
+The cache is bounded: past EMBEDDING_CACHE_MAX_ENTRIES rows the least
+recently used ones are evicted. Hit, miss and eviction counters are kept
+in the same file, so they add up over all processes.
+
+Only embeddings of a real model are cached; mock embeddings are cheap and
+deterministic anyway.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import List, Dict, Any, Optional, Callable, Sequence
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+ENABLE_PERSISTENT_EMBEDDING_CACHE = os.getenv("ENABLE_PERSISTENT_EMBEDDING_CACHE", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'embedding_cache.sqlite3')
+)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# Share of max_entries evicted at once, so eviction does not run on every insert
+EVICTION_FRACTION = 0.05
+# Seconds a writer waits for another process's write lock
+SQLITE_TIMEOUT = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    dimension INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+EmbeddingGenerator = Callable[[List[str]], Optional[List[Optional[List[float]]]]]
+
+
+def normalize_text(text: str) -> str:
+    """Text as it is keyed: Unicode NFC with whitespace runs collapsed and the ends stripped."""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    """Cache key of a text embedded by a model."""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Size-bounded LRU cache of embeddings in a SQLite file."""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        """
+        Args:
+            path: SQLite file, created if missing
+            max_entries: Number of embeddings kept before the least recently used are evicted
+        """
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection must not cross a fork, so forked workers open their own
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, check_same_thread=False,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _count(self, connection: sqlite3.Connection, hits: int, misses: int, evictions: int = 0) -> None:
+        connection.executemany(
+            "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            [(name, value) for name, value in (('hits', hits), ('misses', misses), ('evictions', evictions)) if value]
+        )
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Cached embeddings of the texts (None where missing); hits are marked as recently used."""
+        keys = [cache_key(model, text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            connection = self._connect()
+            unique = list(dict.fromkeys(keys))
+            # Bounded IN lists (SQLite limits host parameters per statement)
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+            hits = sum(1 for key in keys if key in found)
+            connection.execute("BEGIN")
+            try:
+                if found:
+                    now = time.time()
+                    connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                           [(now, key) for key in found])
+                self._count(connection, hits, len(keys) - hits)
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model: str, texts: Sequence[str], embeddings: Sequence[Optional[Sequence[float]]]) -> None:
+        """Store embeddings (None entries are skipped) and evict the least recently used past max_entries."""
+        now = time.time()
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            if embedding is None:
+                continue
+            vector = np.asarray(embedding, dtype=np.float32)
+            rows.append((cache_key(model, text), model, int(vector.shape[0]), vector.tobytes(), now))
+        if not rows:
+            return
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, dimension, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                excess = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    evicted = connection.execute(
+                        "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                        (excess + int(self.max_entries * EVICTION_FRACTION),)
+                    ).rowcount
+                    self._count(connection, 0, 0, evicted)
+                    logger.info(f"Evicted {evicted} least recently used embeddings from {self.path}")
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+    def get_or_generate(self, model: str, texts: List[str], generate: EmbeddingGenerator) -> Optional[List[Optional[List[float]]]]:
+        """
+        Embeddings of the texts, generating and storing only the ones not cached yet.
+
+        Texts that are not non-empty strings get None without reaching the generator;
+        texts that normalize to the same key are generated once.
+
+        Args:
+            model: Name of the model the generator uses
+            texts: Texts to embed
+            generate: Embeds a list of texts, e.g. embedding_service.generate_embeddings
+
+        Returns:
+            Embeddings in the order of texts, or None if the generator failed completely
+        """
+        valid = [index for index, text in enumerate(texts) if isinstance(text, str) and text.strip()]
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        try:
+            for index, embedding in zip(valid, self.get_many(model, [texts[index] for index in valid])):
+                embeddings[index] = embedding
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache lookup failed ({self.path}): {e}")
+
+        missing = [index for index in valid if embeddings[index] is None]
+        if not missing:
+            return embeddings
+        distinct: Dict[str, int] = {}
+        for index in missing:
+            distinct.setdefault(normalize_text(texts[index]), index)
+        to_generate = [texts[index] for index in distinct.values()]
+        generated = generate(to_generate)
+        if generated is None:
+            return None
+
+        by_text = dict(zip(distinct, generated))
+        for index in missing:
+            embeddings[index] = by_text.get(normalize_text(texts[index]))
+        try:
+            self.put_many(model, to_generate, generated)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache update failed ({self.path}): {e}")
+        return embeddings
+
+    def stats(self) -> Dict[str, Any]:
+        """Entries, file size and hit/miss counters (this process and all processes)."""
+        with self._lock:
+            connection = self._connect()
+            entries = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            counters = dict(connection.execute("SELECT name, value FROM counters").fetchall())
+            page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+            page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        total_hits, total_misses = counters.get('hits', 0), counters.get('misses', 0)
+        lookups = total_hits + total_misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "size_bytes": page_count * page_size,
+            "hits": total_hits,
+            "misses": total_misses,
+            "evictions": counters.get('evictions', 0),
+            "hit_rate": total_hits / lookups if lookups else 0.0,
+            "process_hits": self.hits,
+            "process_misses": self.misses
+        }
+
+    def clear(self) -> None:
+        """Remove every embedding and reset the counters."""
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM embeddings")
+            connection.execute("DELETE FROM counters")
+            self.hits = self.misses = 0
+        logger.info(f"Cleared embedding cache {self.path}")
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """The process-wide cache, or None if disabled (ENABLE_PERSISTENT_EMBEDDING_CACHE=false)."""
+    global _cache
+    if not ENABLE_PERSISTENT_EMBEDDING_CACHE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+            logger.info(f"Using persistent embedding cache at {_cache.path} (max {_cache.max_entries} entries)")
+        return _cache
@@ -3,10 +3,14 @@
 import logging
 import time
 import os
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional, Iterator, Tuple
 import hashlib
 import numpy as np
 
+from .embedding_cache import get_embedding_cache, normalize_text
+from .local_embedding import generate_local_embeddings
+
 # Try to import Vertex AI, but don't fail if not available
 try:
     import vertexai
@@ -19,7 +23,7 @@ try:
 except ImportError:
     VERTEX_AI_AVAILABLE = False
     logger = logging.getLogger(__name__)
-    logger.warning("Vertex AI libraries not available. Will use mock embeddings.")
+    logger.warning("Vertex AI libraries not available. Will use local or mock embeddings.")
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -28,6 +32,8 @@ logger = logging.getLogger(__name__)
 MODEL_NAME = "textembedding-gecko@003"  # Latest model for text embeddings
 MAX_BATCH_SIZE = 5  # Vertex AI batch size limit
 EMBEDDING_DIMENSION = 768  # Default dimension for gecko model
+# API calls in flight at once when streaming bulk embeddings
+EMBEDDING_PARALLEL_BATCHES = int(os.getenv("EMBEDDING_PARALLEL_BATCHES", "4"))
 
 # Get project configuration from environment
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "lyrical-ward-454915-e6")
@@ -36,9 +42,16 @@ LOCATION = os.getenv("GCP_REGION", "us-central1")
 # Allow fallback to mock embeddings
 USE_MOCK_EMBEDDINGS = os.getenv("USE_MOCK_EMBEDDINGS", "false").lower() == "true"
 
+# Embedding backend: "vertex" (Vertex AI), "local" (CPU hashed n-grams, see local_embedding)
+# or "mock" (hash of the whole text); USE_MOCK_EMBEDDINGS=true selects "mock"
+EMBEDDING_BACKEND = "mock" if USE_MOCK_EMBEDDINGS else os.getenv("EMBEDDING_BACKEND", "vertex").lower()
+# Backend used when Vertex AI is unavailable or fails: "local" or "mock"
+EMBEDDING_FALLBACK_BACKEND = os.getenv("EMBEDDING_FALLBACK_BACKEND", "local").lower()
+
 # Global model instance
 _embedding_model = None
-_use_mock = False  # Track whether we're using mock embeddings
+_use_mock = False  # Track whether we're using a non-Vertex backend (local or mock embeddings)
+_offline_backend = EMBEDDING_FALLBACK_BACKEND  # Which one, while _use_mock is set
 
 def generate_mock_embedding(text: str) -> List[float]:
     """Generate a deterministic mock embedding for testing."""
@@ -85,22 +98,27 @@ def check_authentication():
 def initialize_vertex_ai() -> bool:
     """
     Initialize Vertex AI and load the embedding model.
-    Falls back to mock embeddings if configured or if Vertex AI fails.
+    Uses the local or mock backend if configured (EMBEDDING_BACKEND), and falls
+    back to EMBEDDING_FALLBACK_BACKEND if Vertex AI fails.
     
     Returns:
         bool: True if initialization is successful, False otherwise.
     """
-    global _embedding_model, _use_mock
+    global _embedding_model, _use_mock, _offline_backend
     
-    # If explicitly configured to use mock embeddings
-    if USE_MOCK_EMBEDDINGS:
-        logger.info("Configured to use mock embeddings (USE_MOCK_EMBEDDINGS=true)")
+    # If explicitly configured to use local or mock embeddings
+    if EMBEDDING_BACKEND in ("local", "mock"):
+        logger.info(f"Configured to use {EMBEDDING_BACKEND} embeddings (EMBEDDING_BACKEND={EMBEDDING_BACKEND})")
         _use_mock = True
+        _offline_backend = EMBEDDING_BACKEND
         return True
     
+    # Vertex AI failures below fall back to this backend
+    _offline_backend = EMBEDDING_FALLBACK_BACKEND
+    
     # If Vertex AI is not available
     if not VERTEX_AI_AVAILABLE:
-        logger.warning("Vertex AI not available. Using mock embeddings.")
+        logger.warning(f"Vertex AI not available. Using {_offline_backend} embeddings.")
         _use_mock = True
         return True
     
@@ -108,7 +126,7 @@ def initialize_vertex_ai() -> bool:
         # Check authentication first
         if not check_authentication():
             logger.error("Cannot initialize Vertex AI without valid authentication")
-            logger.info("Falling back to mock embeddings")
+            logger.info(f"Falling back to {_offline_backend} embeddings")
             _use_mock = True
             return True
         
@@ -130,14 +148,14 @@ def initialize_vertex_ai() -> bool:
             return True
         except Exception as e:
             logger.error(f"Model test failed: {e}")
-            logger.info("Falling back to mock embeddings")
+            logger.info(f"Falling back to {_offline_backend} embeddings")
             _embedding_model = None
             _use_mock = True
             return True
         
     except Exception as e:
         logger.error(f"Failed to initialize Vertex AI: {e}", exc_info=True)
-        logger.info("Falling back to mock embeddings")
+        logger.info(f"Falling back to {_offline_backend} embeddings")
         _embedding_model = None
         _use_mock = True
         return True
@@ -170,10 +188,87 @@ if VERTEX_AI_AVAILABLE:
         embeddings = _embedding_model.get_embeddings(texts)
         return [embedding.values for embedding in embeddings]
 
+def _generate_model_embeddings(texts: List[str]) -> List[Optional[List[float]]]:
+    """Embed texts with the loaded model in API-sized batches; texts of a failed batch get None."""
+    logger.info(f"Generating embeddings for {len(texts)} texts using {MODEL_NAME}")
+
+    # Process in batches to respect API limits
+    all_embeddings = []
+
+    for i in range(0, len(texts), MAX_BATCH_SIZE):
+        batch = texts[i:i + MAX_BATCH_SIZE]
+
+        try:
+            # Clean and validate batch texts
+            cleaned_batch = []
+            batch_indices = []
+
+            for j, text in enumerate(batch):
+                if text and isinstance(text, str) and text.strip():
+                    # Truncate very long texts (API limit is ~10k tokens)
+                    truncated = text[:8000] if len(text) > 8000 else text
+                    cleaned_batch.append(truncated)
+                    batch_indices.append(i + j)
+                else:
+                    logger.warning(f"Invalid text at index {i + j}, skipping")
+                    all_embeddings.append(None)
+
+            if cleaned_batch:
+                # Call the API with retry logic
+                batch_embeddings = _call_embedding_api(cleaned_batch)
+
+                # Map embeddings back to original positions
+                embedding_map = {idx: emb for idx, emb in zip(batch_indices, batch_embeddings)}
+
+                for j in range(len(batch)):
+                    if (i + j) in embedding_map:
+                        all_embeddings.append(embedding_map[i + j])
+                    elif (i + j) < len(all_embeddings):
+                        # Already added None for invalid text
+                        pass
+                    else:
+                        all_embeddings.append(None)
+
+                logger.debug(f"Processed batch {i//MAX_BATCH_SIZE + 1}/{(len(texts)-1)//MAX_BATCH_SIZE + 1}")
+
+                # Small delay between batches to avoid rate limiting
+                if i + MAX_BATCH_SIZE < len(texts):
+                    time.sleep(0.1)
+
+        except Exception as e:
+            logger.error(f"Error processing batch starting at index {i}: {e}")
+            # Add None for all texts in the failed batch
+            for j in range(len(batch)):
+                if len(all_embeddings) <= i + j:
+                    all_embeddings.append(None)
+
+    successful_count = sum(1 for emb in all_embeddings if emb is not None)
+    logger.info(f"Successfully generated {successful_count}/{len(texts)} embeddings")
+
+    return all_embeddings
+
+def _generate_offline_embeddings(texts: List[str], backend: Optional[str] = None) -> List[Optional[List[float]]]:
+    """Embed texts without Vertex AI, with the local backend or mock embeddings (default: the active one)."""
+    backend = backend or _offline_backend
+    logger.info(f"Generating {backend} embeddings for {len(texts)} texts")
+    if backend == "local":
+        return generate_local_embeddings(texts)
+    embeddings = []
+    for text in texts:
+        if text and isinstance(text, str) and text.strip():
+            embeddings.append(generate_mock_embedding(text))
+        else:
+            embeddings.append(None)
+    return embeddings
+
 def generate_embeddings(texts: List[str]) -> Optional[List[Optional[List[float]]]]:
     """
     Generate embeddings for the given texts using Vertex AI's text embedding model.
-    Falls back to mock embeddings if Vertex AI is not available or fails.
+    Uses the local or mock backend instead if configured, or if Vertex AI is not
+    available or fails (EMBEDDING_FALLBACK_BACKEND).
+    
+    Model embeddings are read from and added to the persistent embedding cache
+    (see embedding_cache), so only texts never embedded before reach the API.
     
     Args:
         texts: List of text strings to generate embeddings for.
@@ -187,16 +282,9 @@ def generate_embeddings(texts: List[str]) -> Optional[List[Optional[List[float]]
         logger.warning("Empty text list provided for embedding generation")
         return []
     
-    # Use mock embeddings if configured or fallback
+    # Use local or mock embeddings if configured or fallback
     if _use_mock:
-        logger.info(f"Generating mock embeddings for {len(texts)} texts")
-        embeddings = []
-        for text in texts:
-            if text and isinstance(text, str) and text.strip():
-                embeddings.append(generate_mock_embedding(text))
-            else:
-                embeddings.append(None)
-        return embeddings
+        return _generate_offline_embeddings(texts)
     
     # Try to use real Vertex AI embeddings
     if not _embedding_model:
@@ -206,74 +294,102 @@ def generate_embeddings(texts: List[str]) -> Optional[List[Optional[List[float]]
             return None
     
     try:
-        logger.info(f"Generating embeddings for {len(texts)} texts using {MODEL_NAME}")
-        
-        # Process in batches to respect API limits
-        all_embeddings = []
-        
-        for i in range(0, len(texts), MAX_BATCH_SIZE):
-            batch = texts[i:i + MAX_BATCH_SIZE]
-            
-            try:
-                # Clean and validate batch texts
-                cleaned_batch = []
-                batch_indices = []
-                
-                for j, text in enumerate(batch):
-                    if text and isinstance(text, str) and text.strip():
-                        # Truncate very long texts (API limit is ~10k tokens)
-                        truncated = text[:8000] if len(text) > 8000 else text
-                        cleaned_batch.append(truncated)
-                        batch_indices.append(i + j)
-                    else:
-                        logger.warning(f"Invalid text at index {i + j}, skipping")
-                        all_embeddings.append(None)
-                
-                if cleaned_batch:
-                    # Call the API with retry logic
-                    batch_embeddings = _call_embedding_api(cleaned_batch)
-                    
-                    # Map embeddings back to original positions
-                    embedding_map = {idx: emb for idx, emb in zip(batch_indices, batch_embeddings)}
-                    
-                    for j in range(len(batch)):
-                        if (i + j) in embedding_map:
-                            all_embeddings.append(embedding_map[i + j])
-                        elif (i + j) < len(all_embeddings):
-                            # Already added None for invalid text
-                            pass
-                        else:
-                            all_embeddings.append(None)
-                    
-                    logger.debug(f"Processed batch {i//MAX_BATCH_SIZE + 1}/{(len(texts)-1)//MAX_BATCH_SIZE + 1}")
-                    
-                    # Small delay between batches to avoid rate limiting
-                    if i + MAX_BATCH_SIZE < len(texts):
-                        time.sleep(0.1)
-                
-            except Exception as e:
-                logger.error(f"Error processing batch starting at index {i}: {e}")
-                # Add None for all texts in the failed batch
-                for j in range(len(batch)):
-                    if len(all_embeddings) <= i + j:
-                        all_embeddings.append(None)
-        
-        successful_count = sum(1 for emb in all_embeddings if emb is not None)
-        logger.info(f"Successfully generated {successful_count}/{len(texts)} embeddings")
-        
-        return all_embeddings
+        cache = get_embedding_cache()
+        if cache is not None:
+            return cache.get_or_generate(MODEL_NAME, texts, _generate_model_embeddings)
+        return _generate_model_embeddings(texts)
     
     except Exception as e:
         logger.error(f"Critical error generating embeddings: {e}", exc_info=True)
-        # Fall back to mock embeddings
-        logger.info("Falling back to mock embeddings due to error")
-        embeddings = []
-        for text in texts:
-            if text and isinstance(text, str) and text.strip():
-                embeddings.append(generate_mock_embedding(text))
-            else:
-                embeddings.append(None)
-        return embeddings
+        # Fall back to local or mock embeddings
+        logger.info(f"Falling back to {EMBEDDING_FALLBACK_BACKEND} embeddings due to error")
+        return _generate_offline_embeddings(texts, EMBEDDING_FALLBACK_BACKEND)
+
+def stream_embeddings(texts: List[str], parallel_batches: int = EMBEDDING_PARALLEL_BATCHES) -> Iterator[Tuple[List[int], List[Optional[List[float]]]]]:
+    """
+    Embed many texts, yielding results as soon as they are available.
+
+    Cached embeddings are yielded first. The remaining texts are deduplicated
+    and sent in MAX_BATCH_SIZE batches, parallel_batches API calls at a time.
+    Each batch is written to the persistent cache and yielded as it completes,
+    so callers can stream results out while later batches are in flight.
+
+    Args:
+        texts: List of text strings to generate embeddings for.
+        parallel_batches: API calls in flight at once
+
+    Yields:
+        (indices, embeddings) pairs covering every index of texts exactly once;
+        an embedding is None where its text is invalid or failed.
+    """
+    if not texts:
+        return
+
+    if not _use_mock and not _embedding_model:
+        # Try to initialize on demand
+        if not initialize_vertex_ai():
+            logger.error("Failed to initialize Vertex AI")
+            yield list(range(len(texts))), [None] * len(texts)
+            return
+
+    if _use_mock:
+        # Local and mock embeddings are cheap; yield them in blocks of 256 so large inputs still stream
+        for start in range(0, len(texts), 256):
+            block = texts[start:start + 256]
+            yield list(range(start, start + len(block))), _generate_offline_embeddings(block)
+        return
+
+    valid = [index for index, text in enumerate(texts) if isinstance(text, str) and text.strip()]
+    valid_set = set(valid)
+    invalid = [index for index in range(len(texts)) if index not in valid_set]
+    if invalid:
+        yield invalid, [None] * len(invalid)
+
+    cache = get_embedding_cache()
+    missing = valid
+    if cache is not None and valid:
+        try:
+            cached = cache.get_many(MODEL_NAME, [texts[index] for index in valid])
+            hits = [(index, embedding) for index, embedding in zip(valid, cached) if embedding is not None]
+            if hits:
+                yield [index for index, _ in hits], [embedding for _, embedding in hits]
+            missing = [index for index, embedding in zip(valid, cached) if embedding is None]
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+    if not missing:
+        return
+
+    # Texts that normalize alike are embedded once
+    groups: Dict[str, List[int]] = {}
+    for index in missing:
+        groups.setdefault(normalize_text(texts[index]), []).append(index)
+    distinct = [indices[0] for indices in groups.values()]
+    batches = [distinct[i:i + MAX_BATCH_SIZE] for i in range(0, len(distinct), MAX_BATCH_SIZE)]
+    logger.info(f"Embedding {len(distinct)} uncached texts ({len(missing)} requested) in {len(batches)} batches, "
+                f"{parallel_batches} at a time")
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel_batches)) as executor:
+        futures = {executor.submit(_generate_model_embeddings, [texts[index] for index in batch]): batch
+                   for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                embeddings = future.result()
+            except Exception as e:
+                logger.error(f"Error embedding batch of {len(batch)} texts: {e}")
+                embeddings = [None] * len(batch)
+            if cache is not None:
+                try:
+                    cache.put_many(MODEL_NAME, [texts[index] for index in batch], embeddings)
+                except Exception as e:
+                    logger.warning(f"Embedding cache update failed: {e}")
+            indices = []
+            results = []
+            for index, embedding in zip(batch, embeddings):
+                for duplicate in groups[normalize_text(texts[index])]:
+                    indices.append(duplicate)
+                    results.append(embedding)
+            yield indices, results
 
 # --- Example Usage ---
 if __name__ == '__main__':
@@ -281,7 +397,7 @@ if __name__ == '__main__':
 
     print(f"Using Project: {PROJECT_ID}, Location: {LOCATION}")
     print(f"Vertex AI Available: {VERTEX_AI_AVAILABLE}")
-    print(f"Use Mock Embeddings: {USE_MOCK_EMBEDDINGS}")
+    print(f"Embedding Backend: {EMBEDDING_BACKEND} (fallback: {EMBEDDING_FALLBACK_BACKEND})")
 
     # Initialize once
     if initialize_vertex_ai():
@@ -298,7 +414,7 @@ if __name__ == '__main__':
 
         if generated_embeddings:
             print(f"\nSuccessfully generated {len(generated_embeddings)} results.")
-            print(f"Using {'mock' if _use_mock else 'real Vertex AI'} embeddings")
+            print(f"Using {_offline_backend if _use_mock else 'real Vertex AI'} embeddings")
             for i, (text, embedding) in enumerate(zip(sample_texts, generated_embeddings)):
                 if embedding:
                     print(f"Text {i+1}: \"{text[:50]}...\" -> Embedding dim: {len(embedding)}, First 3 values: {embedding[:3]}")
@@ -0,0 +1,800 @@
+# eidbi-query-system/backend/app/services/index_snapshot.py
+
+import heapq
+import logging
+import sys
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Iterator, Tuple, FrozenSet, Sequence, Set
+
+import numpy as np
+
+from .corpus_artifact import CorpusArtifact
+from .document_index import DocumentIndex, DocumentChunkOrder, merge_overlapping_text
+from .keyword_index import KeywordIndex, bm25_scores
+from .partition_index import PartitionIndex
+from .vector_store import VectorStore
+from .vector_index import VectorIndex, RRF_K, RRF_DEPTH_FACTOR, fuse_scores, normalize_rows, top_k_indices
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def _object_size(value: Any) -> int:
+    """Approximate heap bytes of plain chunk data (dicts, lists and scalars)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_object_size(key) + _object_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_object_size(item) for item in value)
+    return size
+
+
+class IndexSegment:
+    """
+    Immutable slice of the corpus with its own vector and keyword indexes.
+
+    A snapshot is made of a large base segment (the scraped corpus), the
+    structured-data segment and small delta segments for chunks added or
+    updated since the base was built.
+    """
+
+    def __init__(self, name: str, chunks: Sequence[Dict[str, Any]], vector_index: VectorIndex,
+                 keyword_index: KeywordIndex, artifact: Optional[CorpusArtifact] = None):
+        self.name = name
+        self.chunks = chunks
+        self.vector_index = vector_index
+        self.keyword_index = keyword_index
+        self.artifact = artifact
+
+        # chunk id -> position in chunks (first occurrence wins); artifact-backed
+        # chunks expose their id column so rows need not be materialized
+        ids = getattr(chunks, 'ids', None)
+        if ids is None:
+            ids = [chunk.get('id') for chunk in chunks]
+        self.chunk_ids: Sequence[str] = ids
+        self.row_by_id: Dict[str, int] = {}
+        for row, chunk_id in enumerate(ids):
+            if chunk_id is not None and chunk_id not in self.row_by_id:
+                self.row_by_id[chunk_id] = row
+        self._vector_row_by_id: Optional[Dict[str, int]] = None
+        # Topic and source_type row masks for routed searches
+        self.partitions = PartitionIndex.from_segment(chunks, self.row_by_id, vector_index, keyword_index)
+        self._memory_usage: Optional[Dict[str, Any]] = None
+        self._documents: Optional[DocumentIndex] = None
+        self._chunk_order: Optional[DocumentChunkOrder] = None
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def get_chunk(self, chunk_id: str) -> Optional[Dict[str, Any]]:
+        """Return the chunk with the given id, or None."""
+        row = self.row_by_id.get(chunk_id)
+        return self.chunks[row] if row is not None else None
+
+    def vector_row(self, chunk_id: str) -> Optional[int]:
+        """Vector index row of a chunk id, or None if it has no embedding."""
+        if self._vector_row_by_id is None:
+            self._vector_row_by_id = {chunk_id: row for row, chunk_id in enumerate(self.vector_index.ids)}
+        return self._vector_row_by_id.get(chunk_id)
+
+    def vector_rows(self, chunk_ids: Sequence[str]) -> np.ndarray:
+        """Sorted vector index rows of the given chunk ids (ids without an embedding are skipped)."""
+        if not chunk_ids:
+            return np.empty(0, dtype=np.int64)
+        rows = [row for row in map(self.vector_row, chunk_ids) if row is not None]
+        return np.unique(np.asarray(rows, dtype=np.int64))
+
+    @property
+    def documents(self) -> DocumentIndex:
+        """Document-level index of the segment, built on first use (only hierarchical search needs it)."""
+        if self._documents is None:
+            self._documents = DocumentIndex.from_segment(self.chunks, self.row_by_id, self.vector_index,
+                                                         self.keyword_index)
+        return self._documents
+
+    @property
+    def chunk_order(self) -> DocumentChunkOrder:
+        """Page order of the chunks of each document, built on first use (only context expansion needs it)."""
+        if self._chunk_order is None:
+            self._chunk_order = DocumentChunkOrder.from_segment(self.chunks)
+        return self._chunk_order
+
+    def get_info(self) -> Dict[str, Any]:
+        """Summary of the segment for statistics endpoints."""
+        return {
+            "name": self.name,
+            "chunks": len(self.chunks),
+            "vector_rows": len(self.vector_index),
+            "keyword_terms": len(self.keyword_index.vocabulary),
+            "partitions": self.partitions.counts(),
+            "source": self.artifact.path if self.artifact is not None else "memory"
+        }
+
+    def memory_usage(self) -> Dict[str, Any]:
+        """Approximate bytes per component; computed once since segments are immutable."""
+        if self._memory_usage is None:
+            chunk_usage = getattr(self.chunks, 'memory_usage', None)
+            matrix = self.vector_index.matrix
+            vectors = {
+                ("mapped_bytes" if isinstance(matrix, np.memmap) else "matrix_bytes"): int(matrix.nbytes),
+                "codes_bytes": int(self.vector_index.codes.nbytes) if self.vector_index.codes is not None else 0
+            }
+            ann = self.vector_index.ann
+            if ann is not None:
+                vectors["ann_bytes"] = int(ann.centroids.nbytes + ann.order.nbytes + ann.list_offsets.nbytes)
+            projection = self.vector_index.projection
+            if projection is not None:
+                mapped = isinstance(projection.projected, np.memmap)
+                vectors["projection_mapped_bytes" if mapped else "projection_bytes"] = int(projection.projected.nbytes)
+            self._memory_usage = {
+                "chunks": chunk_usage() if chunk_usage is not None else {"total_bytes": _object_size(list(self.chunks))},
+                "vectors": vectors,
+                "keyword_index_bytes": self.keyword_index.memory_usage(),
+                "id_map_bytes": _object_size(self.row_by_id),
+                "partitions_bytes": self.partitions.memory_usage()
+            }
+        documents_bytes = ((self._documents.memory_usage() if self._documents is not None else 0)
+                           + (self._chunk_order.memory_usage() if self._chunk_order is not None else 0))
+        return dict(self._memory_usage, documents_bytes=documents_bytes)
+
+
+class IndexSnapshot:
+    """
+    Immutable, versioned view of the searchable corpus.
+
+    A snapshot is an ordered list of segments, oldest first, plus a set of
+    deleted chunk ids. A chunk id in a newer segment shadows the same id in
+    older segments, so an update is a new delta segment rather than a rebuild.
+    Searches run over every segment and merge the results.
+
+    A request that holds a snapshot reads one consistent version even while a
+    newer snapshot is being built or published. That includes the vector store
+    holding the base segment's embeddings, which is published with the snapshot.
+    """
+
+    def __init__(self, version: str, segments: List[IndexSegment], deleted: FrozenSet[str] = frozenset(),
+                 vector_store: Optional[VectorStore] = None):
+        self.version = version
+        self.created_at = datetime.now().isoformat()
+        self.segments = segments
+        self.deleted = frozenset(deleted)
+        self.vector_store = vector_store
+
+        # Per segment: ids hidden by a deletion or by a newer segment. Only the
+        # newer (small) segments are walked, so this costs O(delta), not O(corpus).
+        hidden = set(self.deleted)
+        self._masked: List[FrozenSet[str]] = [frozenset()] * len(segments)
+        for position in range(len(segments) - 1, -1, -1):
+            segment = segments[position]
+            self._masked[position] = frozenset(chunk_id for chunk_id in hidden if chunk_id in segment.row_by_id)
+            if position > 0:
+                hidden.update(segment.row_by_id)
+        self._masked_vector_rows = [segment.vector_rows(list(masked))
+                                    for segment, masked in zip(segments, self._masked)]
+
+    def __len__(self) -> int:
+        return sum(len(segment.row_by_id) - len(masked) for segment, masked in zip(self.segments, self._masked))
+
+    def segment(self, name: str) -> Optional[IndexSegment]:
+        """Return the segment with the given name, or None."""
+        for segment in self.segments:
+            if segment.name == name:
+                return segment
+        return None
+
+    def get_chunk(self, chunk_id: str) -> Optional[Dict[str, Any]]:
+        """Return the live version of the chunk with the given id, or None."""
+        if chunk_id in self.deleted:
+            return None
+        for segment in reversed(self.segments):
+            chunk = segment.get_chunk(chunk_id)
+            if chunk is not None:
+                return chunk
+        return None
+
+    def get_embeddings(self, chunk_ids: Sequence[str], dimension: int) -> np.ndarray:
+        """
+        Normalized embeddings of the live versions of the given chunks.
+
+        Returns:
+            float32 [len(chunk_ids) x dimension] matrix; rows of chunks without a
+            local embedding of that dimension are zero
+        """
+        matrix = np.zeros((len(chunk_ids), dimension), dtype=np.float32)
+        for i, chunk_id in enumerate(chunk_ids):
+            if chunk_id in self.deleted:
+                continue
+            for segment in reversed(self.segments):
+                if chunk_id not in segment.row_by_id:
+                    continue
+                row = segment.vector_row(chunk_id)
+                if row is not None and segment.vector_index.dimension == dimension:
+                    matrix[i] = segment.vector_index.matrix[row]
+                break
+        return matrix
+
+    def is_live(self, chunk_id: str, segment: IndexSegment) -> bool:
+        """Whether a segment holds the live version of a chunk in this snapshot."""
+        return chunk_id in segment.row_by_id and chunk_id not in self._masked[self.segments.index(segment)]
+
+    def passage(self, chunk_id: str, before: int = 1, after: int = 1,
+                exclude: Optional[Set[str]] = None) -> Tuple[List[str], str]:
+        """
+        A chunk and its live neighbors in the same document, merged into one passage.
+
+        Neighbors are looked up in the segment holding the live chunk; a hidden or
+        excluded neighbor ends the passage on its side so the text stays contiguous.
+
+        Returns:
+            Tuple of (chunk ids in page order, merged content); ([], '') if the chunk is not live
+        """
+        if chunk_id in self.deleted:
+            return [], ''
+        for position in range(len(self.segments) - 1, -1, -1):
+            segment = self.segments[position]
+            row = segment.row_by_id.get(chunk_id)
+            if row is None:
+                continue
+            masked = self._masked[position]
+            if chunk_id in masked:
+                return [], ''
+            stop = masked | exclude if exclude else masked
+            order = segment.chunk_order
+            rows = order.neighbors(row, before, after)
+            center = rows.index(row)
+            first, last = center, center
+            while first > 0 and segment.chunk_ids[rows[first - 1]] not in stop:
+                first -= 1
+            while last + 1 < len(rows) and segment.chunk_ids[rows[last + 1]] not in stop:
+                last += 1
+            rows = rows[first:last + 1]
+            content = segment.chunks[rows[0]].get('content', '')
+            for previous, current in zip(rows, rows[1:]):
+                content = merge_overlapping_text(content, segment.chunks[current].get('content', ''),
+                                                 order.max_overlap(previous, current))
+            return [segment.chunk_ids[current] for current in rows], content
+        return [], ''
+
+    def matches_filters(self, chunk_id: str, filters: Optional[Dict[str, Any]]) -> bool:
+        """Whether the live version of a chunk passes a filter expression (see partition_index.validate_filters)."""
+        if not filters:
+            return True
+        if chunk_id in self.deleted:
+            return False
+        for segment in reversed(self.segments):
+            row = segment.row_by_id.get(chunk_id)
+            if row is not None:
+                return segment.partitions.contains(row, None, filters)
+        return False
+
+    def iter_segment_chunks(self, segment: IndexSegment) -> Iterator[Dict[str, Any]]:
+        """Iterate over the live chunks of one segment of this snapshot."""
+        masked = self._masked[self.segments.index(segment)]
+        for chunk_id, row in segment.row_by_id.items():
+            if chunk_id not in masked:
+                yield segment.chunks[row]
+
+    def iter_chunks(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over every live chunk, oldest segment first."""
+        for segment in self.segments:
+            yield from self.iter_segment_chunks(segment)
+
+    def vector_search(self, query_embedding: Sequence[float], k: int, engine: str = 'exact',
+                      nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Find the k live chunks most similar to the query embedding across all segments.
+
+        Returns:
+            List of (chunk_id, similarity) tuples sorted by similarity (highest first)
+        """
+        results: List[Tuple[str, float]] = []
+        for segment, masked in zip(self.segments, self._masked):
+            if not segment.vector_index:
+                continue
+            hits = segment.vector_index.search(query_embedding, k + len(masked), engine=engine, nprobe=nprobe)
+            results.extend(hit for hit in hits if hit[0] not in masked)
+        return heapq.nlargest(k, results, key=lambda item: item[1])
+
+    def vector_search_batch(self, query_embeddings: Sequence[Sequence[float]], k: int, fusion: str = 'max',
+                            engine: str = 'exact', nprobe: Optional[int] = None,
+                            partitions: Optional[Sequence[str]] = None,
+                            filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """
+        Score several query embeddings against all segments and fuse them as one collection.
+
+        Per-variant scores from every segment are concatenated before fusion, so
+        reciprocal-rank fusion ranks rows across segments rather than within each.
+        With partitions, only chunks in any of the given labels (see PartitionIndex) are
+        scored; with filters, only chunks matching the filter expression (see
+        partition_index.validate_filters). Both are applied before scoring.
+
+        Returns:
+            List of (chunk_id, fused_score) tuples sorted by fused score (highest first)
+        """
+        if not len(query_embeddings):
+            return []
+        parts: List[Tuple[VectorIndex, np.ndarray]] = []
+        blocks: List[np.ndarray] = []
+        for segment, masked_rows in zip(self.segments, self._masked_vector_rows):
+            if not segment.vector_index:
+                continue
+            allowed = segment.partitions.vector_candidates(partitions, filters)
+            if allowed is not None and not allowed.size:
+                continue
+            rows, scores = segment.vector_index.score_candidates(query_embeddings, k, fusion, engine, nprobe, allowed)
+            if masked_rows.size:
+                keep = ~np.isin(rows, masked_rows)
+                rows, scores = rows[keep], scores[keep]
+            parts.append((segment.vector_index, rows))
+            blocks.append(scores)
+        if not parts:
+            return []
+
+        fused = fuse_scores(np.concatenate(blocks), k, fusion)
+        offsets = np.cumsum([0] + [rows.shape[0] for _, rows in parts])
+        results = []
+        for i in top_k_indices(fused, k):
+            part = int(np.searchsorted(offsets, i, side='right')) - 1
+            index, rows = parts[part]
+            results.append((index.ids[rows[i - offsets[part]]], float(fused[i])))
+        return results
+
+    def keyword_search(self, keywords: List[str], k: int, partitions: Optional[Sequence[str]] = None,
+                       filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """
+        BM25 search over all segments, scored with collection statistics summed across segments.
+
+        With partitions or filters, only matching chunks are scored; the statistics
+        still describe the whole collection so scores stay comparable.
+
+        Returns:
+            List of (chunk_id, bm25_score) tuples sorted by score (highest first)
+        """
+        indexes = [(segment, masked) for segment, masked in zip(self.segments, self._masked) if segment.keyword_index]
+        if not indexes:
+            return []
+
+        matches = [segment.keyword_index.match(keywords) for segment, _ in indexes]
+        total = sum(len(segment.keyword_index) for segment, _ in indexes)
+        avg_doc_length = sum(segment.keyword_index.avg_doc_length * len(segment.keyword_index)
+                             for segment, _ in indexes) / total
+        document_frequency: Dict[str, int] = {}
+        for segment_matches in matches:
+            for keyword, keyword_matches in segment_matches.items():
+                document_frequency[keyword] = document_frequency.get(keyword, 0) + len(keyword_matches)
+
+        results: List[Tuple[str, float]] = []
+        for (segment, masked), segment_matches in zip(indexes, matches):
+            index = segment.keyword_index
+            allowed = segment.partitions.keyword_mask(partitions, filters)
+            if allowed is not None:
+                segment_matches = {keyword: {row: tf for row, tf in keyword_matches.items() if allowed[row]}
+                                   for keyword, keyword_matches in segment_matches.items()}
+            scores = index.score_matches(segment_matches, total, avg_doc_length, document_frequency)
+            results.extend((index.ids[row], score) for row, score in scores.items() if index.ids[row] not in masked)
+        return heapq.nlargest(k, results, key=lambda item: item[1])
+
+    def hybrid_search(self, query_embeddings: Sequence[Sequence[float]], keywords: List[str], k: int,
+                      vector_weight: float = 0.7, fusion: str = 'weighted', boosts: Optional[Dict[str, float]] = None,
+                      partitions: Optional[Sequence[str]] = None, filters: Optional[Dict[str, Any]] = None,
+                      engine: str = 'exact', nprobe: Optional[int] = None,
+                      variant_fusion: str = 'max') -> Tuple[List[Tuple[str, float]], Optional[float]]:
+        """
+        Fused hybrid search: vector, BM25 and boost scores of every chunk in one pass.
+
+        Each segment is scored once by its vector index and once from its keyword
+        postings into dense per-chunk arrays spanning all segments; the arrays are
+        fused and ranked with a single top-k selection.
+
+        Args:
+            query_embeddings: Embeddings of the query and its expansions (may be empty)
+            keywords: Keywords for BM25 matching
+            k: Number of results
+            vector_weight: Weight of the vector score (0-1); BM25 gets 1 - vector_weight
+            fusion: 'weighted' sums the weighted scores, each normalized by its best score;
+                    'rrf' sums the weighted reciprocal ranks of each score
+            boosts: chunk_id -> score added after fusion (e.g. structured data matches);
+                    applied to every chunk matching the filters, whatever the partitions
+            partitions: Optional labels restricting the vector and keyword scores (see vector_search_batch)
+            filters: Optional filter expression restricting the chunks
+            engine: Vector engine, 'exact', 'ivf' or 'pca' (approximate engines score a shortlist)
+            nprobe: Clusters scanned per variant by the IVF engine
+            variant_fusion: How the scores of several query embeddings are fused ('max' or 'rrf')
+
+        Returns:
+            (results, best_similarity): (chunk_id, fused score) tuples sorted by score
+            (highest first), leaving out chunks without any vector, keyword or boost
+            signal; and the best vector similarity among the eligible chunks, which
+            callers routing by partition compare with a threshold (None if no vector
+            was scored or several variants were fused by rank)
+        """
+        if fusion not in ('weighted', 'rrf'):
+            raise ValueError(f"Unknown hybrid fusion method: {fusion}")
+        offsets = np.cumsum([0] + [len(segment.chunk_ids) for segment in self.segments])
+        total = int(offsets[-1])
+        if total == 0:
+            return [], None
+        dimension = len(query_embeddings[0]) if len(query_embeddings) else 0
+
+        # Collection statistics for BM25, summed across segments
+        indexes = [segment.keyword_index for segment in self.segments]
+        matches = [index.match(keywords) if index else {} for index in indexes]
+        keyword_total = sum(len(index) for index in indexes)
+        avg_doc_length = sum(index.avg_doc_length * len(index) for index in indexes) / max(keyword_total, 1)
+        document_frequency: Dict[str, int] = {}
+        for segment_matches in matches:
+            for keyword, keyword_matches in segment_matches.items():
+                document_frequency[keyword] = document_frequency.get(keyword, 0) + len(keyword_matches)
+
+        # Dense per-chunk scores; chunk rows of segment i start at offsets[i]. Chunks
+        # matching the filters are eligible for boosts; valid ones also lie in the partitions
+        eligible = np.ones(total, dtype=bool)
+        valid = np.ones(total, dtype=bool)
+        keyword_scores = np.zeros(total, dtype=np.float32)
+        vector_positions: List[np.ndarray] = []
+        vector_blocks: List[np.ndarray] = []
+        for position, (segment, segment_matches) in enumerate(zip(self.segments, matches)):
+            start = int(offsets[position])
+            filter_mask = segment.partitions.chunk_mask(None, filters)
+            if filter_mask is not None:
+                eligible[start:start + filter_mask.shape[0]] &= filter_mask
+            masked = self._masked[position]
+            if masked:
+                eligible[start + np.fromiter((segment.row_by_id[chunk_id] for chunk_id in masked),
+                                             dtype=np.int64, count=len(masked))] = False
+            mask = segment.partitions.chunk_mask(partitions, filters) if partitions else None
+            if mask is not None:
+                valid[start:start + mask.shape[0]] &= mask
+
+            index = segment.vector_index
+            if dimension and len(index) and index.dimension == dimension:
+                allowed = segment.partitions.vector_candidates(partitions, filters)
+                if allowed is None or allowed.size:
+                    rows, scores = index.score_candidates(query_embeddings, k, variant_fusion, engine, nprobe, allowed)
+                    vector_positions.append(start + segment.partitions.vector_rows[rows])
+                    vector_blocks.append(scores)
+
+            if segment_matches:
+                scores = segment.keyword_index.score_matches(segment_matches, keyword_total, avg_doc_length,
+                                                             document_frequency)
+                rows = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+                keyword_scores[start + segment.partitions.keyword_rows[rows]] = np.fromiter(
+                    scores.values(), dtype=np.float32, count=len(scores))
+
+        valid &= eligible
+        vector_scores = np.zeros(total, dtype=np.float32)
+        if vector_blocks:
+            vector_scores[np.concatenate(vector_positions)] = fuse_scores(np.concatenate(vector_blocks), k, variant_fusion)
+        np.maximum(vector_scores, 0.0, out=vector_scores)
+        vector_scores[~valid] = 0.0
+        keyword_scores[~valid] = 0.0
+        # Fused scores are only similarities under max-sim fusion (or with a single variant)
+        best_similarity = None
+        if vector_blocks and (len(query_embeddings) == 1 or variant_fusion == 'max'):
+            best_similarity = float(vector_scores.max())
+
+        fused = np.zeros(total, dtype=np.float32)
+        for scores, weight in ((vector_scores, vector_weight), (keyword_scores, 1 - vector_weight)):
+            if fusion == 'weighted':
+                best = float(scores.max())
+                if best > 0:
+                    fused += weight * scores / best
+            else:
+                ranked = top_k_indices(scores, k * RRF_DEPTH_FACTOR)
+                ranked = ranked[scores[ranked] > 0]
+                fused[ranked] += weight / (RRF_K + np.arange(1, ranked.shape[0] + 1, dtype=np.float32))
+
+        for chunk_id, boost in (boosts or {}).items():
+            for position in range(len(self.segments) - 1, -1, -1):
+                row = self.segments[position].row_by_id.get(chunk_id)
+                if row is not None:
+                    if eligible[offsets[position] + row]:
+                        fused[offsets[position] + row] += boost
+                    break
+
+        results = []
+        for i in top_k_indices(fused, k):
+            if fused[i] <= 0:
+                break
+            position = int(np.searchsorted(offsets, i, side='right')) - 1
+            results.append((self.segments[position].chunk_ids[i - offsets[position]], float(fused[i])))
+        return results, best_similarity
+
+    def document_search(self, query_embeddings: Sequence[Sequence[float]], keywords: List[str], k: int,
+                        num_documents: int, max_chunks_per_document: int, vector_weight: float = 0.7,
+                        filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """
+        Hierarchical search: rank documents first, then score only the chunks of the best ones.
+
+        Documents are ranked by centroid similarity and document-level BM25 (chunk
+        frequencies summed per document, collection statistics summed across
+        segments). Chunks of the selected documents are scored the same way at
+        chunk level, and each document contributes at most max_chunks_per_document.
+
+        Args:
+            query_embeddings: Embeddings of the query and its expansions (may be empty)
+            keywords: Keywords for BM25 matching
+            k: Number of chunks to return
+            num_documents: Number of documents whose chunks are scored
+            max_chunks_per_document: Chunks kept per document
+            vector_weight: Weight of the vector score (0-1); BM25 gets 1 - vector_weight
+            filters: Optional filter expression; only documents with a matching chunk are
+                     ranked and only matching chunks are returned
+
+        Returns:
+            List of (chunk_id, score) tuples grouped per document; documents are ordered
+            by their best chunk and chunks by score within a document
+        """
+        queries = None
+        if len(query_embeddings):
+            queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1))
+        parts = [(position, segment, segment.documents) for position, segment in enumerate(self.segments)
+                 if segment.keyword_index or segment.vector_index]
+        if not parts:
+            return []
+
+        def searchable(segment: IndexSegment) -> bool:
+            return queries is not None and len(segment.vector_index) > 0 and segment.vector_index.dimension == queries.shape[1]
+
+        def normalized(blocks: List[np.ndarray]) -> List[np.ndarray]:
+            top = max((float(block.max()) for block in blocks if block.size), default=0.0)
+            return [block / top if top > 0 else block for block in blocks]
+
+        # Rows allowed by the filters, per segment (None when unfiltered)
+        vector_allowed = [segment.partitions.vector_candidates(None, filters) for _, segment, _ in parts]
+        keyword_allowed = [segment.partitions.keyword_mask(None, filters) for _, segment, _ in parts]
+
+        # 1. Rank documents across segments
+        chunk_matches = [segment.keyword_index.match(keywords) for _, segment, _ in parts]
+        chunk_matches = [matches if allowed is None else
+                         {keyword: {row: tf for row, tf in keyword_matches.items() if allowed[row]}
+                          for keyword, keyword_matches in matches.items()}
+                         for matches, allowed in zip(chunk_matches, keyword_allowed)]
+        doc_matches = [documents.document_matches(matches) for (_, _, documents), matches in zip(parts, chunk_matches)]
+        total_documents = sum(len(documents) for _, _, documents in parts)
+        avg_document_length = sum(float(documents.doc_lengths.sum()) for _, _, documents in parts) / max(total_documents, 1)
+        document_frequency: Dict[str, int] = {}
+        for matches in doc_matches:
+            for keyword, keyword_matches in matches.items():
+                document_frequency[keyword] = document_frequency.get(keyword, 0) + len(keyword_matches)
+
+        vector_blocks, keyword_blocks = [], []
+        for (_, segment, documents), matches in zip(parts, doc_matches):
+            vector_blocks.append(documents.document_scores(queries) if searchable(segment)
+                                 else np.zeros(len(documents), dtype=np.float32))
+            keyword_block = np.zeros(len(documents), dtype=np.float32)
+            index = segment.keyword_index
+            for doc, score in bm25_scores(matches, documents.doc_lengths, total_documents, avg_document_length,
+                                          document_frequency, index.k1, index.b, index.title_weight).items():
+                keyword_block[doc] = score
+            keyword_blocks.append(keyword_block)
+        combined = [vector_weight * vector + (1 - vector_weight) * keyword for vector, keyword
+                    in zip(normalized(vector_blocks), normalized(keyword_blocks))]
+        for (_, _, documents), block, vector_rows, keyword_rows in zip(parts, combined, vector_allowed, keyword_allowed):
+            if vector_rows is not None:
+                # Documents without a chunk that passes the filters cannot contribute
+                eligible = np.zeros(len(documents), dtype=bool)
+                eligible[documents.vector_docs[vector_rows]] = True
+                eligible[documents.keyword_docs[keyword_rows]] = True
+                block[~eligible] = 0.0
+        document_scores = np.concatenate(combined)
+        offsets = np.cumsum([0] + [len(documents) for _, _, documents in parts])
+        selected = [[] for _ in parts]
+        for i in top_k_indices(document_scores, num_documents):
+            if document_scores[i] <= 0:
+                break
+            part = int(np.searchsorted(offsets, i, side='right')) - 1
+            selected[part].append(int(i - offsets[part]))
+
+        # 2. Score the chunks of the selected documents with chunk-level statistics
+        total_chunks = sum(len(segment.keyword_index) for _, segment, _ in parts)
+        avg_chunk_length = sum(segment.keyword_index.avg_doc_length * len(segment.keyword_index)
+                               for _, segment, _ in parts) / max(total_chunks, 1)
+        chunk_frequency: Dict[str, int] = {}
+        for matches in chunk_matches:
+            for keyword, keyword_matches in matches.items():
+                chunk_frequency[keyword] = chunk_frequency.get(keyword, 0) + len(keyword_matches)
+
+        # chunk_id -> [vector score, BM25 score, document id]; a document may span segments
+        candidates: Dict[str, List[Any]] = {}
+        for part, ((position, segment, documents), matches, docs) in enumerate(zip(parts, chunk_matches, selected)):
+            if not docs:
+                continue
+            masked = self._masked[position]
+            if searchable(segment):
+                rows = documents.vector_rows(docs)
+                if vector_allowed[part] is not None:
+                    rows = np.intersect1d(rows, vector_allowed[part], assume_unique=True)
+                masked_rows = self._masked_vector_rows[position]
+                if masked_rows.size:
+                    rows = rows[~np.isin(rows, masked_rows)]
+                scores = (segment.vector_index.matrix[rows] @ queries.T).max(axis=1)
+                for row, score in zip(rows, scores):
+                    candidates[segment.vector_index.ids[row]] = [float(score), 0.0, documents.doc_ids[documents.vector_docs[row]]]
+
+            wanted = set(docs)
+            restricted = {keyword: {row: tf for row, tf in keyword_matches.items() if documents.keyword_docs[row] in wanted}
+                          for keyword, keyword_matches in matches.items()}
+            index = segment.keyword_index
+            for row, score in index.score_matches(restricted, total_chunks, avg_chunk_length, chunk_frequency).items():
+                chunk_id = index.ids[row]
+                if chunk_id in masked:
+                    continue
+                candidate = candidates.setdefault(chunk_id, [0.0, 0.0, documents.doc_ids[documents.keyword_docs[row]]])
+                candidate[1] = score
+
+        if not candidates:
+            return []
+        top_vector = max(candidate[0] for candidate in candidates.values())
+        top_keyword = max(candidate[1] for candidate in candidates.values())
+        groups: Dict[str, List[Tuple[str, float]]] = {}
+        for chunk_id, (vector_score, keyword_score, group) in candidates.items():
+            score = (vector_weight * (vector_score / top_vector if top_vector > 0 else 0.0)
+                     + (1 - vector_weight) * (keyword_score / top_keyword if top_keyword > 0 else 0.0))
+            groups.setdefault(group, []).append((chunk_id, score))
+
+        # 3. Keep the best chunks of each document, documents ordered by their best chunk
+        ranked = [sorted(chunks, key=lambda item: item[1], reverse=True)[:max_chunks_per_document]
+                  for chunks in groups.values()]
+        ranked.sort(key=lambda chunks: chunks[0][1], reverse=True)
+        return [hit for chunks in ranked for hit in chunks][:k]
+
+    def get_info(self) -> Dict[str, Any]:
+        """Summary for health and statistics endpoints."""
+        return {
+            "version": self.version,
+            "created_at": self.created_at,
+            "chunks": len(self),
+            "deleted": len(self.deleted),
+            "segments": [segment.get_info() for segment in self.segments]
+        }
+
+    def memory_usage(self) -> Dict[str, Any]:
+        """Per-segment memory breakdown plus heap totals per component."""
+        segments = {segment.name: segment.memory_usage() for segment in self.segments}
+        totals = {"chunks_bytes": 0, "vectors_bytes": 0, "keyword_index_bytes": 0, "id_map_bytes": 0,
+                  "documents_bytes": 0, "partitions_bytes": 0}
+        for usage in segments.values():
+            totals["chunks_bytes"] += usage["chunks"]["total_bytes"]
+            totals["vectors_bytes"] += sum(size for name, size in usage["vectors"].items() if not name.endswith("mapped_bytes"))
+            totals["keyword_index_bytes"] += usage["keyword_index_bytes"]
+            totals["id_map_bytes"] += usage["id_map_bytes"]
+            totals["documents_bytes"] += usage["documents_bytes"]
+            totals["partitions_bytes"] += usage["partitions_bytes"]
+        totals["total_bytes"] = sum(totals.values())
+        return {"version": self.version, "totals": totals, "segments": segments}
+
+
+class IndexSnapshotManager:
+    """
+    Builds index snapshots off the request path and publishes them with a single
+    reference swap (read-copy-update).
+
+    Readers call current() and keep using the snapshot they got; they never
+    block on a rebuild except for the very first load. Refresh requests that
+    arrive while a build is running are coalesced into one follow-up build.
+    """
+
+    def __init__(self, builder: Callable[[str], IndexSnapshot]):
+        """
+        Args:
+            builder: Function that builds a snapshot for a given version string
+        """
+        self._builder = builder
+        self._current: Optional[IndexSnapshot] = None
+        self._generation = 0
+        self._build_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._refresh_requested = False
+        self._worker: Optional[threading.Thread] = None
+
+    def current(self) -> IndexSnapshot:
+        """Return the published snapshot, building the first one if none exists yet."""
+        snapshot = self._current
+        if snapshot is None:
+            with self._build_lock:
+                if self._current is None:
+                    self._publish(self._build())
+                snapshot = self._current
+        return snapshot
+
+    @property
+    def version(self) -> Optional[str]:
+        """Version of the published snapshot, or None before the first load."""
+        snapshot = self._current
+        return snapshot.version if snapshot is not None else None
+
+    def _build(self) -> IndexSnapshot:
+        """Build a new snapshot with the next version number (caller holds the build lock)."""
+        self._generation += 1
+        version = self._version_string()
+        start = datetime.now()
+        snapshot = self._builder(version)
+        logger.info(f"Built index snapshot {version} with {len(snapshot)} chunks in "
+                    f"{(datetime.now() - start).total_seconds():.2f}s")
+        return snapshot
+
+    def _version_string(self) -> str:
+        """Version string for the current generation."""
+        return f"v{self._generation}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+    def _publish(self, snapshot: IndexSnapshot) -> None:
+        """Make a snapshot visible to readers; a single reference assignment is atomic."""
+        previous = self._current
+        self._current = snapshot
+        if previous is not None:
+            logger.info(f"Swapped index snapshot {previous.version} -> {snapshot.version}")
+
+    def update(self, updater: Callable[[IndexSnapshot, str], IndexSnapshot],
+               background: bool = False) -> Optional[IndexSnapshot]:
+        """
+        Derive a new snapshot from the published one and publish it.
+
+        Used for delta updates and compaction, whose cost depends on the size of
+        the change rather than of the corpus. Updates are serialized with full
+        rebuilds, so none of them can overwrite another.
+
+        Args:
+            updater: Function that takes the current snapshot and a new version string
+            background: Run the update in a worker thread and return immediately
+
+        Returns:
+            The new snapshot when run in the foreground, otherwise None
+        """
+        if background:
+            threading.Thread(target=self._run_update, args=(updater,), name="index-snapshot-update",
+                             daemon=True).start()
+            return None
+        return self._run_update(updater)
+
+    def _run_update(self, updater: Callable[[IndexSnapshot, str], IndexSnapshot]) -> Optional[IndexSnapshot]:
+        """Apply an update under the build lock; errors are logged and leave the current snapshot in place."""
+        try:
+            with self._build_lock:
+                if self._current is None:
+                    self._publish(self._build())
+                self._generation += 1
+                snapshot = updater(self._current, self._version_string())
+                self._publish(snapshot)
+                return snapshot
+        except Exception as e:
+            logger.error(f"Failed to update index snapshot: {e}", exc_info=True)
+            return None
+
+    def refresh(self, background: bool = True) -> Optional[IndexSnapshot]:
+        """
+        Build a new snapshot from the current sources and publish it.
+
+        Args:
+            background: Build in a worker thread and return immediately
+
+        Returns:
+            The new snapshot when built in the foreground, otherwise None
+        """
+        if not background:
+            with self._build_lock:
+                self._publish(self._build())
+                return self._current
+
+        with self._state_lock:
+            self._refresh_requested = True
+            if self._worker is not None and self._worker.is_alive():
+                return None
+            self._worker = threading.Thread(target=self._refresh_loop, name="index-snapshot-refresh", daemon=True)
+            self._worker.start()
+        return None
+
+    def _refresh_loop(self) -> None:
+        """Worker: keep building until no refresh is pending."""
+        while True:
+            with self._state_lock:
+                if not self._refresh_requested:
+                    self._worker = None
+                    return
+                self._refresh_requested = False
+            try:
+                with self._build_lock:
+                    self._publish(self._build())
+            except Exception as e:
+                logger.error(f"Failed to build index snapshot: {e}", exc_info=True)
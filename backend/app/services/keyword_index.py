@@ -0,0 +1,261 @@
+# eidbi-query-system/backend/app/services/keyword_index.py
+
+import heapq
+import logging
+import math
+import re
+import sys
+from array import array
+from typing import List, Dict, Any, Tuple, Iterable, Sequence
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Same word boundaries as the previous regex scan (\bkeyword\b)
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# BM25 parameters
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+TITLE_WEIGHT = 3.0  # Title matches are worth more
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens."""
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+def chunk_title(chunk: Dict[str, Any]) -> str:
+    """Title of a chunk, whether stored at the top level or in its metadata."""
+    return chunk.get('title') or (chunk.get('metadata') or {}).get('title') or ''
+
+
+def bm25_scores(matches: Dict[str, Dict[int, Tuple[int, int]]], doc_lengths: Sequence[float], total: int,
+                avg_doc_length: float, document_frequency: Dict[str, int], k1: float = DEFAULT_K1,
+                b: float = DEFAULT_B, title_weight: float = TITLE_WEIGHT) -> Dict[int, float]:
+    """
+    BM25 scores of per-row (content, title) keyword frequencies.
+
+    Rows may be chunks or whole documents (see document_index.DocumentIndex),
+    as long as doc_lengths and the statistics describe the same units.
+
+    Returns:
+        Dictionary of row -> BM25 score
+    """
+    scores: Dict[int, float] = {}
+    if not total:
+        return scores
+
+    for keyword, keyword_matches in matches.items():
+        if not keyword_matches:
+            continue
+        df = document_frequency.get(keyword, len(keyword_matches))
+        idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+        for row, (content_tf, title_tf) in keyword_matches.items():
+            tf = content_tf + title_weight * title_tf
+            norm = k1 * (1 - b + b * doc_lengths[row] / avg_doc_length)
+            scores[row] = scores.get(row, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+class KeywordIndex:
+    """
+    Positional inverted index with BM25 scoring over chunk titles and contents.
+
+    Postings map each term to the rows that contain it, with the token positions
+    of the term in the content and title fields. Term frequencies are stored with
+    the postings, and positions let multi-word keywords such as
+    "medical assistance" match as exact phrases.
+
+    The postings are flat numpy arrays rather than per-row Python objects. The
+    postings of term t are rows[term_offsets[t]:term_offsets[t + 1]] (ascending)
+    with their (content, title) frequencies in term_frequencies; the positions of
+    posting p in field f are positions[f][position_offsets[f][p]:position_offsets[f][p + 1]].
+    Positions are only decoded for phrase matches.
+    """
+
+    def __init__(self, chunks: Iterable[Dict[str, Any]], k1: float = DEFAULT_K1, b: float = DEFAULT_B,
+                 title_weight: float = TITLE_WEIGHT):
+        self.k1 = k1
+        self.b = b
+        self.title_weight = title_weight
+        self.ids: List[str] = []
+        self.doc_lengths: List[float] = []
+        # term -> term number (index into term_offsets)
+        self.vocabulary: Dict[str, int] = {}
+
+        # Token stream in (row, field, position) order: term numbers plus the token count of each (row, field)
+        token_terms = array('i')
+        field_lengths = array('q')
+        for chunk in chunks:
+            if 'id' not in chunk or 'content' not in chunk:
+                continue
+            self.ids.append(chunk['id'])
+
+            content_tokens = tokenize(chunk['content'])
+            title_tokens = tokenize(chunk_title(chunk))
+            self.doc_lengths.append(len(content_tokens) + self.title_weight * len(title_tokens))
+
+            for tokens in (content_tokens, title_tokens):
+                token_terms.extend([self.vocabulary.setdefault(term, len(self.vocabulary)) for term in tokens])
+                field_lengths.append(len(tokens))
+
+        self._build_postings(np.frombuffer(token_terms, dtype=np.int32) if token_terms else np.zeros(0, dtype=np.int32),
+                             np.frombuffer(field_lengths, dtype=np.int64) if field_lengths else np.zeros(0, dtype=np.int64))
+
+        self.avg_doc_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        logger.info(f"Built keyword index with {len(self.ids)} chunks, {len(self.vocabulary)} terms "
+                    f"and {len(self.rows)} postings")
+
+    def _build_postings(self, token_terms: np.ndarray, field_lengths: np.ndarray) -> None:
+        """Group the token stream into per-term postings (see the class docstring for the layout)."""
+        row_count = max(len(self.ids), 1)
+        field_starts = np.cumsum(field_lengths) - field_lengths
+        token_rows = np.repeat(np.arange(len(field_lengths), dtype=np.int64) // 2, field_lengths)
+        token_fields = np.repeat(np.arange(len(field_lengths), dtype=np.int64) % 2, field_lengths)
+        token_positions = (np.arange(len(token_terms), dtype=np.int64)
+                           - np.repeat(field_starts, field_lengths)).astype(np.int32)
+
+        # A stable sort by (term, row) keeps each posting's tokens in field and position order
+        keys = token_terms.astype(np.int64) * row_count + token_rows
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        posting_keys = keys[first]
+        posting_of_token = np.cumsum(first) - 1
+
+        self.rows = (posting_keys % row_count).astype(np.int32)
+        self.term_offsets = np.searchsorted(posting_keys // row_count,
+                                            np.arange(len(self.vocabulary) + 1)).astype(np.int64)
+        self.term_frequencies = np.zeros((len(posting_keys), 2), dtype=np.int32)
+        self.positions: List[np.ndarray] = []
+        self.position_offsets: List[np.ndarray] = []
+        sorted_fields = token_fields[order]
+        for field in (0, 1):
+            in_field = sorted_fields == field
+            counts = np.bincount(posting_of_token[in_field], minlength=len(posting_keys))
+            self.term_frequencies[:, field] = counts
+            offsets = np.zeros(len(posting_keys) + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            self.position_offsets.append(offsets)
+            self.positions.append(np.ascontiguousarray(token_positions[order][in_field]))
+
+    def memory_usage(self) -> int:
+        """Approximate heap bytes of the postings and per-row lists (id strings are owned by the chunks)."""
+        total = sys.getsizeof(self.ids) + sys.getsizeof(self.doc_lengths) + sys.getsizeof(0.0) * len(self.doc_lengths)
+        total += sys.getsizeof(self.vocabulary) + sum(sys.getsizeof(term) for term in self.vocabulary)
+        total += self.rows.nbytes + self.term_offsets.nbytes + self.term_frequencies.nbytes
+        total += sum(values.nbytes for values in self.positions + self.position_offsets)
+        return total
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _term_postings(self, term: str) -> Tuple[int, int]:
+        """Range of the term's postings in rows and term_frequencies ((0, 0) if the term is unknown)."""
+        number = self.vocabulary.get(term)
+        if number is None:
+            return 0, 0
+        return int(self.term_offsets[number]), int(self.term_offsets[number + 1])
+
+    def _phrase_matches(self, terms: List[str]) -> Dict[int, Tuple[int, int]]:
+        """
+        Find rows where the terms occur consecutively.
+
+        Returns:
+            Dictionary of row -> (content phrase count, title phrase count)
+        """
+        ranges = [self._term_postings(term) for term in terms]
+        if any(start == end for start, end in ranges):
+            return {}
+
+        # Intersect starting from the rarest term
+        rows = self.rows[slice(*min(ranges, key=lambda span: span[1] - span[0]))]
+        for start, end in ranges:
+            rows = np.intersect1d(rows, self.rows[start:end], assume_unique=True)
+        if not len(rows):
+            return {}
+        # Posting of each intersected row for every term (rows are sorted within a term)
+        postings = [start + np.searchsorted(self.rows[start:end], rows) for start, end in ranges]
+
+        counts = np.zeros((len(rows), 2), dtype=np.int64)
+        for field in (0, 1):
+            positions, offsets = self.positions[field], self.position_offsets[field]
+            for i in range(len(rows)):
+                spans = [(offsets[posting[i]], offsets[posting[i] + 1]) for posting in postings]
+                if any(start == end for start, end in spans):
+                    continue
+                # Phrase starts: positions of the first term where term k follows at offset k
+                starts = positions[spans[0][0]:spans[0][1]]
+                for offset, (start, end) in enumerate(spans[1:], 1):
+                    starts = np.intersect1d(starts, positions[start:end] - offset, assume_unique=True)
+                counts[i, field] = len(starts)
+
+        found = counts.any(axis=1)
+        return dict(zip(rows[found].tolist(), map(tuple, counts[found].tolist())))
+
+    def _keyword_matches(self, keyword: str) -> Dict[int, Tuple[int, int]]:
+        """Per-row (content, title) frequencies of a single- or multi-word keyword."""
+        terms = tokenize(keyword)
+        if not terms:
+            return {}
+        if len(terms) == 1:
+            start, end = self._term_postings(terms[0])
+            return dict(zip(self.rows[start:end].tolist(), map(tuple, self.term_frequencies[start:end].tolist())))
+        return self._phrase_matches(terms)
+
+    def match(self, keywords: List[str]) -> Dict[str, Dict[int, Tuple[int, int]]]:
+        """Per-keyword matches: keyword -> {row: (content frequency, title frequency)}."""
+        return {keyword: self._keyword_matches(keyword) for keyword in dict.fromkeys(keywords)}
+
+    def score_matches(self, matches: Dict[str, Dict[int, Tuple[int, int]]], total: int,
+                      avg_doc_length: float, document_frequency: Dict[str, int]) -> Dict[int, float]:
+        """
+        BM25-score matches from match() against collection statistics.
+
+        The statistics are passed in so several indexes (e.g. the segments of an
+        index snapshot) can be scored as one collection.
+
+        Args:
+            matches: Output of match()
+            total: Number of documents in the collection
+            avg_doc_length: Average document length in the collection
+            document_frequency: keyword -> number of matching documents in the collection
+
+        Returns:
+            Dictionary of row -> BM25 score
+        """
+        return bm25_scores(matches, self.doc_lengths, total, avg_doc_length, document_frequency,
+                           self.k1, self.b, self.title_weight)
+
+    def score(self, keywords: List[str]) -> Dict[int, float]:
+        """
+        Compute BM25 scores for every row that matches at least one keyword.
+
+        Args:
+            keywords: Single words or multi-word phrases
+
+        Returns:
+            Dictionary of row -> BM25 score
+        """
+        matches = self.match(keywords)
+        document_frequency = {keyword: len(keyword_matches) for keyword, keyword_matches in matches.items()}
+        return self.score_matches(matches, len(self.ids), self.avg_doc_length, document_frequency)
+
+    def search(self, keywords: List[str], k: int) -> List[Tuple[str, float]]:
+        """
+        Find the k chunks with the highest BM25 score for the keywords.
+
+        Args:
+            keywords: Single words or multi-word phrases
+            k: Number of results to return
+
+        Returns:
+            List of (chunk_id, bm25_score) tuples sorted by score (highest first)
+        """
+        scores = self.score(keywords)
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[row], score) for row, score in top]
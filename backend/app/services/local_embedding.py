@@ -0,0 +1,357 @@
+# eidbi-query-system/backend/app/services/local_embedding.py
+
+"""
+Local CPU embedding backend: hashed word and character n-gram features.
+
+Mock embeddings are hashes of the whole text, so two texts that share every
+word but one are as far apart as two unrelated texts. This backend keeps
+lexical locality without network or GPU:
+
+    features    lowercased words, word bigrams and character 3- to 5-grams,
+                hashed with a sign bit into a fixed number of buckets
+    weighting   sublinear term frequency, IDF once a projection is fitted
+    projection  none (the features are hashed straight into the output
+                dimension), or a truncated SVD of the hashed corpus matrix
+                (latent semantic analysis) mapping the buckets to the output
+                dimension
+
+Texts are hashed with NumPy over whole character arrays and embedded block by
+block as dense matrices, so batches cost a few matrix operations rather than
+a Python loop per feature. Hashes are fixed (not Python's salted hash), so
+embeddings are identical across processes and runs.
+
+Fit a projection on the corpus once:
+
+    python -m app.services.local_embedding fit <scraped_data.jsonl>
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import zlib
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+LOCAL_EMBEDDING_MODEL_NAME = "local-hashing-ngram-v1"
+LOCAL_EMBEDDING_DIMENSION = int(os.getenv("LOCAL_EMBEDDING_DIMENSION", "768"))
+# Buckets of the hashed feature space a fitted projection starts from
+LOCAL_EMBEDDING_HASH_FEATURES = int(os.getenv("LOCAL_EMBEDDING_HASH_FEATURES", str(2 ** 14)))
+LOCAL_EMBEDDING_PROJECTION_PATH = os.getenv(
+    "LOCAL_EMBEDDING_PROJECTION_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'local_embedding_projection.npz')
+)
+
+CHAR_NGRAM_RANGE = (3, 5)
+# Relative weight of each feature family
+WORD_WEIGHT = 1.0
+BIGRAM_WEIGHT = 1.0
+CHAR_NGRAM_WEIGHT = 0.5
+# Same truncation as the Vertex AI path
+MAX_TEXT_CHARS = 8000
+# Texts hashed into one dense block
+BLOCK_ROWS = 256
+
+_NON_WORD = re.compile(r'[^\w]+')
+_PRIME = np.uint64(0x100000001B3)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+_SIGN_BIT = np.uint64(63)
+# Salts keeping the feature families apart in the hashed space
+_WORD_SALT = np.uint64(0x9E3779B97F4A7C15)
+_BIGRAM_SALT = np.uint64(0xC2B2AE3D27D4EB4F)
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, spreading polynomial hashes over all 64 bits."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * _MIX_1
+    values = values ^ (values >> np.uint64(27))
+    values = values * _MIX_2
+    return values ^ (values >> np.uint64(31))
+
+
+def normalize_for_features(text: str) -> str:
+    """Lowercase, punctuation to spaces, whitespace collapsed, one space at both ends."""
+    return f" {' '.join(_NON_WORD.sub(' ', text[:MAX_TEXT_CHARS].lower()).split())} "
+
+
+def feature_hashes(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    64-bit hashes and weights of the features of one text.
+
+    Args:
+        text: Text to featurize
+
+    Returns:
+        (hashes, weights) as uint64 and float32 arrays of equal length
+    """
+    normalized = normalize_for_features(text)
+    hashes = []
+    weights = []
+
+    words = normalized.split()
+    if words:
+        word_hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words),
+                                  dtype=np.uint64, count=len(words))
+        hashes.append(_mix(word_hashes ^ _WORD_SALT))
+        weights.append(np.full(len(words), WORD_WEIGHT, dtype=np.float32))
+        if len(words) > 1:
+            hashes.append(_mix(word_hashes[:-1] * _PRIME + word_hashes[1:] + _BIGRAM_SALT))
+            weights.append(np.full(len(words) - 1, BIGRAM_WEIGHT, dtype=np.float32))
+
+    codes = np.frombuffer(normalized.encode('utf-32-le'), dtype='<u4').astype(np.uint64)
+    for n in range(CHAR_NGRAM_RANGE[0], CHAR_NGRAM_RANGE[1] + 1):
+        count = len(codes) - n + 1
+        if count <= 0:
+            break
+        ngram_hashes = np.full(count, n, dtype=np.uint64)
+        for offset in range(n):
+            ngram_hashes = ngram_hashes * _PRIME + codes[offset:offset + count]
+        hashes.append(_mix(ngram_hashes))
+        weights.append(np.full(count, CHAR_NGRAM_WEIGHT, dtype=np.float32))
+
+    if not hashes:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.float32)
+    return np.concatenate(hashes), np.concatenate(weights)
+
+
+def hash_texts(texts: List[str], n_features: int) -> np.ndarray:
+    """
+    Signed, sublinearly weighted feature counts of texts, one dense row per text.
+
+    Args:
+        texts: Texts to hash
+        n_features: Number of buckets
+
+    Returns:
+        float32 matrix of shape (len(texts), n_features)
+    """
+    rows = []
+    buckets = []
+    values = []
+    for row, text in enumerate(texts):
+        hashes, weights = feature_hashes(text)
+        signs = 1.0 - 2.0 * (hashes >> _SIGN_BIT).astype(np.float32)
+        rows.append(np.full(len(hashes), row, dtype=np.int64))
+        buckets.append((hashes % np.uint64(n_features)).astype(np.int64))
+        values.append(weights * signs)
+    if not rows:
+        return np.zeros((0, n_features), dtype=np.float32)
+    counts = np.bincount(np.concatenate(rows) * n_features + np.concatenate(buckets),
+                         weights=np.concatenate(values), minlength=len(texts) * n_features)
+    matrix = counts.reshape(len(texts), n_features).astype(np.float32)
+    # Sublinear term frequency: repeating a term adds less and less
+    return np.sign(matrix) * np.log1p(np.abs(matrix))
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class HashingEmbedder:
+    """Embeds texts as hashed n-gram features, optionally projected with a fitted SVD."""
+
+    def __init__(self, dimension: int = LOCAL_EMBEDDING_DIMENSION,
+                 hash_features: int = LOCAL_EMBEDDING_HASH_FEATURES,
+                 projection: Optional[np.ndarray] = None,
+                 idf: Optional[np.ndarray] = None):
+        """
+        Args:
+            dimension: Length of the embeddings
+            hash_features: Buckets hashed into before a projection (unused without one)
+            projection: (hash_features, dimension) matrix from fit; without it features are hashed into dimension buckets
+            idf: Inverse document frequency per bucket, fitted with the projection
+        """
+        self.dimension = dimension
+        self.hash_features = hash_features
+        self.projection = projection
+        self.idf = idf
+
+    @property
+    def model_name(self) -> str:
+        """Name identifying the embedding space (differs with and without a projection)."""
+        return f"{LOCAL_EMBEDDING_MODEL_NAME}-{'svd' if self.projection is not None else 'hash'}-{self.dimension}"
+
+    def _features(self, texts: List[str], n_features: int) -> np.ndarray:
+        matrix = hash_texts(texts, n_features)
+        if self.idf is not None:
+            matrix *= self.idf
+        return _normalize_rows(matrix)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Unit-length embeddings of texts.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            float32 matrix of shape (len(texts), dimension)
+        """
+        n_features = self.hash_features if self.projection is not None else self.dimension
+        blocks = []
+        for start in range(0, len(texts), BLOCK_ROWS):
+            features = self._features(texts[start:start + BLOCK_ROWS], n_features)
+            if self.projection is not None:
+                features = features @ self.projection
+            blocks.append(_normalize_rows(features).astype(np.float32))
+        return np.vstack(blocks) if blocks else np.zeros((0, self.dimension), dtype=np.float32)
+
+    def _blocks(self, texts: List[str]) -> Iterator[np.ndarray]:
+        for start in range(0, len(texts), BLOCK_ROWS):
+            yield self._features(texts[start:start + BLOCK_ROWS], self.hash_features)
+
+    def fit(self, texts: List[str], oversample: int = 10, power_iterations: int = 2, seed: int = 0) -> 'HashingEmbedder':
+        """
+        Fit IDF weights and a truncated SVD projection on a corpus.
+
+        The SVD is randomized and computed block by block, so the hashed corpus
+        matrix is never held in memory. A corpus with fewer texts than dimension
+        yields fewer components; the remaining output dimensions stay zero.
+
+        Args:
+            texts: Corpus texts, e.g. the chunk contents
+            oversample: Extra random directions for the range finder
+            power_iterations: Power iterations sharpening the range finder
+            seed: Seed of the random directions
+
+        Returns:
+            self
+        """
+        texts = [text for text in texts if isinstance(text, str) and text.strip()]
+        if not texts:
+            raise ValueError("Cannot fit a projection without texts")
+        self.projection = None
+        self.idf = None
+
+        # IDF over the hashed buckets
+        document_frequency = np.zeros(self.hash_features, dtype=np.float64)
+        for start in range(0, len(texts), BLOCK_ROWS):
+            document_frequency += (hash_texts(texts[start:start + BLOCK_ROWS], self.hash_features) != 0).sum(axis=0)
+        self.idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+
+        components = min(self.dimension, len(texts))
+        width = min(components + oversample, len(texts))
+        rng = np.random.default_rng(seed)
+        directions = rng.standard_normal((self.hash_features, width)).astype(np.float32)
+        sample = np.vstack([block @ directions for block in self._blocks(texts)])
+        for _ in range(power_iterations):
+            basis, _ = np.linalg.qr(sample)
+            directions = np.zeros((self.hash_features, width), dtype=np.float32)
+            start = 0
+            for block in self._blocks(texts):
+                directions += block.T @ basis[start:start + len(block)]
+                start += len(block)
+            directions, _ = np.linalg.qr(directions)
+            sample = np.vstack([block @ directions for block in self._blocks(texts)])
+        basis, _ = np.linalg.qr(sample)
+        reduced = np.zeros((width, self.hash_features), dtype=np.float32)
+        start = 0
+        for block in self._blocks(texts):
+            reduced += basis[start:start + len(block)].T @ block
+            start += len(block)
+        _, singular_values, right_vectors = np.linalg.svd(reduced, full_matrices=False)
+
+        projection = np.zeros((self.hash_features, self.dimension), dtype=np.float32)
+        projection[:, :components] = right_vectors[:components].T
+        self.projection = projection
+        logger.info(f"Fitted {components}-component projection of {self.hash_features} hashed features "
+                    f"on {len(texts)} texts (top singular value {singular_values[0]:.2f})")
+        return self
+
+    def save(self, path: str = LOCAL_EMBEDDING_PROJECTION_PATH) -> None:
+        """Write the fitted projection and IDF weights to an .npz file."""
+        if self.projection is None:
+            raise ValueError("No projection fitted")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(path, projection=self.projection, idf=self.idf,
+                            dimension=self.dimension, hash_features=self.hash_features)
+        logger.info(f"Saved local embedding projection to {path}")
+
+    @classmethod
+    def load(cls, path: str = LOCAL_EMBEDDING_PROJECTION_PATH, dimension: int = LOCAL_EMBEDDING_DIMENSION) -> 'HashingEmbedder':
+        """Embedder using the projection at path, or plain hashing if there is none or it has another dimension."""
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    if int(data['dimension']) == dimension:
+                        logger.info(f"Loaded local embedding projection from {path}")
+                        return cls(dimension, int(data['hash_features']), data['projection'], data['idf'])
+                    logger.warning(f"Projection at {path} has dimension {int(data['dimension'])}, not {dimension}; "
+                                   f"using plain hashing")
+            except Exception as e:
+                logger.error(f"Error loading local embedding projection {path}: {e}", exc_info=True)
+        return cls(dimension)
+
+
+_embedder: Optional[HashingEmbedder] = None
+_embedder_lock = threading.Lock()
+
+
+def get_local_embedder() -> HashingEmbedder:
+    """The process-wide embedder, loading the fitted projection on first use."""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = HashingEmbedder.load()
+        return _embedder
+
+
+def generate_local_embeddings(texts: List[str]) -> List[Optional[List[float]]]:
+    """
+    Embed texts with the local backend.
+
+    Args:
+        texts: Texts to embed
+
+    Returns:
+        Embeddings in the order of texts; None for texts that are not non-empty strings
+    """
+    valid = [index for index, text in enumerate(texts) if isinstance(text, str) and text.strip()]
+    embeddings: List[Optional[List[float]]] = [None] * len(texts)
+    if valid:
+        matrix = get_local_embedder().embed([texts[index] for index in valid])
+        for index, row in zip(valid, matrix):
+            embeddings[index] = row.tolist()
+    return embeddings
+
+
+def _read_corpus_texts(paths: Iterable[str]) -> List[str]:
+    texts = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    chunk: Dict[str, Any] = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if chunk.get('content'):
+                    texts.append(chunk['content'])
+    return texts
+
+
+# --- Example Usage ---
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s')
+
+    if len(sys.argv) > 2 and sys.argv[1] == 'fit':
+        corpus = _read_corpus_texts(sys.argv[2:])
+        print(f"Fitting projection on {len(corpus)} chunks...")
+        HashingEmbedder().fit(corpus).save()
+    else:
+        sample_texts = [
+            "Who is eligible for EIDBI services?",
+            "EIDBI eligibility requirements for children",
+            "Provider enrollment for EIDBI agencies"
+        ]
+        sample_embeddings = get_local_embedder().embed(sample_texts)
+        for text, embedding in zip(sample_texts, sample_embeddings):
+            print(f"\"{text}\" -> similarity to first: {float(embedding @ sample_embeddings[0]):.3f}")
@@ -0,0 +1,294 @@
+# eidbi-query-system/backend/app/services/partition_index.py
+
+"""
+Topic and metadata partitions of an index segment.
+
+Every chunk is tagged at build time with the knowledge-base topics it covers
+(the TopicCategory keyword lists of knowledge_base_audit_system.py, matched
+through the segment's keyword index) and with its source_type, document_type,
+source_name and whether it is a structured-data entry. Each label keeps a
+packed bitmap over the chunk rows, and a float column holds each chunk's
+last-updated time, so a search can be restricted before scoring without
+copying or re-indexing the segment.
+
+Query types from PromptEngineeringService.classify_query_type map to the
+topics a search is routed to first (see QUERY_TYPE_TOPICS). Callers filter
+with expressions such as
+
+    {"source_type": ["official_website"], "updated_after": "2024-01-01", "structured_data": False}
+
+where values of one field are OR-ed and fields are AND-ed (see FILTER_FIELDS).
+"""
+
+import logging
+import math
+import os
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Any, Optional, Sequence, Mapping
+
+import numpy as np
+
+from .chunk_store import ChunkStore
+from .keyword_index import KeywordIndex
+from .vector_index import VectorIndex
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+TOPIC_PREFIX = 'topic:'
+STRUCTURED_LABEL = 'structured_data'
+
+# Filterable metadata fields -> (section, key) they are read from
+FILTER_FIELDS = {
+    'source_type': ('source_metadata', 'source_type'),
+    'document_type': ('source_metadata', 'document_type'),
+    'source_name': ('source_metadata', 'source_name')
+}
+
+# Date fields that make up a chunk's last-updated time, most specific first
+UPDATED_FIELDS = (('source_metadata', 'last_modified'), ('metadata', 'last_updated'), ('source_metadata', 'crawl_date'))
+
+# A chunk is tagged with a topic when it contains at least this many distinct topic keywords
+TOPIC_MIN_KEYWORDS = int(os.getenv("TOPIC_MIN_KEYWORDS", "2"))
+
+# Keyword lists of knowledge_base_audit_system.TopicCategory (ambiguous abbreviations such as "MA" left out)
+TOPIC_KEYWORDS: Dict[str, List[str]] = {
+    'billing_claims': [
+        "billing", "claims", "reimbursement", "payment", "invoice", "medicaid", "medical assistance",
+        "fee schedule", "prior authorization", "claim submission", "denial", "appeal"
+    ],
+    'provider_network': [
+        "provider", "network", "directory", "availability", "capacity", "qualified supervising professional",
+        "qsp", "bcba", "therapist", "enrollment", "credentialing", "geographic distribution"
+    ],
+    'service_descriptions': [
+        "services", "treatment", "intervention", "therapy", "behavioral", "developmental", "autism", "asd",
+        "early intensive", "eidbi", "scope", "limitations", "covered services"
+    ],
+    'eligibility_enrollment': [
+        "eligibility", "enrollment", "qualify", "requirements", "criteria", "cmde",
+        "comprehensive multidisciplinary evaluation", "diagnosis", "medical necessity", "age", "income"
+    ],
+    'policies_compliance': [
+        "policy", "compliance", "regulations", "requirements", "standards", "quality", "monitoring",
+        "oversight", "audit", "review"
+    ],
+    'training_support': [
+        "training", "education", "support", "resources", "materials", "workshops", "certification",
+        "continuing education", "technical assistance"
+    ],
+    'funding_budget': [
+        "funding", "budget", "appropriation", "cost", "expenditure", "allocation", "financial", "revenue", "spending"
+    ],
+    'outcomes_quality': [
+        "outcomes", "quality", "measures", "metrics", "performance", "effectiveness", "evaluation",
+        "assessment", "data", "reporting"
+    ],
+    'technology_tools': [
+        "technology", "tools", "systems", "software", "platform", "database", "portal", "application",
+        "digital", "electronic"
+    ]
+}
+
+# QueryType value -> topics searched first; unlisted types (general, definition, comparison) are not routed
+QUERY_TYPE_TOPICS: Dict[str, List[str]] = {
+    'eligibility': ['eligibility_enrollment'],
+    'services': ['service_descriptions'],
+    'process': ['eligibility_enrollment', 'billing_claims', 'policies_compliance'],
+    'cost_payment': ['billing_claims', 'funding_budget'],
+    'provider': ['provider_network']
+}
+
+
+def topic_labels(query_type: Optional[str]) -> Optional[List[str]]:
+    """Partition labels a query of the given type is routed to, or None to search everything."""
+    topics = QUERY_TYPE_TOPICS.get((query_type or '').lower())
+    return [TOPIC_PREFIX + topic for topic in topics] if topics else None
+
+
+def chunk_field(chunk: Mapping[str, Any], section: Optional[str], key: str) -> Optional[str]:
+    """String metadata field of a chunk dictionary; source metadata fields fall back to the top level."""
+    value = (chunk.get(section) or {}).get(key) if section else chunk.get(key)
+    if value is None and section == 'source_metadata':
+        value = chunk.get(key)
+    return value if isinstance(value, str) else None
+
+
+def parse_timestamp(value: Optional[str]) -> float:
+    """POSIX time of an ISO 8601 or HTTP date string (naive times are UTC), NaN if missing or unparseable."""
+    if not value:
+        return math.nan
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return math.nan
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def validate_filters(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Check a filter expression and normalize it; empty expressions become None.
+
+    Raises:
+        ValueError: On an unknown field or an unparseable updated_after date
+    """
+    if not filters:
+        return None
+    normalized: Dict[str, Any] = {}
+    for field, value in filters.items():
+        if value is None:
+            continue
+        if field in FILTER_FIELDS:
+            normalized[field] = [value] if isinstance(value, str) else list(value)
+        elif field == 'updated_after':
+            timestamp = value if isinstance(value, (int, float)) else parse_timestamp(value)
+            if math.isnan(timestamp):
+                raise ValueError(f"Unparseable updated_after date: {value}")
+            normalized[field] = float(timestamp)
+        elif field == 'structured_data':
+            normalized[field] = bool(value)
+        else:
+            raise ValueError(f"Unknown filter field: {field}")
+    return normalized or None
+
+
+class PartitionIndex:
+    """Packed bitmaps over chunk rows per label, a last-updated column and the row maps of the segment's indexes."""
+
+    def __init__(self, bitmaps: Dict[str, np.ndarray], updated: np.ndarray, vector_rows: np.ndarray,
+                 keyword_rows: np.ndarray):
+        """
+        Args:
+            bitmaps: label -> np.packbits of the bool [chunks] membership mask
+            updated: float64 [chunks] last-updated POSIX time (NaN if unknown)
+            vector_rows: Chunk row of each vector index row
+            keyword_rows: Chunk row of each keyword index row
+        """
+        self.bitmaps = bitmaps
+        self.updated = updated
+        self.vector_rows = vector_rows
+        self.keyword_rows = keyword_rows
+
+    @classmethod
+    def from_segment(cls, chunks: Sequence[Mapping[str, Any]], row_by_id: Dict[str, int],
+                     vector_index: VectorIndex, keyword_index: KeywordIndex) -> 'PartitionIndex':
+        """Tag the chunks of a segment with their topics and metadata labels."""
+        rows = len(chunks)
+        vector_rows = np.fromiter((row_by_id[chunk_id] for chunk_id in vector_index.ids),
+                                  dtype=np.int64, count=len(vector_index.ids))
+        keyword_rows = np.fromiter((row_by_id[chunk_id] for chunk_id in keyword_index.ids),
+                                   dtype=np.int64, count=len(keyword_index.ids))
+        masks: Dict[str, np.ndarray] = {}
+
+        # Topics: distinct keyword hits per row, from the postings rather than a text scan
+        for topic, keywords in TOPIC_KEYWORDS.items():
+            hits = np.zeros(len(keyword_index), dtype=np.int32)
+            for keyword_matches in keyword_index.match(keywords).values():
+                if keyword_matches:
+                    hits[np.fromiter(keyword_matches, dtype=np.int64, count=len(keyword_matches))] += 1
+            mask = np.zeros(rows, dtype=bool)
+            mask[keyword_rows[hits >= TOPIC_MIN_KEYWORDS]] = True
+            masks[TOPIC_PREFIX + topic] = mask
+
+        # Metadata: interned columns of a chunk store, so no chunk is decompressed
+        if isinstance(chunks, ChunkStore):
+            column = chunks.field_values
+        else:
+            column = lambda section, key: [chunk_field(chunk, section, key) for chunk in chunks]
+        for field, (section, key) in FILTER_FIELDS.items():
+            for row, value in enumerate(column(section, key)):
+                if value:
+                    masks.setdefault(f"{field}:{value}", np.zeros(rows, dtype=bool))[row] = True
+        structured = np.fromiter((chunk_id.startswith('structured_') for chunk_id in getattr(chunks, 'ids', None) or
+                                  [chunk.get('id') or '' for chunk in chunks]), dtype=bool, count=rows)
+        structured |= np.asarray([value == 'structured_data' for value in column('metadata', 'type')], dtype=bool)
+        masks[STRUCTURED_LABEL] = structured
+
+        updated = np.full(rows, math.nan)
+        for section, key in UPDATED_FIELDS:
+            for row, value in enumerate(column(section, key)):
+                if value and math.isnan(updated[row]):
+                    updated[row] = parse_timestamp(value)
+
+        return cls({label: np.packbits(mask) for label, mask in masks.items()}, updated, vector_rows, keyword_rows)
+
+    def __len__(self) -> int:
+        return int(self.updated.shape[0])
+
+    def _any_of(self, labels: Sequence[str]) -> np.ndarray:
+        """Packed union of the bitmaps of the given labels (all zeros if none is known)."""
+        union = np.zeros((len(self) + 7) // 8, dtype=np.uint8)
+        for label in labels:
+            bitmap = self.bitmaps.get(label)
+            if bitmap is not None:
+                np.bitwise_or(union, bitmap, out=union)
+        return union
+
+    def chunk_mask(self, labels: Optional[Sequence[str]] = None,
+                   filters: Optional[Dict[str, Any]] = None) -> Optional[np.ndarray]:
+        """
+        bool [chunks] rows in any of the labels and matching every filter (see validate_filters).
+
+        Returns:
+            The mask, or None when neither labels nor filters restrict anything
+        """
+        if not labels and not filters:
+            return None
+        # Combine packed bitmaps first; unpack once at the end
+        packed = self._any_of(labels) if labels else np.full((len(self) + 7) // 8, 0xFF, dtype=np.uint8)
+        for field, values in (filters or {}).items():
+            if field in FILTER_FIELDS:
+                np.bitwise_and(packed, self._any_of([f"{field}:{value}" for value in values]), out=packed)
+        mask = np.unpackbits(packed, count=len(self)).view(bool)
+        if filters and 'structured_data' in filters:
+            structured = np.unpackbits(self.bitmaps[STRUCTURED_LABEL], count=len(self)).view(bool)
+            mask &= structured if filters['structured_data'] else ~structured
+        if filters and 'updated_after' in filters:
+            # NaN (unknown date) compares False, so undated chunks are excluded
+            mask &= self.updated >= filters['updated_after']
+        return mask
+
+    def vector_candidates(self, labels: Optional[Sequence[str]] = None,
+                          filters: Optional[Dict[str, Any]] = None) -> Optional[np.ndarray]:
+        """Sorted vector index rows of the matching chunks, or None if nothing is restricted."""
+        mask = self.chunk_mask(labels, filters)
+        return None if mask is None else np.flatnonzero(mask[self.vector_rows])
+
+    def keyword_mask(self, labels: Optional[Sequence[str]] = None,
+                     filters: Optional[Dict[str, Any]] = None) -> Optional[np.ndarray]:
+        """bool [keyword rows] of the matching chunks, or None if nothing is restricted."""
+        mask = self.chunk_mask(labels, filters)
+        return None if mask is None else mask[self.keyword_rows]
+
+    def _has(self, row: int, label: str) -> bool:
+        bitmap = self.bitmaps.get(label)
+        return bitmap is not None and bool(bitmap[row >> 3] & (0x80 >> (row & 7)))
+
+    def contains(self, row: int, labels: Optional[Sequence[str]] = None,
+                 filters: Optional[Dict[str, Any]] = None) -> bool:
+        """Whether a chunk row is in any of the labels and matches every filter (reads single bits)."""
+        if labels and not any(self._has(row, label) for label in labels):
+            return False
+        for field, values in (filters or {}).items():
+            if field in FILTER_FIELDS and not any(self._has(row, f"{field}:{value}") for value in values):
+                return False
+        if filters and 'structured_data' in filters and self._has(row, STRUCTURED_LABEL) != filters['structured_data']:
+            return False
+        if filters and 'updated_after' in filters and not self.updated[row] >= filters['updated_after']:
+            return False
+        return True
+
+    def counts(self) -> Dict[str, int]:
+        """Number of chunks per label."""
+        return {label: int(np.unpackbits(bitmap, count=len(self)).sum()) for label, bitmap in self.bitmaps.items()}
+
+    def memory_usage(self) -> int:
+        """Bytes of the bitmaps, the updated column and the row maps."""
+        return int(sum(bitmap.nbytes for bitmap in self.bitmaps.values()) + self.updated.nbytes
+                   + self.vector_rows.nbytes + self.keyword_rows.nbytes)
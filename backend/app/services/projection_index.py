@@ -0,0 +1,312 @@
+# eidbi-query-system/backend/app/services/projection_index.py
+
+"""
+Two-stage retrieval over reduced-dimension projections of the embeddings.
+
+Every row is projected offline onto its top principal components (or simply
+truncated to its first dimensions). A query is projected the same way and
+the low-dimensional rows are scanned for a shortlist of a few hundred
+candidates; only the shortlist is re-scored with the full-dimension rows.
+At 128 of 768 dimensions the coarse pass reads a sixth of the memory of an
+exact scan.
+
+The projection is built offline and stored inside the corpus artifact
+directory; recall against exact search is reported for each candidate
+dimension so the dimension can be chosen from the numbers:
+
+    python -m app.services.projection_index local_scraped_data_with_embeddings.jsonl --dim 128 --compare 64 96 128 192 256
+
+Building the corpus artifact with VECTOR_SEARCH_ENGINE=pca builds it too, at
+the default dimension. The projection records the artifact's source stamp and
+is ignored once the corpus changes.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from .corpus_artifact import CorpusArtifact
+from .vector_index import VectorIndex, top_k_indices
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PROJECTION_FILE = 'projection.npz'
+PROJECTED_ROWS_FILE = 'projection_rows.npy'
+
+PROJECTION_METHODS = ('pca', 'truncate')
+DEFAULT_PROJECTION_DIM = 128
+DEFAULT_SHORTLIST = int(os.getenv("VECTOR_PROJECTION_SHORTLIST", "300"))
+DEFAULT_TRAIN_SAMPLE = 100_000
+PROJECTION_BLOCK = 65536
+
+
+class PCAProjection:
+    """Linear projection of a normalized embedding matrix plus the projected rows."""
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, projected: np.ndarray,
+                 shortlist: int = DEFAULT_SHORTLIST, method: str = 'pca', metadata: Optional[dict] = None):
+        """
+        Args:
+            mean: float32 [dim] vector subtracted before projecting
+            components: float32 [d x dim] orthonormal projection rows, most important first
+            projected: float32 [rows x d] projected corpus rows (may be a read-only memmap)
+            shortlist: Default number of coarse candidates re-scored at full dimension
+            method: 'pca' or 'truncate', recorded for statistics
+            metadata: Build settings stored with the projection (see save())
+        """
+        self.mean = mean
+        self.components = components
+        self.projected = projected
+        self.shortlist = shortlist
+        self.method = method
+        self.metadata = metadata or {}
+
+    @property
+    def dimension(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def rows(self) -> int:
+        return int(self.projected.shape[0])
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, dimension: int = DEFAULT_PROJECTION_DIM, method: str = 'pca',
+              train_sample: int = DEFAULT_TRAIN_SAMPLE, seed: int = 0,
+              shortlist: int = DEFAULT_SHORTLIST) -> 'PCAProjection':
+        """
+        Fit the projection on a normalized matrix and project every row.
+
+        Args:
+            matrix: float32 [rows x dim] L2-normalized embeddings
+            dimension: Number of dimensions to keep
+            method: 'pca' for the top principal components, 'truncate' for the first dimensions
+            train_sample: Maximum number of rows used to fit the principal components
+            seed: Random seed for sampling
+            shortlist: Default number of coarse candidates re-scored at full dimension
+        """
+        rows, full_dimension = matrix.shape
+        if rows == 0:
+            raise ValueError("Cannot train a projection on an empty matrix")
+        if method not in PROJECTION_METHODS:
+            raise ValueError(f"Unknown projection method: {method}")
+        dimension = min(dimension, full_dimension)
+
+        if method == 'truncate':
+            mean = np.zeros(full_dimension, dtype=np.float32)
+            components = np.eye(full_dimension, dtype=np.float32)[:dimension]
+        else:
+            sample = matrix
+            if rows > train_sample:
+                rng = np.random.default_rng(seed)
+                sample = matrix[np.sort(rng.choice(rows, train_sample, replace=False))]
+            sample = np.asarray(sample, dtype=np.float64)
+            mean = sample.mean(axis=0)
+            centered = sample - mean
+            # Eigenvectors of the dim x dim covariance; cheaper than an SVD of the sample
+            eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered)
+            order = np.argsort(eigenvalues)[::-1][:dimension]
+            mean = mean.astype(np.float32)
+            components = np.ascontiguousarray(eigenvectors[:, order].T, dtype=np.float32)
+
+        projection = cls(mean, components, np.empty((0, dimension), dtype=np.float32), shortlist, method)
+        projection.projected = projection.project(matrix)
+        return projection
+
+    def truncated(self, dimension: int) -> 'PCAProjection':
+        """Projection onto the first `dimension` components (principal components are nested)."""
+        dimension = min(dimension, self.dimension)
+        return PCAProjection(self.mean, self.components[:dimension],
+                             np.ascontiguousarray(self.projected[:, :dimension]), self.shortlist, self.method)
+
+    def project(self, matrix: np.ndarray, block: int = PROJECTION_BLOCK) -> np.ndarray:
+        """Project the rows of a matrix, in blocks to bound the temporaries."""
+        projected = np.empty((matrix.shape[0], self.dimension), dtype=np.float32)
+        for start in range(0, matrix.shape[0], block):
+            projected[start:start + block] = (np.asarray(matrix[start:start + block]) - self.mean) @ self.components.T
+        return projected
+
+    def coarse_scores(self, query: np.ndarray) -> np.ndarray:
+        """
+        Approximate scores of every row for one query [dim] or several [dim x m].
+
+        The mean term q . mean is the same for every row, so it is left out; the
+        scores rank rows like q . x but are not similarities themselves.
+        """
+        return self.projected @ (self.components @ query)
+
+    def candidates(self, query: np.ndarray, shortlist: Optional[int] = None) -> np.ndarray:
+        """Rows of the coarse shortlist for a normalized query."""
+        return top_k_indices(self.coarse_scores(query), shortlist or self.shortlist)
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, k: int,
+               shortlist: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Two-stage top-k search.
+
+        Args:
+            matrix: The full-dimension normalized matrix the projection was built over
+            query: Normalized query vector
+            k: Number of results
+            shortlist: Coarse candidates to re-score (defaults to the projection setting, at least k)
+
+        Returns:
+            Tuple of (matrix rows, exact scores), best first
+        """
+        rows = self.candidates(query, max(shortlist or self.shortlist, k))
+        rows.sort()  # Sequential access into a memory-mapped matrix
+        scores = matrix[rows] @ query
+        best = top_k_indices(scores, k)
+        return rows[best], scores[best]
+
+    def save(self, artifact_path: str, metadata: Optional[dict] = None) -> None:
+        """Persist the projection into an artifact directory (projected rows as a mappable .npy)."""
+        np.save(os.path.join(artifact_path, PROJECTED_ROWS_FILE), self.projected)
+        np.savez(
+            os.path.join(artifact_path, PROJECTION_FILE),
+            mean=self.mean,
+            components=self.components,
+            metadata=np.array(json.dumps(dict(metadata or {}, method=self.method)))
+        )
+
+    @classmethod
+    def load(cls, artifact_path: str, shortlist: int = DEFAULT_SHORTLIST) -> 'PCAProjection':
+        """Load a projection written by save(), memory-mapping the projected rows."""
+        with np.load(os.path.join(artifact_path, PROJECTION_FILE)) as data:
+            mean, components = data['mean'], data['components']
+            metadata = json.loads(str(data['metadata']))
+        projected = np.load(os.path.join(artifact_path, PROJECTED_ROWS_FILE), mmap_mode='r')
+        return cls(mean, components, projected, shortlist, metadata.get('method', 'pca'), metadata)
+
+
+def measure_recall(matrix: np.ndarray, projection: PCAProjection, k: int = 10, queries: int = 200,
+                   shortlist: Optional[int] = None, seed: int = 1) -> Tuple[float, float, float]:
+    """
+    Estimate recall@k of two-stage search against exact search, using corpus rows as queries.
+
+    Returns:
+        Tuple of (recall, exact ms per query, two-stage ms per query)
+    """
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(matrix.shape[0], min(queries, matrix.shape[0]), replace=False)
+    hits = 0
+    exact_time = approx_time = 0.0
+    for row in sample:
+        query = np.asarray(matrix[row], dtype=np.float32)
+        start = time.perf_counter()
+        exact = set(top_k_indices(matrix @ query, k).tolist())
+        exact_time += time.perf_counter() - start
+        start = time.perf_counter()
+        approx, _ = projection.search(matrix, query, k, shortlist)
+        approx_time += time.perf_counter() - start
+        hits += len(exact.intersection(approx.tolist()))
+    total = len(sample)
+    return hits / (total * min(k, matrix.shape[0])), 1000 * exact_time / total, 1000 * approx_time / total
+
+
+def build_projection(artifact: CorpusArtifact, dimension: int = DEFAULT_PROJECTION_DIM, method: str = 'pca',
+                     shortlist: int = DEFAULT_SHORTLIST, compare: Sequence[int] = ()) -> PCAProjection:
+    """
+    Fit a projection over an artifact's matrix and store it in the artifact directory.
+
+    Args:
+        artifact: Corpus artifact to project
+        dimension: Projection dimension to store
+        method: 'pca' or 'truncate'
+        shortlist: Coarse candidates re-scored per query
+        compare: Additional dimensions to report recall for
+
+    Returns:
+        The stored projection
+    """
+    index = VectorIndex.from_artifact(artifact)
+    # Components are nested, so one fit at the largest dimension serves every candidate
+    dimensions = sorted(set(compare) | {dimension})
+    full = PCAProjection.train(index.matrix, max(dimensions), method=method, shortlist=shortlist)
+    chosen, chosen_recall = None, None
+    for candidate in dimensions:
+        projection = full.truncated(candidate)
+        recall, exact_ms, approx_ms = measure_recall(index.matrix, projection, shortlist=shortlist)
+        logger.info(f"{method} dim={projection.dimension} shortlist={shortlist}: recall@10={recall:.3f}, "
+                    f"exact {exact_ms:.2f} ms/query, two-stage {approx_ms:.2f} ms/query")
+        if candidate == dimension:
+            chosen, chosen_recall = projection, recall
+
+    chosen.metadata = {'dimension': chosen.dimension, 'shortlist': shortlist, 'recall_at_10': chosen_recall,
+                       'source_stamp': artifact.manifest.get('source_stamp')}
+    chosen.save(artifact.path, chosen.metadata)
+    logger.info(f"Wrote {chosen.dimension}-dim projection to {artifact.path}")
+    return chosen
+
+
+def load_projection(artifact_path: str, rows: int, full_dimension: int,
+                    source_stamp: Optional[dict] = None) -> Optional[PCAProjection]:
+    """
+    Load the projection stored in an artifact directory, if present and built for the same corpus.
+
+    Args:
+        artifact_path: Corpus artifact directory
+        rows: Rows of the matrix the projection must cover
+        full_dimension: Embedding dimension of that matrix
+        source_stamp: The artifact manifest's source_stamp; a projection built from another corpus file is ignored
+
+    Returns:
+        The projection, or None (with a warning) if it is missing or stale
+    """
+    if not os.path.exists(os.path.join(artifact_path, PROJECTION_FILE)):
+        logger.warning(f"No projection in {artifact_path}; using exact search. Build it with "
+                       f"python -m app.services.projection_index <corpus.jsonl>")
+        return None
+    try:
+        projection = PCAProjection.load(artifact_path)
+    except Exception as e:
+        logger.warning(f"Could not load projection from {artifact_path}: {e}")
+        return None
+    if source_stamp is not None and projection.metadata.get('source_stamp') != source_stamp:
+        logger.warning(f"Projection in {artifact_path} was built from a different corpus file; rebuild it to use it")
+        return None
+    if projection.rows != rows or projection.components.shape[1] != full_dimension:
+        logger.warning(f"Projection in {artifact_path} covers {projection.rows} rows of dim "
+                       f"{projection.components.shape[1]} but the corpus has {rows} of dim {full_dimension}; "
+                       f"rebuild it to use it")
+        return None
+    logger.info(f"Loaded {projection.method} projection to {projection.dimension} dims "
+                f"(shortlist={projection.shortlist}) from {artifact_path}")
+    return projection
+
+
+def ensure_projection(artifact: CorpusArtifact) -> PCAProjection:
+    """Load the artifact's projection, building it first (at the default dimension) if it is missing or stale."""
+    if os.path.exists(os.path.join(artifact.path, PROJECTION_FILE)):
+        projection = load_projection(artifact.path, int(artifact.has_embedding.sum()), artifact.dimension,
+                                     artifact.manifest.get('source_stamp'))
+        if projection is not None:
+            return projection
+    logger.info(f"Building projection for {artifact.path}")
+    return build_projection(artifact)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from .corpus_artifact import build_corpus_artifact, load_corpus_artifact
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s')
+
+    parser = argparse.ArgumentParser(description="Build a reduced-dimension projection for two-stage vector search.")
+    parser.add_argument("input_file", help="Path to the JSONL corpus file.")
+    parser.add_argument("--dim", type=int, default=DEFAULT_PROJECTION_DIM, help="Projection dimension to store.")
+    parser.add_argument("--compare", type=int, nargs='*', default=[],
+                        help="Additional dimensions to report recall for before storing --dim.")
+    parser.add_argument("--method", choices=PROJECTION_METHODS, default='pca', help="PCA or plain truncation.")
+    parser.add_argument("--shortlist", type=int, default=DEFAULT_SHORTLIST, help="Coarse candidates re-scored per query.")
+    args = parser.parse_args()
+
+    artifact = load_corpus_artifact(args.input_file)
+    if artifact is None:
+        artifact = CorpusArtifact(build_corpus_artifact(args.input_file))
+    build_projection(artifact, args.dim, args.method, args.shortlist, args.compare)
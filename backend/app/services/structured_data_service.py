@@ -10,13 +10,20 @@ import csv
 import logging
 import os
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional, Union
+from typing import Dict, List, Any, Optional, Union, Set, Tuple
 from dataclasses import dataclass, asdict
 from pathlib import Path
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+# Length of the substrings indexed for search_entries
+NGRAM_SIZE = 3
+
+def _ngrams(text: str) -> Set[str]:
+    """All NGRAM_SIZE-character substrings of a string"""
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
 @dataclass
 class StructuredDataEntry:
     """Represents a structured data entry with metadata"""
@@ -43,8 +50,61 @@ class StructuredDataService:
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.structured_data_file = self.data_dir / "structured_data.json"
         self.structured_data: Dict[str, StructuredDataEntry] = {}
+        self._reset_indexes()
         self.load_existing_data()
     
+    def _reset_indexes(self) -> None:
+        """Clear the lookup indexes kept alongside structured_data"""
+        # entry id -> insertion position, so index lookups keep structured_data order
+        self._positions: Dict[str, int] = {}
+        # entry id -> lowercase (key, value, source) as matched by search_entries
+        self._search_text: Dict[str, Tuple[str, str, str]] = {}
+        # character n-gram -> ids of entries whose key, value or source contains it
+        self._ngram_index: Dict[str, Set[str]] = {}
+        # lowercase key -> entry ids, category -> entry ids (and each entry's indexed category)
+        self._ids_by_key: Dict[str, Set[str]] = {}
+        self._ids_by_category: Dict[str, Set[str]] = {}
+        self._categories: Dict[str, str] = {}
+    
+    def _index_entry(self, entry: StructuredDataEntry) -> None:
+        """Add an entry to the lookup indexes, replacing the indexed version of the same id"""
+        self._unindex_entry(entry.id)
+        self._positions.setdefault(entry.id, len(self._positions))
+        
+        # str(value) includes the repr of dict values such as county breakdowns
+        search_text = (entry.key.lower(), str(entry.value).lower(), entry.source.lower())
+        self._search_text[entry.id] = search_text
+        for field in search_text:
+            for ngram in _ngrams(field):
+                self._ngram_index.setdefault(ngram, set()).add(entry.id)
+        self._ids_by_key.setdefault(search_text[0], set()).add(entry.id)
+        self._ids_by_category.setdefault(entry.category, set()).add(entry.id)
+        self._categories[entry.id] = entry.category
+    
+    def _unindex_entry(self, entry_id: str) -> None:
+        """Remove the indexed version of an entry (which may differ from a since-mutated entry object)"""
+        search_text = self._search_text.pop(entry_id, None)
+        if search_text is None:
+            return
+        for field in search_text:
+            for ngram in _ngrams(field):
+                ids = self._ngram_index.get(ngram)
+                if ids is not None:
+                    ids.discard(entry_id)
+                    if not ids:
+                        del self._ngram_index[ngram]
+        category = self._categories.pop(entry_id)
+        for index, name in ((self._ids_by_key, search_text[0]), (self._ids_by_category, category)):
+            ids = index.get(name)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del index[name]
+    
+    def _entries_in_order(self, entry_ids: Set[str]) -> List[StructuredDataEntry]:
+        """Entries for a set of ids, in structured_data order"""
+        return [self.structured_data[entry_id] for entry_id in sorted(entry_ids, key=self._positions.__getitem__)]
+    
     def load_existing_data(self) -> None:
         """Load existing structured data from file"""
         try:
@@ -52,13 +112,16 @@ class StructuredDataService:
                 with open(self.structured_data_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     for entry_id, entry_data in data.items():
-                        self.structured_data[entry_id] = StructuredDataEntry(**entry_data)
+                        entry = StructuredDataEntry(**entry_data)
+                        self._index_entry(entry)
+                        self.structured_data[entry_id] = entry
                 logger.info(f"Loaded {len(self.structured_data)} structured data entries")
             else:
                 logger.info("No existing structured data file found, starting fresh")
         except Exception as e:
             logger.error(f"Error loading structured data: {e}")
             self.structured_data = {}
+            self._reset_indexes()
     
     def save_data(self) -> None:
         """Save structured data to file"""
@@ -78,6 +141,7 @@ class StructuredDataService:
         """Add or update a structured data entry"""
         try:
             entry.last_updated = datetime.now().isoformat()
+            self._index_entry(entry)
             self.structured_data[entry.id] = entry
             self.save_data()
             logger.info(f"Added/updated structured data entry: {entry.id}")
@@ -154,27 +218,37 @@ class StructuredDataService:
     
     def get_entries_by_category(self, category: str) -> List[StructuredDataEntry]:
         """Get all entries in a specific category"""
-        return [entry for entry in self.structured_data.values() if entry.category == category]
+        return self._entries_in_order(self._ids_by_category.get(category, set()))
     
     def get_entry_by_key(self, key: str) -> Optional[StructuredDataEntry]:
         """Get entry by key (first match)"""
-        for entry in self.structured_data.values():
-            if entry.key.lower() == key.lower():
-                return entry
-        return None
+        entry_ids = self._ids_by_key.get(key.lower())
+        if not entry_ids:
+            return None
+        return self.structured_data[min(entry_ids, key=self._positions.__getitem__)]
     
     def search_entries(self, query: str) -> List[StructuredDataEntry]:
-        """Search entries by key, value, or source"""
+        """Search entries by key, value, or source (case-insensitive substring match)"""
         query_lower = query.lower()
-        results = []
         
-        for entry in self.structured_data.values():
-            if (query_lower in entry.key.lower() or 
-                query_lower in str(entry.value).lower() or 
-                query_lower in entry.source.lower()):
-                results.append(entry)
+        # Entries containing every n-gram of the query are the only possible matches
+        if len(query_lower) >= NGRAM_SIZE:
+            candidates: Optional[Set[str]] = None
+            for ngram in sorted(_ngrams(query_lower), key=lambda ngram: len(self._ngram_index.get(ngram, ()))):
+                ids = self._ngram_index.get(ngram)
+                if not ids:
+                    return []
+                candidates = set(ids) if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+        else:
+            candidates = set(self._search_text)
         
-        return results
+        matches = {
+            entry_id for entry_id in candidates
+            if any(query_lower in field for field in self._search_text[entry_id])
+        }
+        return self._entries_in_order(matches)
     
     def get_stale_entries(self, max_age_days: int = 30) -> List[StructuredDataEntry]:
         """Get entries that are older than max_age_days"""
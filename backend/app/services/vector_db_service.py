@@ -1,12 +1,26 @@
 # eidbi-query-system/backend/app/services/vector_db_service.py
 
+import hashlib
+import itertools
 import logging
 import os
 import json
-import numpy as np
-from typing import List, Dict, Any, Tuple, Optional
 import re
+import numpy as np
+from typing import List, Dict, Any, Tuple, Optional, Sequence, Callable
+from collections import OrderedDict
 from .structured_data_service import StructuredDataService
+from .vector_index import VectorIndex, mmr_select
+from .keyword_index import KeywordIndex
+from .ann_index import load_ivf_index
+from .projection_index import load_projection
+from .partition_index import topic_labels, validate_filters
+from .corpus_artifact import (CorpusArtifact, ArtifactChunks, artifact_path_for, load_corpus_artifact,
+                              shared_artifact_path)
+from .chunk_store import ChunkStore
+from .index_snapshot import IndexSegment, IndexSnapshot, IndexSnapshotManager
+from .vector_store import (VectorStore, NumpyVectorStore, MmapVectorStore, MatchingEngineVectorStore,
+                           VECTOR_STORE_BACKENDS, VECTOR_STORE_MEMORY_BUDGET_MB, select_backend)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -16,6 +30,58 @@ DEFAULT_NUM_NEIGHBORS = 15  # Increased from 5 for better coverage
 DEFAULT_KEYWORD_RESULTS = 20  # Increased for better coverage
 DEFAULT_HYBRID_RESULTS = 12  # Increased for better coverage
 
+# Vector search engine: "exact" scans every row, "ivf" uses the approximate index built
+# offline with `python -m app.services.ann_index`, "pca" scans reduced-dimension projections
+# built with `python -m app.services.projection_index` and re-scores a shortlist at full
+# dimension (both fall back to exact if absent)
+VECTOR_SEARCH_ENGINE = os.getenv("VECTOR_SEARCH_ENGINE", "exact").lower()
+
+# Opt-in int8 first-pass scan with exact float32 re-scoring of VECTOR_RESCORE_FACTOR * k candidates
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))
+
+# Hierarchical search: documents whose chunks are scored, and chunks kept per document
+HIERARCHICAL_TOP_DOCUMENTS = int(os.getenv("HIERARCHICAL_TOP_DOCUMENTS", "20"))
+MAX_CHUNKS_PER_DOCUMENT = int(os.getenv("MAX_CHUNKS_PER_DOCUMENT", "2"))
+
+# Routed searches widen to the whole index when the routed partitions return fewer than the
+# requested results or, for max-sim vector scores, a best similarity below this
+ROUTING_MIN_SIMILARITY = float(os.getenv("ROUTING_MIN_SIMILARITY", "0.5"))
+
+# Result diversification before reranking: MMR trade-off between relevance (1.0) and
+# diversity (0.0), and the similarity at which a candidate counts as a near-duplicate
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+DUPLICATE_SIMILARITY = float(os.getenv("DUPLICATE_SIMILARITY", "0.95"))
+
+# Context expansion: neighbors merged on each side of a hit, and how many of the best hits are expanded
+CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", "1"))
+CONTEXT_EXPANSION_HITS = int(os.getenv("CONTEXT_EXPANSION_HITS", "3"))
+
+# How scores of several query expansions are fused: "max" (max-sim) or "rrf" (reciprocal rank)
+MULTI_QUERY_FUSION = os.getenv("MULTI_QUERY_FUSION", "max").lower()
+
+# How hybrid search fuses vector and BM25 scores: "weighted" (sum of max-normalized scores
+# weighted by vector_weight) or "rrf" (weighted reciprocal rank fusion)
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "weighted").lower()
+
+# Vector store holding the corpus embeddings: "auto" (numpy or mmap by corpus size),
+# "numpy", "mmap" or "matching_engine"; main.py sets it from settings.vector_db
+VECTOR_STORE = os.getenv("VECTOR_DB_STORE_BACKEND", "auto").lower()
+_vector_store_memory_budget_mb = VECTOR_STORE_MEMORY_BUDGET_MB
+_remote_store_settings: Dict[str, Optional[str]] = {
+    "project_id": os.getenv("GCP_PROJECT_ID"),
+    "region": os.getenv("GCP_REGION", "us-central1"),
+    "index_id": os.getenv("VECTOR_DB_INDEX_ID"),
+    "index_endpoint_id": os.getenv("VECTOR_DB_INDEX_ENDPOINT_ID")
+}
+
+# Index segments: the scraped corpus, the structured facts, then delta-<n> segments
+# for chunks upserted since the last full rebuild
+BASE_SEGMENT = "base"
+STRUCTURED_SEGMENT = "structured"
+# Delta segments are merged in the background once there are more than this many
+MAX_DELTA_SEGMENTS = int(os.getenv("MAX_DELTA_SEGMENTS", "8"))
+
 # Path to the scraped data file
 # When running in Docker, the file will be in /app directory
 # When running locally, try multiple paths
@@ -34,7 +100,8 @@ def get_scraped_data_path():
     ]
     
     for path in possible_paths:
-        if os.path.exists(path):
+        # A prebuilt corpus artifact is enough even if the JSONL was not shipped
+        if os.path.exists(path) or os.path.exists(artifact_path_for(path)):
             logger.info(f"Found scraped data at: {path}")
             return path
     
@@ -43,6 +110,29 @@ def get_scraped_data_path():
 
 SCRAPED_DATA_PATH = get_scraped_data_path()
 
+# Memory-backed directory (e.g. /dev/shm) the corpus artifact is published to before
+# uvicorn starts its workers; every worker then maps the same pages instead of a private copy
+CORPUS_SHARED_MEMORY_DIR = os.getenv("CORPUS_SHARED_MEMORY_DIR")
+
+# Number of uvicorn worker processes (uvicorn reads the same variable)
+WORKER_COUNT = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+def get_corpus_artifact_path() -> str:
+    """Get the corpus artifact to load, preferring the shared-memory copy when one is published."""
+    if os.getenv("CORPUS_ARTIFACT_PATH"):
+        return os.getenv("CORPUS_ARTIFACT_PATH")
+    path = artifact_path_for(SCRAPED_DATA_PATH)
+    if CORPUS_SHARED_MEMORY_DIR:
+        shared_path = shared_artifact_path(path, CORPUS_SHARED_MEMORY_DIR)
+        if os.path.exists(os.path.join(shared_path, 'manifest.json')):
+            logger.info(f"Attaching to shared corpus artifact at: {shared_path}")
+            return shared_path
+        logger.warning(f"No shared corpus artifact in {CORPUS_SHARED_MEMORY_DIR}; using {path}")
+    return path
+
+# Columnar artifact built from SCRAPED_DATA_PATH (see corpus_artifact.py)
+CORPUS_ARTIFACT_PATH = get_corpus_artifact_path()
+
 def cosine_similarity(a: List[float], b: List[float]) -> float:
     """Calculate the cosine similarity between two vectors."""
     a_norm = np.linalg.norm(a)
@@ -51,8 +141,13 @@ def cosine_similarity(a: List[float], b: List[float]) -> float:
         return 0.0
     return np.dot(a, b) / (a_norm * b_norm)
 
-def _load_data() -> List[Dict[str, Any]]:
-    """Load the scraped data from the JSONL file."""
+def _load_corpus() -> Tuple[Sequence[Dict[str, Any]], Optional[CorpusArtifact]]:
+    """Load the scraped data from the corpus artifact, or from the JSONL file if there is none."""
+    artifact = load_corpus_artifact(SCRAPED_DATA_PATH, CORPUS_ARTIFACT_PATH)
+    if artifact is not None:
+        # Embeddings and text stay in the memory-mapped artifact; chunks are materialized on access
+        return ArtifactChunks(artifact), artifact
+    
     data = []
     try:
         logger.info(f"Loading data from {SCRAPED_DATA_PATH}")
@@ -64,15 +159,22 @@ def _load_data() -> List[Dict[str, Any]]:
                 except json.JSONDecodeError:
                     logger.warning(f"Error decoding JSON line: {line[:50]}...")
         logger.info(f"Loaded {len(data)} chunks from {SCRAPED_DATA_PATH}")
-        return data
+        return data, None
     except Exception as e:
         logger.error(f"Error loading data from {SCRAPED_DATA_PATH}: {e}", exc_info=True)
-        return []
+        return [], None
+
+def _load_data() -> List[Dict[str, Any]]:
+    """Load the scraped data (without structured entries)."""
+    data, _ = _load_corpus()
+    return list(data)
 
-# Cache the loaded data
-_cached_data = None
 _structured_data_service = None
 
+# Chunks from additional data sources (additional_* ids), most recent last
+MAX_ADDITIONAL_CHUNKS = int(os.getenv("MAX_ADDITIONAL_CHUNKS", "500"))
+_additional_chunks: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
 def get_structured_data_service() -> StructuredDataService:
     """Get or initialize the structured data service"""
     global _structured_data_service
@@ -80,79 +182,452 @@ def get_structured_data_service() -> StructuredDataService:
         _structured_data_service = StructuredDataService()
     return _structured_data_service
 
-def _load_data_with_structured() -> List[Dict[str, Any]]:
-    """Load both regular and structured data"""
-    data = _load_data()  # Load regular data
-    
-    # Add structured data
+def _load_structured_chunks() -> List[Dict[str, Any]]:
+    """Load structured data entries in vector DB chunk format"""
     try:
         structured_service = get_structured_data_service()
         structured_entries = structured_service.to_vector_db_format()
         
         logger.info(f"Adding {len(structured_entries)} structured data entries")
-        data.extend(structured_entries)
+        return structured_entries
         
     except Exception as e:
         logger.warning(f"Could not load structured data: {e}")
+        return []
+
+def _load_data_with_structured() -> List[Dict[str, Any]]:
+    """Load both regular and structured data"""
+    return _load_data() + _load_structured_chunks()
+
+# Chunks upserted and ids deleted through the delta path; replayed on every full rebuild
+_delta_chunks: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_deleted_ids = set()
+_delta_sequence = itertools.count(1)
+
+def configure_vector_store(backend: str = "auto", memory_budget_mb: Optional[int] = None,
+                           remote_settings: Optional[Dict[str, Optional[str]]] = None) -> None:
+    """
+    Choose the vector store backend for the corpus embeddings.
+    
+    Call before the first search; later calls rebuild the index snapshot.
+    
+    Args:
+        backend: "auto", "numpy", "mmap" or "matching_engine"
+        memory_budget_mb: Largest corpus matrix "auto" keeps in memory
+        remote_settings: project_id, region, index_id and index_endpoint_id for "matching_engine"
+    """
+    global VECTOR_STORE, _vector_store_memory_budget_mb
+    backend = (backend or "auto").lower()
+    if backend != "auto" and backend not in VECTOR_STORE_BACKENDS:
+        logger.warning(f"Unknown vector store backend '{backend}', using auto")
+        backend = "auto"
+    VECTOR_STORE = backend
+    if memory_budget_mb:
+        _vector_store_memory_budget_mb = memory_budget_mb
+    if remote_settings:
+        _remote_store_settings.update({key: value for key, value in remote_settings.items() if value})
+    
+    if get_index_version() is not None:
+        refresh_index(background=False)
+
+def get_vector_store() -> Optional[VectorStore]:
+    """The vector store of the published snapshot, or None before the first load"""
+    if _snapshots.version is None:
+        return None
+    return _snapshots.current().vector_store
+
+def _create_vector_store(data: Sequence[Dict[str, Any]], artifact: Optional[CorpusArtifact]) -> VectorStore:
+    """Create the configured vector store over the corpus, sized for it when the backend is auto"""
+    backend = VECTOR_STORE
+    
+    if backend == 'matching_engine':
+        # Reuse the published remote store; the index it points to does not change on a rebuild
+        current = get_vector_store()
+        if isinstance(current, MatchingEngineVectorStore):
+            return current
+        settings = _remote_store_settings
+        if settings.get("project_id") and settings.get("index_id") and settings.get("index_endpoint_id"):
+            return MatchingEngineVectorStore.from_settings(
+                settings["project_id"], settings["region"], settings["index_id"], settings["index_endpoint_id"])
+        logger.warning("Matching Engine index or endpoint not configured; using a local vector store")
+        backend = 'auto'
+    
+    if backend == 'auto' and artifact is not None and (CORPUS_SHARED_MEMORY_DIR or WORKER_COUNT > 1):
+        # A private in-memory copy per worker is what the shared artifact avoids
+        logger.info(f"Sharing the corpus matrix across {WORKER_COUNT} workers; using the mmap vector store")
+        backend = 'mmap'
+    
+    if backend == 'auto':
+        if artifact is not None:
+            backend = select_backend(len(artifact), artifact.dimension, _vector_store_memory_budget_mb)
+        else:
+            dimension = next((len(chunk['embedding']) for chunk in data if chunk.get('embedding')), 0)
+            backend = select_backend(len(data), dimension, _vector_store_memory_budget_mb)
+    
+    if backend == 'mmap':
+        if artifact is not None:
+            return MmapVectorStore(artifact)
+        # Building the artifact here would run on the request path, in every worker at once
+        logger.warning(f"No corpus artifact to memory-map at {CORPUS_ARTIFACT_PATH}; keeping embeddings in memory. "
+                       f"Build it before starting the server: python -m app.services.corpus_artifact {SCRAPED_DATA_PATH}")
+    
+    if artifact is not None:
+        return NumpyVectorStore.from_artifact(artifact)
+    return NumpyVectorStore.from_chunks(data)
+
+def _build_base_segment(data: Sequence[Dict[str, Any]], artifact: Optional[CorpusArtifact]) -> Tuple[IndexSegment, VectorStore]:
+    """Index the scraped corpus, with its embeddings held by the configured vector store"""
+    store = _create_vector_store(data, artifact)
+    
+    if isinstance(store, MatchingEngineVectorStore):
+        # Embeddings are searched remotely; the segment only indexes text
+        vector_index = VectorIndex([], np.zeros((0, 0), dtype=np.float32), normalized=True)
+    else:
+        vector_index = store.index
+        artifact = getattr(store, 'artifact', artifact)
+        if VECTOR_SEARCH_ENGINE == 'ivf' and artifact is not None:
+            vector_index.ann = load_ivf_index(artifact.path, len(vector_index), artifact.manifest.get('source_stamp'))
+        if VECTOR_SEARCH_ENGINE == 'pca' and artifact is not None:
+            vector_index.projection = load_projection(artifact.path, len(vector_index), vector_index.dimension,
+                                                      artifact.manifest.get('source_stamp'))
+        if VECTOR_QUANTIZATION == 'int8':
+            vector_index.enable_quantization(VECTOR_RESCORE_FACTOR)
+    
+    # The store now holds the embeddings; keep text and metadata in the compact chunk store
+    if isinstance(data, ArtifactChunks):
+        chunks = ChunkStore.from_artifact(data.artifact)
+    else:
+        chunks = ChunkStore.from_chunks(data)
+    
+    logger.info(f"Vector store: {store.backend}")
+    segment = IndexSegment(BASE_SEGMENT, chunks, vector_index, KeywordIndex(chunks.iter_search_fields()), artifact)
+    return segment, store
+
+def _build_segment(name: str, chunks: List[Dict[str, Any]]) -> IndexSegment:
+    """Build the vector and keyword indexes over the chunks of a structured or delta segment"""
+    vector_index = VectorIndex.from_chunks(chunks)
+    # The matrix now holds the embeddings; drop the per-chunk float lists
+    for chunk in chunks:
+        chunk.pop('embedding', None)
+    if VECTOR_QUANTIZATION == 'int8':
+        vector_index.enable_quantization(VECTOR_RESCORE_FACTOR)
+    
+    return IndexSegment(name, chunks, vector_index, KeywordIndex(chunks))
+
+def _next_delta_name() -> str:
+    """Unique name for a new delta segment"""
+    return f"delta-{next(_delta_sequence)}"
+
+def _is_delta(segment: IndexSegment) -> bool:
+    """Whether a segment holds upserted chunks (as opposed to the corpus or structured data)"""
+    return segment.name not in (BASE_SEGMENT, STRUCTURED_SEGMENT)
+
+def _build_snapshot(version: str) -> IndexSnapshot:
+    """Load the corpus and structured data, build every index over them and replay the deltas"""
+    data, artifact = _load_corpus()
+    base, store = _build_base_segment(data, artifact)
+    segments = [base, _build_segment(STRUCTURED_SEGMENT, _load_structured_chunks())]
+    if _delta_chunks:
+        segments.append(_build_segment(_next_delta_name(), [dict(chunk) for chunk in _delta_chunks.values()]))
+    
+    # The store is published together with the segments it backs, never ahead of them
+    return IndexSnapshot(version, segments, frozenset(_deleted_ids), store)
+
+# Published index snapshot; replaced atomically by refresh_index() and the delta updates below
+_snapshots = IndexSnapshotManager(_build_snapshot)
+
+def get_index_snapshot() -> IndexSnapshot:
+    """Get the current index snapshot (loads the corpus on first use)"""
+    return _snapshots.current()
+
+def get_index_version() -> Optional[str]:
+    """Version of the published index snapshot, or None if nothing is loaded yet"""
+    return _snapshots.version
+
+def get_index_memory_usage() -> Optional[Dict[str, Any]]:
+    """Memory used by each component of the published snapshot, or None if nothing is loaded yet"""
+    if _snapshots.version is None:
+        return None
+    snapshot = get_index_snapshot()
+    usage = snapshot.memory_usage()
+    if snapshot.vector_store is not None and not isinstance(snapshot.vector_store, MatchingEngineVectorStore):
+        # Remote stats need a network round trip; only local stores are reported here
+        usage["vector_store"] = snapshot.vector_store.stats()
+    return usage
+
+def refresh_index(background: bool = True) -> None:
+    """
+    Rebuild the index snapshot from the current data and swap it in.
     
-    return data
+    Args:
+        background: Build in a worker thread; queries keep using the current snapshot meanwhile
+    """
+    _snapshots.refresh(background=background)
+
+def _vector_dimension(snapshot: IndexSnapshot) -> int:
+    """Embedding dimension of the indexed corpus (0 if nothing has embeddings)"""
+    if isinstance(snapshot.vector_store, MatchingEngineVectorStore):
+        return snapshot.vector_store.dimension
+    for segment in snapshot.segments:
+        if segment.vector_index.dimension:
+            return segment.vector_index.dimension
+    return 0
 
-def find_neighbors(query_embedding: List[float], num_neighbors_override: Optional[int] = None) -> List[Tuple[str, float]]:
+def upsert_chunks(chunks: List[Dict[str, Any]]) -> bool:
+    """
+    Add or replace chunks without rebuilding the corpus indexes.
+    
+    The chunks are indexed as a new delta segment that shadows older versions of
+    the same ids, so the cost grows with the number of chunks, not the corpus.
+    
+    Args:
+        chunks: Chunk dictionaries with 'id', 'content' and optionally 'embedding'
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    chunks = [dict(chunk) for chunk in chunks if chunk.get('id')]
+    if not chunks:
+        return False
+    
+    def add_delta(snapshot: IndexSnapshot, version: str) -> IndexSnapshot:
+        dimension = _vector_dimension(snapshot)
+        for chunk in chunks:
+            embedding = chunk.get('embedding')
+            if embedding and dimension and len(embedding) != dimension:
+                logger.warning(f"Dropping embedding of chunk {chunk['id']}: dimension {len(embedding)} != {dimension}")
+                chunk.pop('embedding')
+        replay = [dict(chunk) for chunk in chunks]
+        
+        segment = _build_segment(_next_delta_name(), chunks)
+        upserted = frozenset(chunk['id'] for chunk in chunks)
+        for chunk in replay:
+            _delta_chunks[chunk['id']] = chunk
+            _delta_chunks.move_to_end(chunk['id'])
+        _deleted_ids.difference_update(upserted)
+        return IndexSnapshot(version, snapshot.segments + [segment], snapshot.deleted - upserted,
+                             snapshot.vector_store)
+    
+    snapshot = _snapshots.update(add_delta)
+    if snapshot is None:
+        return False
+    
+    logger.info(f"Upserted {len(chunks)} chunks into index snapshot {snapshot.version}")
+    if sum(1 for segment in snapshot.segments if _is_delta(segment)) > MAX_DELTA_SEGMENTS:
+        compact_index()
+    return True
+
+def delete_chunks(chunk_ids: List[str]) -> bool:
+    """
+    Remove chunks from search results without rebuilding the corpus indexes.
+    
+    Deleted ids are recorded as tombstones; compaction drops deleted delta chunks.
+    
+    Args:
+        chunk_ids: Ids of the chunks to delete
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    deleted = frozenset(chunk_ids)
+    if not deleted:
+        return False
+    
+    def add_tombstones(snapshot: IndexSnapshot, version: str) -> IndexSnapshot:
+        for chunk_id in deleted:
+            _delta_chunks.pop(chunk_id, None)
+        _deleted_ids.update(deleted)
+        return IndexSnapshot(version, snapshot.segments, snapshot.deleted | deleted, snapshot.vector_store)
+    
+    snapshot = _snapshots.update(add_tombstones)
+    if snapshot is None:
+        return False
+    
+    logger.info(f"Deleted {len(deleted)} chunks in index snapshot {snapshot.version}")
+    return True
+
+def refresh_structured_index() -> bool:
+    """
+    Re-index only the structured data segment after a structured-data change.
+    
+    Returns:
+        True if successful, False otherwise
+    """
+    def replace_structured(snapshot: IndexSnapshot, version: str) -> IndexSnapshot:
+        segment = _build_segment(STRUCTURED_SEGMENT, _load_structured_chunks())
+        segments = [segment if existing.name == STRUCTURED_SEGMENT else existing for existing in snapshot.segments]
+        return IndexSnapshot(version, segments, snapshot.deleted, snapshot.vector_store)
+    
+    return _snapshots.update(replace_structured) is not None
+
+def _compact_deltas(snapshot: IndexSnapshot, version: str) -> IndexSnapshot:
+    """Merge all delta segments into one, dropping shadowed and deleted chunks"""
+    deltas = [segment for segment in snapshot.segments if _is_delta(segment)]
+    kept = [segment for segment in snapshot.segments if not _is_delta(segment)]
+    
+    chunks: List[Dict[str, Any]] = []
+    ids: List[str] = []
+    blocks: List[np.ndarray] = []
+    for segment in deltas:
+        live = list(snapshot.iter_segment_chunks(segment))
+        chunks.extend(live)
+        rows = segment.vector_rows([chunk['id'] for chunk in live])
+        if rows.size:
+            ids.extend(segment.vector_index.ids[row] for row in rows)
+            blocks.append(np.asarray(segment.vector_index.matrix[rows]))
+    
+    if chunks:
+        matrix = np.vstack(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+        vector_index = VectorIndex(ids, matrix, normalized=True)
+        if VECTOR_QUANTIZATION == 'int8':
+            vector_index.enable_quantization(VECTOR_RESCORE_FACTOR)
+        kept.append(IndexSegment(_next_delta_name(), chunks, vector_index, KeywordIndex(chunks)))
+    
+    # Tombstones are only needed for ids that still exist in the base or structured segments
+    deleted = frozenset(chunk_id for chunk_id in snapshot.deleted
+                        if any(chunk_id in segment.row_by_id for segment in kept if not _is_delta(segment)))
+    logger.info(f"Compacted {len(deltas)} delta segments into {len(chunks)} chunks")
+    return IndexSnapshot(version, kept, deleted, snapshot.vector_store)
+
+def compact_index(background: bool = True) -> None:
+    """
+    Merge the delta segments of the current snapshot and swap the result in.
+    
+    Args:
+        background: Compact in a worker thread; queries keep using the current snapshot meanwhile
+    """
+    _snapshots.update(_compact_deltas, background=background)
+
+def _merge_remote_results(snapshot: IndexSnapshot, local: List[Tuple[str, float]],
+                          remote: List[Tuple[str, float]], k: int,
+                          partitions: Optional[List[str]] = None,
+                          filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+    """Merge remote base-corpus hits with the local segment hits, dropping deleted, superseded or filtered-out ids"""
+    base = snapshot.segment(BASE_SEGMENT)
+    if base is None:
+        return local[:k]
+    hits = local + [hit for hit in remote if snapshot.is_live(hit[0], base) and
+                    (not (partitions or filters) or base.partitions.contains(base.row_by_id[hit[0]], partitions, filters))]
+    hits.sort(key=lambda item: item[1], reverse=True)
+    return hits[:k]
+
+def find_neighbors(query_embedding: List[float], num_neighbors_override: Optional[int] = None,
+                   engine: Optional[str] = None, partitions: Optional[List[str]] = None,
+                   filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
     """
     Find nearest neighbors to the query embedding in the local data (including structured data).
     
     Args:
         query_embedding: The embedding vector to search for
         num_neighbors_override: Optional override for the number of neighbors to return
+        engine: "exact", "ivf" or "pca" (defaults to VECTOR_SEARCH_ENGINE)
+        partitions: Optional partition labels (e.g. "topic:billing_claims") to restrict the search to
+        filters: Optional metadata filter expression applied before scoring, e.g.
+            {"source_type": ["official_website"], "updated_after": "2024-01-01"}
+            (see partition_index.validate_filters)
         
     Returns:
         List of (chunk_id, distance) tuples sorted by similarity (highest first)
+        
+    Raises:
+        ValueError: If the filter expression is invalid
     """
-    global _cached_data
-    
-    # Load data if not already cached (including structured data)
-    if _cached_data is None:
-        _cached_data = _load_data_with_structured()
+    filters = validate_filters(filters)
+    snapshot = get_index_snapshot()
     
-    if not _cached_data:
+    if not _vector_dimension(snapshot):
         logger.warning("No data loaded for vector search.")
         return []
     
     # Number of neighbors to return (increased default for better coverage)
     num_neighbors = num_neighbors_override or DEFAULT_NUM_NEIGHBORS
     
-    # Calculate similarity with each chunk
-    results = []
-    for chunk in _cached_data:
-        if 'embedding' not in chunk or not chunk['embedding'] or 'id' not in chunk:
-            continue
-            
-        similarity = cosine_similarity(query_embedding, chunk['embedding'])
+    engine = (engine or VECTOR_SEARCH_ENGINE).lower()
+    if engine == 'ivf' and snapshot.segments[0].vector_index.ann is None:
+        logger.debug("No IVF index loaded; using exact search")
+    elif engine == 'pca' and snapshot.segments[0].vector_index.projection is None:
+        logger.debug("No projection loaded; using exact search")
+    
+    # Score every chunk (or the probed IVF lists) of each segment with one matrix-vector product and keep the top_k
+    if partitions or filters:
+        results = snapshot.vector_search_batch([query_embedding], num_neighbors, engine=engine,
+                                               partitions=partitions, filters=filters)
+    else:
+        results = snapshot.vector_search(query_embedding, num_neighbors, engine=engine)
+    if isinstance(snapshot.vector_store, MatchingEngineVectorStore):
+        results = _merge_remote_results(snapshot, results, snapshot.vector_store.search(query_embedding, num_neighbors),
+                                        num_neighbors, partitions, filters)
+    return results
+
+def find_neighbors_multi(query_embeddings: List[List[float]], num_neighbors_override: Optional[int] = None,
+                         fusion: Optional[str] = None, engine: Optional[str] = None,
+                         partitions: Optional[List[str]] = None,
+                         filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+    """
+    Find nearest neighbors for several embeddings of the same query (e.g. its expansions).
+    
+    All embeddings are scored in one matrix-matrix product and the per-variant
+    scores are fused into a single candidate list.
+    
+    Args:
+        query_embeddings: The embedding vectors of the query variants
+        num_neighbors_override: Optional override for the number of neighbors to return
+        fusion: "max" or "rrf" (defaults to MULTI_QUERY_FUSION)
+        engine: "exact", "ivf" or "pca" (defaults to VECTOR_SEARCH_ENGINE)
+        partitions: Optional partition labels to restrict the search to
+        filters: Optional metadata filter expression applied before scoring
         
-        results.append((chunk['id'], similarity))
+    Returns:
+        List of (chunk_id, fused_score) tuples sorted by fused score (highest first)
+        
+    Raises:
+        ValueError: If the filter expression is invalid
+    """
+    if len(query_embeddings) == 1:
+        return find_neighbors(query_embeddings[0], num_neighbors_override, engine, partitions, filters)
     
-    # Sort by similarity (highest first) and take top_k
-    results.sort(key=lambda x: x[1], reverse=True)
-    return results[:num_neighbors]
+    filters = validate_filters(filters)
+    snapshot = get_index_snapshot()
+    
+    if not _vector_dimension(snapshot):
+        logger.warning("No data loaded for vector search.")
+        return []
+    
+    num_neighbors = num_neighbors_override or DEFAULT_NUM_NEIGHBORS
+    fusion = (fusion or MULTI_QUERY_FUSION).lower()
+    engine = (engine or VECTOR_SEARCH_ENGINE).lower()
+    
+    logger.info(f"Searching {len(query_embeddings)} query embeddings in one pass (fusion={fusion})")
+    results = snapshot.vector_search_batch(query_embeddings, num_neighbors, fusion=fusion, engine=engine,
+                                           partitions=partitions, filters=filters)
+    if isinstance(snapshot.vector_store, MatchingEngineVectorStore):
+        remote = snapshot.vector_store.batch_search(query_embeddings, num_neighbors, fusion=fusion)
+        results = _merge_remote_results(snapshot, results, remote, num_neighbors, partitions, filters)
+    return results
 
-def keyword_search(keywords: List[str], num_results: int = None) -> List[Tuple[str, int]]:
+def keyword_search(keywords: List[str], num_results: int = None, partitions: Optional[List[str]] = None,
+                   filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
     """
     Search for chunks containing specific keywords (including structured data)
     
+    Uses the BM25 inverted index; multi-word keywords are matched as exact phrases.
+    
     Args:
         keywords: List of keywords to search for
         num_results: Maximum number of results to return
+        partitions: Optional partition labels to restrict the search to
+        filters: Optional metadata filter expression applied before scoring
         
     Returns:
-        List of (chunk_id, match_count) tuples sorted by match count
+        List of (chunk_id, bm25_score) tuples sorted by score
+        
+    Raises:
+        ValueError: If the filter expression is invalid
     """
-    global _cached_data
-    
-    # Load data if not already cached (including structured data)
-    if _cached_data is None:
-        _cached_data = _load_data_with_structured()
+    filters = validate_filters(filters)
+    snapshot = get_index_snapshot()
     
-    if not _cached_data:
+    if not len(snapshot):
         logger.warning("No data loaded for keyword search.")
         return []
     
@@ -162,86 +637,129 @@ def keyword_search(keywords: List[str], num_results: int = None) -> List[Tuple[s
     
     logger.info(f"Performing keyword search for: {keywords}")
     
-    keyword_results = []
-    
-    for chunk in _cached_data:
-        if 'id' not in chunk or 'content' not in chunk:
-            continue
-        
-        content_lower = chunk['content'].lower()
-        title_lower = chunk.get('title', '').lower()
-        
-        # Count keyword matches
-        match_count = 0
-        matched_keywords = set()
-        
-        for keyword in keywords:
-            keyword_lower = keyword.lower()
-            
-            # Count occurrences in content
-            content_matches = len(re.findall(rf'\b{re.escape(keyword_lower)}\b', content_lower))
-            
-            # Bonus for title matches
-            title_matches = len(re.findall(rf'\b{re.escape(keyword_lower)}\b', title_lower))
-            title_matches *= 3  # Title matches are worth more
-            
-            if content_matches > 0 or title_matches > 0:
-                matched_keywords.add(keyword)
-                match_count += content_matches + title_matches
-        
-        # Only include chunks that match at least one keyword
-        if match_count > 0:
-            keyword_results.append((chunk['id'], match_count, len(matched_keywords)))
-    
-    # Sort by match count (descending), then by number of different keywords matched
-    keyword_results.sort(key=lambda x: (x[1], x[2]), reverse=True)
-    
-    # Return only chunk_id and match_count
-    results = [(chunk_id, match_count) for chunk_id, match_count, _ in keyword_results[:num_results]]
+    results = snapshot.keyword_search(keywords, num_results, partitions, filters)
     
     logger.info(f"Keyword search found {len(results)} matching chunks")
     return results
 
+def _routed_search(search: Callable[[Optional[List[str]]], List[Tuple[str, float]]], partitions: Optional[List[str]],
+                   min_results: int, min_score: Optional[float] = None) -> List[Tuple[str, float]]:
+    """Run a search over the routed partitions first; widen to every chunk when the results are weak"""
+    if partitions:
+        results = search(partitions)
+        if len(results) >= min_results and (min_score is None or results[0][1] >= min_score):
+            return results
+        best = f"{results[0][1]:.3f}" if results else "none"
+        logger.info(f"Routed search over {partitions} was weak ({len(results)} results, best {best}); widening")
+    return search(None)
+
 def hybrid_search(
     query_embedding: List[float], 
     keywords: List[str],
     num_results: int = None,
-    vector_weight: float = 0.7
+    vector_weight: float = 0.7,
+    query_embeddings: Optional[List[List[float]]] = None,
+    query_type: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    fusion: Optional[str] = None
 ) -> List[Tuple[str, float]]:
     """
     Perform enhanced hybrid search combining vector similarity and keyword matching
     
+    Vector similarity, BM25 and the structured data boost are computed for every
+    chunk in one pass over the index and fused (see IndexSnapshot.hybrid_search).
+    
     Args:
         query_embedding: The embedding vector for semantic search
         keywords: Keywords for keyword matching
         num_results: Number of results to return
         vector_weight: Weight for vector search (0-1), keyword gets 1-vector_weight
+        query_embeddings: Optional embeddings of all query expansions; when given they
+            are searched together (see find_neighbors_multi) instead of query_embedding alone
+        query_type: Optional QueryType value; the search is routed to its topic partitions first
+        filters: Optional metadata filter expression; every result, structured data
+            included, matches it (see partition_index.validate_filters)
+        fusion: "weighted" or "rrf" (defaults to HYBRID_FUSION)
         
     Returns:
         List of (chunk_id, combined_score) tuples
+        
+    Raises:
+        ValueError: If the filter expression is invalid
     """
+    filters = validate_filters(filters)
+    
     # Use enhanced default for better coverage
     if num_results is None:
         num_results = DEFAULT_HYBRID_RESULTS
+    fusion = (fusion or HYBRID_FUSION).lower()
         
-    logger.info(f"Performing hybrid search with vector_weight={vector_weight}")
-    
-    # Get vector search results with expanded coverage
-    vector_results = find_neighbors(query_embedding, num_results * 3)  # Get more for better coverage
+    logger.info(f"Performing hybrid search with vector_weight={vector_weight}, fusion={fusion}")
     
-    # Get keyword search results with expanded coverage
-    keyword_results = keyword_search(keywords, num_results * 3)
+    partitions = topic_labels(query_type)
+    if partitions:
+        logger.info(f"Routing {query_type} query to partitions {partitions}")
+    if filters:
+        logger.info(f"Filtering search with {filters}")
     
     # Check for structured data matches first (prioritize exact facts)
-    structured_matches = search_structured_data(keywords)
+    structured_boost = 1.5  # Boost factor for structured data
+    boosts = {chunk_id: relevance_score * structured_boost
+              for chunk_id, relevance_score in search_structured_data(keywords)}
     
-    # Combine scores
-    combined_scores = {}
+    snapshot = get_index_snapshot()
+    if isinstance(snapshot.vector_store, MatchingEngineVectorStore):
+        # The corpus embeddings are remote, so vector and keyword results are merged afterwards
+        return _merged_hybrid_search(query_embedding, keywords, num_results, vector_weight, query_embeddings,
+                                     partitions, filters, boosts)
+    
+    embeddings = query_embeddings or [query_embedding]
+    search = lambda labels: snapshot.hybrid_search(embeddings, keywords, num_results, vector_weight, fusion,
+                                                   boosts, labels, filters, VECTOR_SEARCH_ENGINE,
+                                                   variant_fusion=MULTI_QUERY_FUSION)
+    if partitions:
+        # Fused scores have their own scale, so routing is judged by the best vector
+        # similarity, as in the merged path (see _routed_search)
+        results, best_similarity = search(partitions)
+        if len(results) >= num_results and (best_similarity is None or best_similarity >= ROUTING_MIN_SIMILARITY):
+            return results
+        best = f"{best_similarity:.3f}" if best_similarity is not None else "none"
+        logger.info(f"Routed hybrid search over {partitions} was weak ({len(results)} results, "
+                    f"best similarity {best}); widening")
+    return search(None)[0]
+
+def _merged_hybrid_search(
+    query_embedding: List[float],
+    keywords: List[str],
+    num_results: int,
+    vector_weight: float,
+    query_embeddings: Optional[List[List[float]]],
+    partitions: Optional[List[str]],
+    filters: Optional[Dict[str, Any]],
+    boosts: Dict[str, float]
+) -> List[Tuple[str, float]]:
+    """Hybrid search as separate vector and keyword searches whose normalized scores are merged (remote store)"""
+    # Get vector search results with expanded coverage
+    if query_embeddings and len(query_embeddings) > 1:
+        # Fused scores are only similarities under max-sim fusion
+        min_similarity = ROUTING_MIN_SIMILARITY if MULTI_QUERY_FUSION == 'max' else None
+        vector_results = _routed_search(lambda labels: find_neighbors_multi(query_embeddings, num_results * 3,
+                                                                             partitions=labels, filters=filters),
+                                        partitions, num_results, min_similarity)
+    else:
+        embedding = query_embeddings[0] if query_embeddings else query_embedding
+        vector_results = _routed_search(lambda labels: find_neighbors(embedding, num_results * 3,
+                                                                       partitions=labels, filters=filters),
+                                        partitions, num_results, ROUTING_MIN_SIMILARITY)  # Get more for better coverage
+    
+    # Get BM25 keyword search results with expanded coverage
+    keyword_results = _routed_search(lambda labels: keyword_search(keywords, num_results * 3,
+                                                                    partitions=labels, filters=filters),
+                                     partitions, num_results)
     
     # Prioritize structured data matches (give them highest scores)
-    structured_boost = 1.5  # Boost factor for structured data
-    for chunk_id, relevance_score in structured_matches:
-        combined_scores[chunk_id] = relevance_score * structured_boost
+    snapshot = get_index_snapshot()
+    combined_scores = {chunk_id: boost for chunk_id, boost in boosts.items() if snapshot.matches_filters(chunk_id, filters)}
     
     # Add vector scores (normalized)
     if vector_results:
@@ -257,9 +775,9 @@ def hybrid_search(
     
     # Add keyword scores (normalized)
     if keyword_results:
-        max_keyword_score = max(count for _, count in keyword_results)
-        for chunk_id, count in keyword_results:
-            normalized_score = count / max_keyword_score if max_keyword_score > 0 else 0
+        max_keyword_score = max(score for _, score in keyword_results)
+        for chunk_id, score in keyword_results:
+            normalized_score = score / max_keyword_score if max_keyword_score > 0 else 0
             keyword_contribution = (1 - vector_weight) * normalized_score
             
             if chunk_id in combined_scores:
@@ -273,6 +791,174 @@ def hybrid_search(
     
     return results[:num_results]
 
+def hierarchical_search(
+    query_embedding: List[float],
+    keywords: List[str],
+    num_results: int = None,
+    vector_weight: float = 0.7,
+    query_embeddings: Optional[List[List[float]]] = None,
+    num_documents: Optional[int] = None,
+    max_chunks_per_document: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None
+) -> List[Tuple[str, float]]:
+    """
+    Hybrid search that selects the top documents first and then searches only their chunks
+    
+    Results are grouped per document with at most max_chunks_per_document chunks
+    each, so one page cannot fill the prompt with overlapping chunks.
+    
+    Args:
+        query_embedding: The embedding vector for semantic search
+        keywords: Keywords for keyword matching
+        num_results: Number of results to return
+        vector_weight: Weight for vector search (0-1), keyword gets 1-vector_weight
+        query_embeddings: Optional embeddings of all query expansions
+        num_documents: Documents whose chunks are searched (defaults to HIERARCHICAL_TOP_DOCUMENTS)
+        max_chunks_per_document: Chunks kept per document (defaults to MAX_CHUNKS_PER_DOCUMENT)
+        filters: Optional metadata filter expression every result matches
+        
+    Returns:
+        List of (chunk_id, score) tuples, structured data matches first, then grouped per document
+        
+    Raises:
+        ValueError: If the filter expression is invalid
+    """
+    filters = validate_filters(filters)
+    if num_results is None:
+        num_results = DEFAULT_HYBRID_RESULTS
+    snapshot = get_index_snapshot()
+    if isinstance(snapshot.vector_store, MatchingEngineVectorStore):
+        # The corpus embeddings are remote, so there are no local document centroids
+        logger.info("Hierarchical search needs local embeddings; using hybrid search")
+        return hybrid_search(query_embedding, keywords, num_results, vector_weight, query_embeddings, filters=filters)
+    
+    num_documents = max(num_documents or HIERARCHICAL_TOP_DOCUMENTS, 1)
+    max_chunks_per_document = max(max_chunks_per_document or MAX_CHUNKS_PER_DOCUMENT, 1)
+    logger.info(f"Performing hierarchical search over the top {num_documents} documents "
+                f"({max_chunks_per_document} chunks per document)")
+    
+    document_results = snapshot.document_search(query_embeddings or [query_embedding], keywords, num_results,
+                                                num_documents, max_chunks_per_document, vector_weight, filters)
+    
+    # Exact facts first, as in hybrid_search
+    structured_boost = 1.5
+    results = sorted(((chunk_id, score * structured_boost) for chunk_id, score in search_structured_data(keywords)
+                      if snapshot.matches_filters(chunk_id, filters)),
+                     key=lambda item: item[1], reverse=True)
+    seen = {chunk_id for chunk_id, _ in results}
+    results.extend(hit for hit in document_results if hit[0] not in seen)
+    return results[:num_results]
+
+def content_fingerprint(content: str) -> str:
+    """Hash of chunk content with case and whitespace normalized, for exact-duplicate detection"""
+    normalized = re.sub(r'\s+', ' ', content or '').strip().lower()
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+def diversify_results(
+    results: List[Tuple[str, float]],
+    num_results: int,
+    mmr_lambda: Optional[float] = None,
+    duplicate_similarity: Optional[float] = None
+) -> List[Tuple[str, float]]:
+    """
+    Drop duplicate results and pick a diverse subset with maximal marginal relevance
+    
+    Chunks with identical normalized content are collapsed to the best-scored one.
+    The rest are picked by MMR over their embeddings (see vector_index.mmr_select),
+    which also drops chunks nearly identical to an already picked one, e.g. the
+    overlapping neighbors of a chunk. Chunks without a local embedding (additional
+    sources, remote corpus) are picked by relevance alone.
+    
+    Args:
+        results: (chunk_id, score) tuples from any search
+        num_results: Number of results to keep
+        mmr_lambda: Relevance/diversity trade-off (defaults to MMR_LAMBDA)
+        duplicate_similarity: Near-duplicate similarity (defaults to DUPLICATE_SIMILARITY)
+        
+    Returns:
+        List of (chunk_id, score) tuples in MMR pick order, with their original scores
+    """
+    mmr_lambda = MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    duplicate_similarity = DUPLICATE_SIMILARITY if duplicate_similarity is None else duplicate_similarity
+    snapshot = get_index_snapshot()
+    
+    # Exact duplicates: keep the best-scored chunk of each content hash
+    candidates = []
+    seen_ids, seen_fingerprints = set(), set()
+    for chunk_id, score in sorted(results, key=lambda item: item[1], reverse=True):
+        chunk = _lookup_chunk(chunk_id, snapshot)
+        if chunk_id in seen_ids or chunk is None:
+            continue
+        seen_ids.add(chunk_id)
+        fingerprint = content_fingerprint(chunk.get('content', ''))
+        if fingerprint in seen_fingerprints:
+            continue
+        seen_fingerprints.add(fingerprint)
+        candidates.append((chunk_id, score))
+    if not candidates:
+        return []
+    
+    dimension = _vector_dimension(snapshot)
+    scores = np.asarray([score for _, score in candidates], dtype=np.float32)
+    relevance = scores / scores.max() if scores.max() > 0 else np.ones_like(scores)
+    embeddings = snapshot.get_embeddings([chunk_id for chunk_id, _ in candidates], dimension)
+    picked = mmr_select(relevance, embeddings, num_results, mmr_lambda, duplicate_similarity)
+    
+    logger.info(f"Diversified {len(results)} results to {len(picked)} "
+                f"({len(results) - len(candidates)} exact duplicates or unknown ids dropped)")
+    return [candidates[i] for i in picked]
+
+def expand_chunk_context(
+    chunks: List[Dict[str, Any]],
+    window: Optional[int] = None,
+    max_expanded: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Replace the best chunks by contiguous passages of themselves and their neighbors
+    
+    The preceding and following chunks of a hit come from the page-order index of
+    its segment (see IndexSnapshot.passage), so no further search or scan is
+    needed, and their overlapping text is kept once.
+    
+    Args:
+        chunks: Chunks in rank order, e.g. after reranking
+        window: Neighbors merged on each side (defaults to CONTEXT_WINDOW)
+        max_expanded: Number of leading chunks expanded (defaults to CONTEXT_EXPANSION_HITS)
+        
+    Returns:
+        Chunks in the same order; expanded ones are copies whose content is the passage
+        and whose 'context_chunk_ids' lists the merged chunks. Chunks already merged into
+        an earlier passage are dropped.
+    """
+    window = CONTEXT_WINDOW if window is None else window
+    max_expanded = CONTEXT_EXPANSION_HITS if max_expanded is None else max_expanded
+    snapshot = get_index_snapshot()
+    
+    expanded = []
+    covered = set()
+    for rank, chunk in enumerate(chunks):
+        chunk_id = chunk.get('id')
+        if chunk_id in covered:
+            continue
+        chunk_ids, content = [], ''
+        if rank < max_expanded and window > 0:
+            # Passages stop at chunks already in the results, so no text is repeated
+            chunk_ids, content = snapshot.passage(chunk_id, window, window, exclude=covered)
+        if len(chunk_ids) <= 1:
+            expanded.append(chunk)
+            covered.add(chunk_id)
+            continue
+        passage = dict(chunk)
+        passage['content'] = content
+        passage['context_chunk_ids'] = chunk_ids
+        expanded.append(passage)
+        covered.update(chunk_ids)
+    
+    merged = sum(len(chunk.get('context_chunk_ids', ())) - 1 for chunk in expanded)
+    if merged:
+        logger.info(f"Expanded {len(chunks)} chunks with {merged} neighboring chunks into {len(expanded)} passages")
+    return expanded
+
 def search_structured_data(keywords: List[str]) -> List[Tuple[str, float]]:
     """
     Search specifically in structured data for keyword matches
@@ -355,9 +1041,8 @@ def update_provider_data(total_count: int, by_county: Optional[Dict[str, int]] =
         structured_service = get_structured_data_service()
         structured_service.update_provider_count(total_count, by_county, source, source_url)
         
-        # Clear cache to force reload with new data
-        global _cached_data
-        _cached_data = None
+        # Re-index only the structured segment; the corpus segments are reused as is
+        refresh_structured_index()
         
         logger.info(f"Updated provider data: {total_count} total providers")
         return True
@@ -366,9 +1051,34 @@ def update_provider_data(total_count: int, by_county: Optional[Dict[str, int]] =
         logger.error(f"Error updating provider data: {e}")
         return False
 
+def register_additional_chunks(chunks: List[Dict[str, Any]]) -> None:
+    """
+    Make chunks from additional data sources retrievable by their additional_* ids
+    
+    Args:
+        chunks: Chunk dictionaries with at least 'id' and 'content'
+    """
+    for chunk in chunks:
+        chunk_id = chunk.get('id')
+        if not chunk_id:
+            continue
+        _additional_chunks[chunk_id] = chunk
+        _additional_chunks.move_to_end(chunk_id)
+    
+    # Keep only the most recently registered chunks
+    while len(_additional_chunks) > MAX_ADDITIONAL_CHUNKS:
+        _additional_chunks.popitem(last=False)
+
+def _lookup_chunk(chunk_id: str, snapshot: IndexSnapshot) -> Optional[Dict[str, Any]]:
+    """Resolve one id against the snapshot's id index and the additional-source chunks"""
+    chunk = snapshot.get_chunk(chunk_id)
+    if chunk is not None:
+        return chunk
+    return _additional_chunks.get(chunk_id)
+
 def get_chunk_by_id(chunk_id: str) -> Optional[Dict[str, Any]]:
     """
-    Retrieve a specific chunk by its ID from the local JSONL file.
+    Retrieve a specific chunk by its ID, including structured_* and additional_* chunks.
     
     Args:
         chunk_id: The ID of the chunk to retrieve
@@ -376,23 +1086,42 @@ def get_chunk_by_id(chunk_id: str) -> Optional[Dict[str, Any]]:
     Returns:
         The chunk data as a dictionary, or None if not found
     """
-    global _cached_data
+    snapshot = get_index_snapshot()
     
-    # Load data if not already cached
-    if _cached_data is None:
-        _cached_data = _load_data()
+    chunk = _lookup_chunk(chunk_id, snapshot)
+    if chunk is None:
+        logger.warning(f"Chunk with ID {chunk_id} not found in local data.")
+    return chunk
+
+def get_chunks_by_ids_with_missing(chunk_ids: List[str]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Retrieve multiple chunks by their IDs in a single pass over the id index
     
-    if not _cached_data:
-        logger.warning("No data loaded for chunk retrieval.")
-        return None
+    Args:
+        chunk_ids: List of chunk IDs to retrieve
+        
+    Returns:
+        Tuple of (chunks in request order with duplicates removed, ids that were not found)
+    """
+    snapshot = get_index_snapshot()
     
-    # Search for the chunk with the matching ID
-    for chunk in _cached_data:
-        if chunk.get('id') == chunk_id:
-            return chunk
-            
-    logger.warning(f"Chunk with ID {chunk_id} not found in local data.")
-    return None
+    chunks = []
+    missing = []
+    seen = set()
+    for chunk_id in chunk_ids:
+        if chunk_id in seen:
+            continue
+        seen.add(chunk_id)
+        
+        chunk = _lookup_chunk(chunk_id, snapshot)
+        if chunk is None:
+            missing.append(chunk_id)
+        else:
+            chunks.append(chunk)
+    
+    if missing:
+        logger.warning(f"{len(missing)} of {len(seen)} requested chunks not found: {missing}")
+    return chunks, missing
 
 def get_chunks_by_ids(chunk_ids: List[str]) -> List[Dict[str, Any]]:
     """
@@ -402,13 +1131,9 @@ def get_chunks_by_ids(chunk_ids: List[str]) -> List[Dict[str, Any]]:
         chunk_ids: List of chunk IDs to retrieve
         
     Returns:
-        List of chunk dictionaries
+        List of chunk dictionaries in request order
     """
-    chunks = []
-    for chunk_id in chunk_ids:
-        chunk = get_chunk_by_id(chunk_id)
-        if chunk:
-            chunks.append(chunk)
+    chunks, _ = get_chunks_by_ids_with_missing(chunk_ids)
     return chunks
 
 # --- Example Usage --- (Requires a Deployed Index Endpoint)
@@ -0,0 +1,332 @@
+# eidbi-query-system/backend/app/services/vector_index.py
+
+import logging
+from collections import Counter
+from typing import List, Dict, Any, Tuple, Sequence, Optional
+
+import numpy as np
+
+from .corpus_artifact import CorpusArtifact
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Rows per block when scanning quantized codes, bounds the float32 temporaries
+QUANTIZED_SCAN_BLOCK = 32768
+
+# Reciprocal rank fusion constant and per-variant depth (as a multiple of k)
+RRF_K = 60
+RRF_DEPTH_FACTOR = 3
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Return the indices of the k highest scores, ordered best first.
+
+    Uses np.argpartition so only the selected k entries are fully sorted.
+    """
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind='stable')
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row in place; all-zero rows are left as zeros."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def quantize_int8(matrix: np.ndarray, block: int = QUANTIZED_SCAN_BLOCK) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per-dimension int8 scalar quantization.
+
+    Returns:
+        Tuple of (int8 codes [rows x dim], float32 scale per dimension) with
+        matrix ~= codes * scales
+    """
+    rows, dimension = matrix.shape
+    max_abs = np.zeros(dimension, dtype=np.float32)
+    for start in range(0, rows, block):
+        np.maximum(max_abs, np.abs(matrix[start:start + block]).max(axis=0), out=max_abs)
+    scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+
+    codes = np.empty((rows, dimension), dtype=np.int8)
+    for start in range(0, rows, block):
+        codes[start:start + block] = np.clip(np.rint(matrix[start:start + block] / scales), -127, 127)
+    return codes, scales
+
+
+def fuse_scores(scores: np.ndarray, k: int, fusion: str = 'max') -> np.ndarray:
+    """
+    Fuse per-variant scores into one score per row.
+
+    Args:
+        scores: float32 [rows x variants] similarity of every row to every query variant
+        k: Number of results that will be selected from the fused scores
+        fusion: 'max' keeps each row's best similarity (max-sim), 'rrf' sums
+                reciprocal ranks over each variant's top RRF_DEPTH_FACTOR * k rows
+
+    Returns:
+        float32 [rows] fused scores
+    """
+    if fusion == 'max':
+        return scores.max(axis=1)
+    if fusion != 'rrf':
+        raise ValueError(f"Unknown fusion method: {fusion}")
+    fused = np.zeros(scores.shape[0], dtype=np.float32)
+    for column in range(scores.shape[1]):
+        ranked = top_k_indices(scores[:, column], k * RRF_DEPTH_FACTOR)
+        fused[ranked] += 1.0 / (RRF_K + np.arange(1, ranked.shape[0] + 1, dtype=np.float32))
+    return fused
+
+
+def mmr_select(relevance: np.ndarray, embeddings: np.ndarray, k: int, mmr_lambda: float = 0.7,
+               duplicate_threshold: Optional[float] = None) -> np.ndarray:
+    """
+    Maximal marginal relevance: greedily pick rows that are relevant but unlike the rows already picked.
+
+    The pairwise similarities of the candidates are computed in one matrix
+    product and each pick updates every row's redundancy with one vector max.
+
+    Args:
+        relevance: [rows] relevance of each candidate, scaled to [0, 1]
+        embeddings: float32 [rows x dim] L2-normalized candidate embeddings (zero rows are never redundant)
+        k: Number of rows to pick
+        mmr_lambda: Trade-off between relevance (1.0) and diversity (0.0)
+        duplicate_threshold: Rows at least this similar to a picked row are dropped as near-duplicates
+
+    Returns:
+        Indices of the picked rows in pick order
+    """
+    rows = relevance.shape[0]
+    if k <= 0 or rows == 0:
+        return np.empty(0, dtype=np.int64)
+    similarity = embeddings @ embeddings.T
+    relevance = mmr_lambda * np.asarray(relevance, dtype=np.float32)
+    redundancy = np.zeros(rows, dtype=np.float32)
+    available = np.ones(rows, dtype=bool)
+    picked: List[int] = []
+    while len(picked) < k and available.any():
+        scores = np.where(available, relevance - (1 - mmr_lambda) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[:, best], out=redundancy)
+        if duplicate_threshold is not None:
+            available &= similarity[:, best] < duplicate_threshold
+    return np.asarray(picked, dtype=np.int64)
+
+
+class VectorIndex:
+    """
+    Exact cosine-similarity index over the embeddings of a list of chunks.
+
+    All embeddings are held as one pre-normalized float32 matrix so a query
+    is scored with a single matrix-vector product instead of a Python loop.
+    """
+
+    def __init__(self, ids: List[str], matrix: np.ndarray, normalized: bool = False):
+        """
+        Args:
+            ids: Chunk id of each matrix row
+            matrix: float32 [rows x dim] embedding matrix (may be a read-only memmap)
+            normalized: True if the rows are already L2-normalized
+        """
+        if matrix.dtype != np.float32 or not normalized:
+            matrix = normalize_rows(np.array(matrix, dtype=np.float32))
+        self.ids = ids
+        self.dimension = matrix.shape[1] if matrix.ndim == 2 else 0
+        self.matrix = matrix
+        # Optional approximate index over the same rows (see ann_index.IVFIndex)
+        self.ann = None
+        # Optional reduced-dimension projection for a two-stage scan (see projection_index.PCAProjection)
+        self.projection = None
+        # Optional int8 codes for the first-pass scan (see enable_quantization)
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.rescore_factor = 1
+        logger.info(f"Built vector index with {len(self.ids)} rows (dim={self.dimension})")
+
+    @classmethod
+    def from_chunks(cls, chunks: Sequence[Dict[str, Any]]) -> 'VectorIndex':
+        """Build an index from chunk dictionaries that carry an 'embedding' list."""
+        ids: List[str] = []
+        rows: List[Any] = []
+        for chunk in chunks:
+            embedding = chunk.get('embedding')
+            if not embedding or 'id' not in chunk:
+                continue
+            ids.append(chunk['id'])
+            rows.append(embedding)
+
+        # Mixed scrapes can carry embeddings of different sizes; keep the dominant one
+        if rows:
+            dimension = Counter(len(row) for row in rows).most_common(1)[0][0]
+            kept = [(chunk_id, row) for chunk_id, row in zip(ids, rows) if len(row) == dimension]
+            if len(kept) != len(rows):
+                logger.warning(f"Skipping {len(rows) - len(kept)} embeddings whose dimension is not {dimension}")
+            ids = [chunk_id for chunk_id, _ in kept]
+            rows = [row for _, row in kept]
+        else:
+            dimension = 0
+
+        return cls(ids, np.asarray(rows, dtype=np.float32).reshape(len(rows), dimension))
+
+    @classmethod
+    def from_artifact(cls, artifact: CorpusArtifact) -> 'VectorIndex':
+        """Build an index over a corpus artifact, using its memory-mapped matrix directly when possible."""
+        if artifact.has_embedding.all():
+            return cls(list(artifact.ids), artifact.embeddings, normalized=True)
+        rows = np.flatnonzero(artifact.has_embedding)
+        return cls([artifact.ids[row] for row in rows], np.asarray(artifact.embeddings[rows]), normalized=True)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def enable_quantization(self, rescore_factor: int = 4) -> None:
+        """
+        Scan int8 codes first and re-score only the shortlist with the float32 rows.
+
+        With a memory-mapped matrix only the shortlisted float32 rows are paged in,
+        so resident memory for the scan is about a quarter of the float32 matrix.
+
+        Args:
+            rescore_factor: Shortlist size as a multiple of k
+        """
+        if not self.ids:
+            return
+        self.codes, self.scales = quantize_int8(self.matrix)
+        self.rescore_factor = max(1, rescore_factor)
+        logger.info(f"Quantized vector index to int8 ({self.codes.nbytes / 1e6:.1f} MB codes, "
+                    f"{self.matrix.nbytes / 1e6:.1f} MB float32), rescore factor {self.rescore_factor}")
+
+    def _quantized_scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate scores of every row from the int8 codes, for one query [dim] or several [dim x m]."""
+        scaled_query = query * (self.scales if query.ndim == 1 else self.scales[:, None])
+        scores = np.empty((self.codes.shape[0],) + query.shape[1:], dtype=np.float32)
+        for start in range(0, self.codes.shape[0], QUANTIZED_SCAN_BLOCK):
+            block = self.codes[start:start + QUANTIZED_SCAN_BLOCK]
+            scores[start:start + QUANTIZED_SCAN_BLOCK] = block.astype(np.float32) @ scaled_query
+        return scores
+
+    def _prepare_query(self, query_embedding: Sequence[float]) -> np.ndarray:
+        """Convert a query embedding to a normalized float32 vector."""
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        if query.shape[0] != self.dimension:
+            raise ValueError(f"Query dimension {query.shape[0]} does not match index dimension {self.dimension}")
+        norm = np.linalg.norm(query)
+        return query / norm if norm > 0 else query
+
+    def _prepare_queries(self, query_embeddings: Sequence[Sequence[float]]) -> np.ndarray:
+        """Convert several query embeddings to a normalized float32 [m x dim] matrix."""
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        if queries.shape[1] != self.dimension:
+            raise ValueError(f"Query dimension {queries.shape[1]} does not match index dimension {self.dimension}")
+        return normalize_rows(queries)
+
+    def search(self, query_embedding: Sequence[float], k: int, engine: str = 'exact',
+               nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Find the k chunks most similar to the query embedding.
+
+        Args:
+            query_embedding: The embedding vector to search for
+            k: Number of results to return
+            engine: 'exact' for a full scan, 'ivf' for the approximate index or 'pca' for the
+                    reduced-dimension two-stage scan, when one is attached
+            nprobe: Clusters scanned by the approximate index (defaults to its own setting)
+
+        Returns:
+            List of (chunk_id, similarity) tuples sorted by similarity (highest first)
+        """
+        if not self.ids:
+            return []
+        query = self._prepare_query(query_embedding)
+        if engine == 'ivf' and self.ann is not None:
+            rows, scores = self.ann.search(self.matrix, query, k, nprobe)
+            return [(self.ids[row], float(score)) for row, score in zip(rows, scores)]
+        if engine == 'pca' and self.projection is not None:
+            rows, scores = self.projection.search(self.matrix, query, k)
+            return [(self.ids[row], float(score)) for row, score in zip(rows, scores)]
+        if self.codes is not None:
+            shortlist = top_k_indices(self._quantized_scores(query), k * self.rescore_factor)
+            shortlist.sort()  # Sequential access into a memory-mapped matrix
+            scores = self.matrix[shortlist] @ query
+            return [(self.ids[shortlist[i]], float(scores[i])) for i in top_k_indices(scores, k)]
+        scores = self.matrix @ query
+        return [(self.ids[i], float(scores[i])) for i in top_k_indices(scores, k)]
+
+    def score_candidates(self, query_embeddings: Sequence[Sequence[float]], k: int, fusion: str = 'max',
+                         engine: str = 'exact', nprobe: Optional[int] = None,
+                         allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact per-variant scores of the rows that can reach the fused top k.
+
+        Args:
+            query_embeddings: The embedding vectors of the query variants
+            k: Number of results that will be selected after fusion
+            fusion: 'max' or 'rrf'; 'rrf' needs a deeper candidate list per variant
+            engine: 'exact', 'ivf' or 'pca' (see search)
+            nprobe: Clusters scanned per variant by the approximate index
+            allowed: Optional sorted rows to restrict the search to (e.g. a topic partition)
+
+        Returns:
+            Tuple of (matrix rows, float32 [rows x variants] similarity scores)
+        """
+        queries = self._prepare_queries(query_embeddings)
+        depth_factor = RRF_DEPTH_FACTOR if fusion == 'rrf' else 1
+
+        # Restrict to a candidate set where possible, then score it exactly
+        if engine == 'ivf' and self.ann is not None:
+            rows = np.unique(np.concatenate([self.ann.candidates(query, nprobe) for query in queries]))
+            if allowed is not None:
+                rows = np.intersect1d(rows, allowed, assume_unique=True)
+        elif engine == 'pca' and self.projection is not None:
+            depth = max(self.projection.shortlist, k * depth_factor)
+            rows = self._shortlist(self.projection.coarse_scores(queries.T), depth, allowed)
+        elif self.codes is not None:
+            rows = self._shortlist(self._quantized_scores(queries.T), k * max(self.rescore_factor, depth_factor), allowed)
+        elif allowed is not None:
+            # Only the allowed rows are read, so a small partition is a small scan
+            rows = allowed
+        else:
+            return np.arange(len(self.ids)), self.matrix @ queries.T
+
+        return rows, self.matrix[rows] @ queries.T
+
+    @staticmethod
+    def _shortlist(approximate: np.ndarray, depth: int, allowed: Optional[np.ndarray]) -> np.ndarray:
+        """Union of each variant's top rows by approximate score [rows x variants], within the allowed rows."""
+        if allowed is not None:
+            approximate = approximate[allowed]
+        rows = np.unique(np.concatenate([top_k_indices(approximate[:, j], depth) for j in range(approximate.shape[1])]))
+        return allowed[rows] if allowed is not None else rows
+
+    def search_batch(self, query_embeddings: Sequence[Sequence[float]], k: int, fusion: str = 'max',
+                     engine: str = 'exact', nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Score several query embeddings (e.g. query expansions) in one pass and fuse them.
+
+        All variants are scored with a single matrix-matrix product, so searching
+        m expansions costs one pass over the corpus instead of m.
+
+        Args:
+            query_embeddings: The embedding vectors of the query variants
+            k: Number of results to return
+            fusion: 'max' (max-sim) or 'rrf' (reciprocal rank fusion)
+            engine: 'exact', 'ivf' or 'pca' (see search)
+            nprobe: Clusters scanned per variant by the approximate index
+
+        Returns:
+            List of (chunk_id, fused_score) tuples sorted by fused score (highest first)
+        """
+        if not self.ids or not len(query_embeddings):
+            return []
+        rows, scores = self.score_candidates(query_embeddings, k, fusion, engine, nprobe)
+        fused = fuse_scores(scores, k, fusion)
+        return [(self.ids[rows[i]], float(fused[i])) for i in top_k_indices(fused, k)]
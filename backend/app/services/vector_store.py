@@ -0,0 +1,445 @@
+# eidbi-query-system/backend/app/services/vector_store.py
+
+"""
+Vector store backends behind one interface.
+
+    numpy            Brute-force search over an in-memory float32 matrix
+    mmap             Search over the memory-mapped matrix of a corpus artifact; writes
+                     go to an in-memory overlay and deletes are kept as tombstones
+    matching_engine  Vertex AI Matching Engine (Vector Search) through its REST API.
+                     The API host is configurable (VECTOR_DB_API_ENDPOINT), so the
+                     adapter can run against a local stand-in server such as
+                     scripts/matching_engine_standin.py
+
+"auto" picks numpy when the corpus matrix fits in VECTOR_STORE_MEMORY_BUDGET_MB and
+mmap otherwise.
+"""
+
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Tuple, Sequence, Optional, Set
+
+import numpy as np
+
+from .corpus_artifact import CorpusArtifact, build_corpus_artifact, load_corpus_artifact
+from .vector_index import VectorIndex, RRF_K, normalize_rows
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+VECTOR_STORE_BACKENDS = ('numpy', 'mmap', 'matching_engine')
+
+# Largest corpus matrix "auto" keeps in memory before switching to the memory-mapped backend
+VECTOR_STORE_MEMORY_BUDGET_MB = int(os.getenv("VECTOR_STORE_MEMORY_BUDGET_MB", "1024"))
+
+# Matching Engine REST settings; VECTOR_DB_API_ENDPOINT can point at a local stand-in
+MATCHING_ENGINE_API_ENDPOINT = os.getenv("VECTOR_DB_API_ENDPOINT")
+MATCHING_ENGINE_DEPLOYED_INDEX_ID = os.getenv("VECTOR_DB_DEPLOYED_INDEX_ID")
+MATCHING_ENGINE_DIMENSION = int(os.getenv("VECTOR_DB_DIMENSION", "768"))
+MATCHING_ENGINE_TIMEOUT = float(os.getenv("VECTOR_DB_TIMEOUT", "30"))
+MATCHING_ENGINE_UPSERT_BATCH = 1000
+
+
+def fuse_ranked_lists(result_lists: Sequence[List[Tuple[str, float]]], k: int,
+                      fusion: str = 'max') -> List[Tuple[str, float]]:
+    """
+    Fuse ranked (id, score) lists of several query variants into one list.
+
+    Args:
+        result_lists: One ranked list per query variant
+        k: Number of results to return
+        fusion: 'max' keeps each id's best score, 'rrf' sums reciprocal ranks
+
+    Returns:
+        List of (id, fused_score) tuples sorted by fused score (highest first)
+    """
+    if fusion not in ('max', 'rrf'):
+        raise ValueError(f"Unknown fusion method: {fusion}")
+    fused: Dict[str, float] = {}
+    for results in result_lists:
+        for rank, (chunk_id, score) in enumerate(results, 1):
+            if fusion == 'max':
+                fused[chunk_id] = max(fused.get(chunk_id, score), score)
+            else:
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def select_backend(rows: int, dimension: int, memory_budget_mb: int = VECTOR_STORE_MEMORY_BUDGET_MB) -> str:
+    """Pick a local backend for a corpus: in memory if its float32 matrix fits the budget, else memory-mapped."""
+    matrix_mb = rows * dimension * 4 / (1024 * 1024)
+    backend = 'numpy' if matrix_mb <= memory_budget_mb else 'mmap'
+    logger.info(f"Corpus matrix is {matrix_mb:.1f} MB ({rows} x {dimension}); "
+                f"using the {backend} vector store (budget {memory_budget_mb} MB)")
+    return backend
+
+
+class VectorStore(ABC):
+    """Interface shared by all vector store backends."""
+
+    backend = ''
+
+    @abstractmethod
+    def search(self, query_embedding: Sequence[float], k: int) -> List[Tuple[str, float]]:
+        """
+        Find the k ids most similar to the query embedding.
+
+        Returns:
+            List of (id, similarity) tuples sorted by similarity (highest first)
+        """
+
+    def batch_search(self, query_embeddings: Sequence[Sequence[float]], k: int,
+                     fusion: str = 'max') -> List[Tuple[str, float]]:
+        """
+        Search several embeddings of the same query and fuse the results.
+
+        Backends override this when they can score all variants in one call.
+        """
+        return fuse_ranked_lists([self.search(query, k) for query in query_embeddings], k, fusion)
+
+    @abstractmethod
+    def upsert(self, items: Sequence[Tuple[str, Sequence[float]]]) -> int:
+        """
+        Insert or replace embeddings.
+
+        Args:
+            items: (id, embedding) pairs
+
+        Returns:
+            Number of embeddings written
+        """
+
+    @abstractmethod
+    def delete(self, ids: Sequence[str]) -> int:
+        """Remove embeddings by id and return how many were removed."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Backend name, row count, dimension and memory use."""
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Brute-force search over an in-memory float32 matrix.
+
+    Rows live in a buffer with spare capacity, so an upsert appends or
+    overwrites rows and a delete moves the last row into the freed slot; both
+    cost time proportional to the change.
+    """
+
+    backend = 'numpy'
+
+    def __init__(self, index: VectorIndex):
+        """
+        Args:
+            index: Scan index over the rows; its matrix is copied into a writable buffer
+        """
+        self._buffer = np.array(index.matrix, dtype=np.float32)
+        index.matrix = self._buffer[:len(index)]
+        index.ids = list(index.ids)
+        self.index = index
+        self._rows: Dict[str, int] = {chunk_id: row for row, chunk_id in enumerate(index.ids)}
+
+    @classmethod
+    def from_chunks(cls, chunks: Sequence[Dict[str, Any]]) -> 'NumpyVectorStore':
+        """Build a store from chunk dictionaries that carry an 'embedding' list."""
+        return cls(VectorIndex.from_chunks(chunks))
+
+    @classmethod
+    def from_artifact(cls, artifact: CorpusArtifact) -> 'NumpyVectorStore':
+        """Build a store by reading the artifact's matrix into memory."""
+        return cls(VectorIndex.from_artifact(artifact))
+
+    @property
+    def dimension(self) -> int:
+        return self.index.dimension
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def search(self, query_embedding: Sequence[float], k: int, engine: str = 'exact',
+               nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        return self.index.search(query_embedding, k, engine=engine, nprobe=nprobe)
+
+    def batch_search(self, query_embeddings: Sequence[Sequence[float]], k: int, fusion: str = 'max',
+                     engine: str = 'exact', nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        return self.index.search_batch(query_embeddings, k, fusion=fusion, engine=engine, nprobe=nprobe)
+
+    def _invalidate_accelerators(self) -> None:
+        """IVF lists and int8 codes describe the old rows; fall back to exact scans after a write."""
+        if self.index.ann is not None or self.index.codes is not None:
+            logger.warning("Vector store modified; dropping its IVF/int8 accelerators until it is rebuilt")
+        self.index.ann = None
+        self.index.codes = self.index.scales = None
+
+    def upsert(self, items: Sequence[Tuple[str, Sequence[float]]]) -> int:
+        if not items:
+            return 0
+        vectors = normalize_rows(np.asarray([embedding for _, embedding in items], dtype=np.float32))
+        if len(self.index):
+            if vectors.shape[1] != self.dimension:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {self.dimension}")
+        elif self._buffer.shape[1] != vectors.shape[1]:
+            self._buffer = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+            self.index.dimension = vectors.shape[1]
+        self._invalidate_accelerators()
+
+        rows = len(self.index)
+        for (chunk_id, _), vector in zip(items, vectors):
+            row = self._rows.get(chunk_id)
+            if row is None:
+                if rows == self._buffer.shape[0]:
+                    grown = np.zeros((max(16, 2 * rows), self._buffer.shape[1]), dtype=np.float32)
+                    grown[:rows] = self._buffer[:rows]
+                    self._buffer = grown
+                row = rows
+                rows += 1
+                self._rows[chunk_id] = row
+                self.index.ids.append(chunk_id)
+            self._buffer[row] = vector
+        self.index.matrix = self._buffer[:rows]
+        return len(items)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        removed = 0
+        for chunk_id in ids:
+            row = self._rows.pop(chunk_id, None)
+            if row is None:
+                continue
+            if not removed:
+                self._invalidate_accelerators()
+            last = len(self.index.ids) - 1
+            if row != last:
+                moved_id = self.index.ids[last]
+                self._buffer[row] = self._buffer[last]
+                self.index.ids[row] = moved_id
+                self._rows[moved_id] = row
+            self.index.ids.pop()
+            removed += 1
+        self.index.matrix = self._buffer[:len(self.index.ids)]
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "rows": len(self.index),
+            "dimension": self.dimension,
+            "memory_bytes": int(self._buffer.nbytes + (self.index.codes.nbytes if self.index.codes is not None else 0))
+        }
+
+
+class MmapVectorStore(VectorStore):
+    """
+    Search over the memory-mapped embedding matrix of a corpus artifact.
+
+    The artifact on disk is never rewritten: upserts go to an in-memory
+    NumpyVectorStore overlay that shadows the same ids, and deletes are kept
+    as tombstones until the artifact is rebuilt.
+    """
+
+    backend = 'mmap'
+
+    def __init__(self, artifact: CorpusArtifact):
+        self.artifact = artifact
+        self.index = VectorIndex.from_artifact(artifact)
+        self.overlay = NumpyVectorStore(VectorIndex([], np.zeros((0, self.index.dimension), dtype=np.float32),
+                                                    normalized=True))
+        # Artifact ids hidden by a delete or by an overlay row
+        self._hidden: Set[str] = set()
+        self._base_ids: Optional[Set[str]] = None
+
+    @classmethod
+    def open(cls, jsonl_path: str, artifact_path: Optional[str] = None) -> 'MmapVectorStore':
+        """Open the artifact of a JSONL corpus, building it first if it is missing or stale."""
+        artifact = load_corpus_artifact(jsonl_path, artifact_path)
+        if artifact is None:
+            artifact = CorpusArtifact(build_corpus_artifact(jsonl_path, artifact_path))
+        return cls(artifact)
+
+    @property
+    def dimension(self) -> int:
+        return self.index.dimension
+
+    def __len__(self) -> int:
+        return len(self.index) - len(self._hidden) + len(self.overlay)
+
+    def _in_base(self, chunk_id: str) -> bool:
+        if self._base_ids is None:
+            self._base_ids = set(self.index.ids)
+        return chunk_id in self._base_ids
+
+    def _merge(self, base_hits: List[Tuple[str, float]], overlay_hits: List[Tuple[str, float]],
+               k: int) -> List[Tuple[str, float]]:
+        hits = [hit for hit in base_hits if hit[0] not in self._hidden] + overlay_hits
+        hits.sort(key=lambda item: item[1], reverse=True)
+        return hits[:k]
+
+    def search(self, query_embedding: Sequence[float], k: int, engine: str = 'exact',
+               nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        base_hits = self.index.search(query_embedding, k + len(self._hidden), engine=engine, nprobe=nprobe)
+        overlay_hits = self.overlay.search(query_embedding, k) if len(self.overlay) else []
+        return self._merge(base_hits, overlay_hits, k)
+
+    def batch_search(self, query_embeddings: Sequence[Sequence[float]], k: int, fusion: str = 'max',
+                     engine: str = 'exact', nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        if len(self.overlay) and fusion == 'rrf':
+            # Reciprocal ranks must be taken over base and overlay together
+            return super().batch_search(query_embeddings, k, fusion)
+        base_hits = self.index.search_batch(query_embeddings, k + len(self._hidden), fusion=fusion,
+                                            engine=engine, nprobe=nprobe)
+        overlay_hits = self.overlay.batch_search(query_embeddings, k, fusion) if len(self.overlay) else []
+        return self._merge(base_hits, overlay_hits, k)
+
+    def upsert(self, items: Sequence[Tuple[str, Sequence[float]]]) -> int:
+        written = self.overlay.upsert(items)
+        self._hidden.update(chunk_id for chunk_id, _ in items if self._in_base(chunk_id))
+        return written
+
+    def delete(self, ids: Sequence[str]) -> int:
+        removed = self.overlay.delete(ids)
+        for chunk_id in ids:
+            if self._in_base(chunk_id) and chunk_id not in self._hidden:
+                self._hidden.add(chunk_id)
+                removed += 1
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        overlay = self.overlay.stats()
+        return {
+            "backend": self.backend,
+            "rows": len(self),
+            "dimension": self.dimension,
+            "path": self.artifact.path,
+            "disk_bytes": int(self.index.matrix.nbytes),
+            "memory_bytes": overlay["memory_bytes"] + int(self.index.codes.nbytes if self.index.codes is not None else 0),
+            "overlay_rows": overlay["rows"],
+            "tombstones": len(self._hidden)
+        }
+
+
+class MatchingEngineVectorStore(VectorStore):
+    """
+    Adapter for a Vertex AI Matching Engine index deployed to an index endpoint.
+
+    Queries go to ``{endpoint}:findNeighbors`` and writes to the index's
+    ``:upsertDatapoints`` / ``:removeDatapoints`` streaming-update methods.
+    """
+
+    backend = 'matching_engine'
+
+    def __init__(self, index_endpoint_url: str, index_url: str, deployed_index_id: str,
+                 dimension: int = MATCHING_ENGINE_DIMENSION, timeout: float = MATCHING_ENGINE_TIMEOUT,
+                 access_token: Optional[str] = None):
+        """
+        Args:
+            index_endpoint_url: REST URL of the index endpoint resource
+            index_url: REST URL of the index resource
+            deployed_index_id: Id of the deployment of the index on the endpoint
+            dimension: Embedding dimension of the index
+            timeout: Request timeout in seconds
+            access_token: Bearer token; defaults to VECTOR_DB_ACCESS_TOKEN or Google default credentials
+        """
+        import requests
+
+        self.index_endpoint_url = index_endpoint_url.rstrip('/')
+        self.index_url = index_url.rstrip('/')
+        self.deployed_index_id = deployed_index_id
+        self.dimension = dimension
+        self.timeout = timeout
+        self._access_token = access_token or os.getenv("VECTOR_DB_ACCESS_TOKEN")
+        self._session = requests.Session()
+
+    @classmethod
+    def from_settings(cls, project_id: str, region: str, index_id: str, index_endpoint_id: str,
+                      api_endpoint: Optional[str] = None,
+                      deployed_index_id: Optional[str] = None) -> 'MatchingEngineVectorStore':
+        """
+        Build the REST URLs from project settings.
+
+        Args:
+            api_endpoint: Base URL of the API (defaults to https://<region>-aiplatform.googleapis.com)
+            deployed_index_id: Deployment id (defaults to the index id)
+        """
+        api_endpoint = (api_endpoint or MATCHING_ENGINE_API_ENDPOINT or f"https://{region}-aiplatform.googleapis.com").rstrip('/')
+        parent = f"{api_endpoint}/v1/projects/{project_id}/locations/{region}"
+        return cls(
+            index_endpoint_url=f"{parent}/indexEndpoints/{index_endpoint_id}",
+            index_url=f"{parent}/indexes/{index_id}",
+            deployed_index_id=deployed_index_id or MATCHING_ENGINE_DEPLOYED_INDEX_ID or index_id
+        )
+
+    def _headers(self) -> Dict[str, str]:
+        token = self._access_token
+        if token is None:
+            try:
+                import google.auth
+                import google.auth.transport.requests
+                credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+                credentials.refresh(google.auth.transport.requests.Request())
+                token = credentials.token
+            except Exception as e:
+                logger.debug(f"No Google credentials for Matching Engine requests: {e}")
+        return {"Authorization": f"Bearer {token}"} if token else {}
+
+    def _post(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = self._session.post(url, json=payload, headers=self._headers(), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+    def _find_neighbors(self, query_embeddings: Sequence[Sequence[float]], k: int) -> List[List[Tuple[str, float]]]:
+        """One findNeighbors call for all query vectors; returns one ranked list per query."""
+        payload = {
+            "deployed_index_id": self.deployed_index_id,
+            "queries": [
+                {"datapoint": {"datapoint_id": str(i), "feature_vector": [float(x) for x in query]}, "neighbor_count": k}
+                for i, query in enumerate(query_embeddings)
+            ]
+        }
+        response = self._post(f"{self.index_endpoint_url}:findNeighbors", payload)
+        results: List[List[Tuple[str, float]]] = [[] for _ in query_embeddings]
+        for position, entry in enumerate(response.get("nearestNeighbors", [])):
+            query_position = int(entry.get("id", position))
+            results[query_position] = [
+                (neighbor["datapoint"]["datapointId"], float(neighbor.get("distance", 0.0)))
+                for neighbor in entry.get("neighbors", [])
+            ]
+        return results
+
+    def search(self, query_embedding: Sequence[float], k: int, **kwargs) -> List[Tuple[str, float]]:
+        return self._find_neighbors([query_embedding], k)[0]
+
+    def batch_search(self, query_embeddings: Sequence[Sequence[float]], k: int, fusion: str = 'max',
+                     **kwargs) -> List[Tuple[str, float]]:
+        if not len(query_embeddings):
+            return []
+        return fuse_ranked_lists(self._find_neighbors(query_embeddings, k), k, fusion)
+
+    def upsert(self, items: Sequence[Tuple[str, Sequence[float]]]) -> int:
+        for start in range(0, len(items), MATCHING_ENGINE_UPSERT_BATCH):
+            batch = items[start:start + MATCHING_ENGINE_UPSERT_BATCH]
+            self._post(f"{self.index_url}:upsertDatapoints", {
+                "datapoints": [
+                    {"datapointId": chunk_id, "featureVector": [float(x) for x in embedding]}
+                    for chunk_id, embedding in batch
+                ]
+            })
+        return len(items)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        ids = list(ids)
+        if ids:
+            self._post(f"{self.index_url}:removeDatapoints", {"datapointIds": ids})
+        return len(ids)
+
+    def stats(self) -> Dict[str, Any]:
+        response = self._session.get(self.index_url, headers=self._headers(), timeout=self.timeout)
+        response.raise_for_status()
+        index_stats = response.json().get("indexStats", {})
+        return {
+            "backend": self.backend,
+            "rows": int(index_stats.get("vectorsCount", 0)),
+            "dimension": self.dimension,
+            "shards": int(index_stats.get("shardsCount", 0)),
+            "endpoint": self.index_endpoint_url
+        }
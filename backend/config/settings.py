@@ -77,6 +77,8 @@ class VectorDBSettings(BaseSettings):
     index_id: Optional[str] = Field(None)
     index_endpoint_id: Optional[str] = Field(None)
     num_neighbors: int = 10
+    store_backend: str = "auto"  # auto, numpy, mmap or matching_engine
+    memory_budget_mb: int = 1024  # Largest corpus matrix "auto" keeps in memory
 
     # Pydantic V2 configuration
     model_config = SettingsConfigDict(
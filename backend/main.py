@@ -2,7 +2,7 @@
 
 import logging
 from fastapi import FastAPI, HTTPException, Body, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from typing import List, Optional, Dict, Any
@@ -12,7 +12,7 @@ import os
 import time
 import hashlib
 import json
-from functools import lru_cache
+import asyncio
 
 # --- Logging Setup (Moved before imports) ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s')
@@ -21,8 +21,11 @@ logger = logging.getLogger(__name__) # Initialize logger early
 # --- Import Services ---
 try:
     # Import services (using relative imports since we're in backend directory)
-    from app.services.embedding_service import initialize_vertex_ai, generate_embeddings
-    from app.services.vector_db_service import find_neighbors, get_chunk_by_id, hybrid_search, get_chunks_by_ids
+    from app.services.embedding_service import initialize_vertex_ai, generate_embeddings, stream_embeddings
+    from app.services.embedding_cache import get_embedding_cache
+    from app.services.embedding_batcher import EmbeddingBatcher
+    from app.services.embedding_codec import encode_embeddings, encode_base64_response, BINARY_MEDIA_TYPE, BASE64_MEDIA_TYPE, DTYPES as EMBEDDING_DTYPES
+    from app.services.vector_db_service import find_neighbors, find_neighbors_multi, get_chunk_by_id, hybrid_search, hierarchical_search, diversify_results, expand_chunk_context, get_chunks_by_ids, register_additional_chunks, get_index_snapshot, get_index_version, configure_vector_store, get_vector_store, get_index_memory_usage
     from app.services.llm_service import generate_text_response
     from app.services.query_enhancer import query_enhancer
     from app.services.reranker import reranker
@@ -41,12 +44,30 @@ except ImportError as e:
     # Define dummy functions if import fails, to allow basic app run
     def initialize_vertex_ai(): return False
     def generate_embeddings(texts: List[str]) -> Optional[List[Optional[List[float]]]]: return None
-    def find_neighbors(query_embedding: List[float]) -> List[Dict[str, Any]]: return []
+    def stream_embeddings(texts): yield list(range(len(texts))), [None] * len(texts)
+    def find_neighbors(query_embedding: List[float], filters=None) -> List[Dict[str, Any]]: return []
     def generate_text_response(prompt: str) -> Optional[str]: return "LLM Service unavailable."
     def read_json_from_gcs(bucket: str, blob: str) -> Optional[Dict]: return None
     def get_chunk_by_id(chunk_id: str) -> Optional[Dict[str, Any]]: return None
-    def hybrid_search(query_embedding, keywords, num_results=10): return []
+    def find_neighbors_multi(query_embeddings, num_neighbors_override=None, filters=None): return []
+    def hybrid_search(query_embedding, keywords, num_results=10, query_embeddings=None, query_type=None, filters=None): return []
+    def hierarchical_search(query_embedding, keywords, num_results=10, query_embeddings=None, filters=None): return []
+    def diversify_results(results, num_results): return results[:num_results]
+    def expand_chunk_context(chunks): return chunks
+    def get_embedding_cache(): return None
+    EmbeddingBatcher = None
+    def encode_embeddings(embeddings, dtype="float32"): return b""
+    def encode_base64_response(embeddings, dtype="float32"): return {}
+    BINARY_MEDIA_TYPE = "application/octet-stream"
+    BASE64_MEDIA_TYPE = "application/vnd.eidbi.embeddings+base64"
+    EMBEDDING_DTYPES = {}
     def get_chunks_by_ids(chunk_ids): return []
+    def register_additional_chunks(chunks): return None
+    def get_index_snapshot(): return None
+    def get_index_version(): return None
+    def configure_vector_store(backend="auto", memory_budget_mb=None, remote_settings=None): return None
+    def get_vector_store(): return None
+    def get_index_memory_usage(): return None
     settings = None # Fallback
     query_enhancer = None
     reranker = None
@@ -64,24 +85,28 @@ ENABLE_QUERY_CACHE = os.getenv("ENABLE_QUERY_CACHE", "true").lower() == "true"
 EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "100"))
 QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "50"))
 
-# Cache decorator for embedding generation
-@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
-def cached_generate_embeddings(text: str) -> Optional[List[float]]:
-    """Generate embeddings with caching for a single text."""
-    if not ENABLE_EMBEDDING_CACHE:
-        # If cache is disabled, just pass through to the regular function
-        embeddings = generate_embeddings([text])
-        return embeddings[0] if embeddings and embeddings[0] is not None else None
-    
-    # Generate embedding with caching
-    logger.info(f"Generating embedding for text (length={len(text)})")
-    result = generate_embeddings([text])
-    if result and result[0] is not None:
-        logger.info("Successfully generated embedding with caching")
-        return result[0]
-    else:
-        logger.warning("Failed to generate embedding")
-        return None
+# --- Retrieval Configuration ---
+# With diversification, searches return DIVERSITY_POOL_FACTOR * num_results candidates
+# and MMR keeps 2 * num_results of them for reranking
+DIVERSITY_POOL_FACTOR = int(os.getenv("DIVERSITY_POOL_FACTOR", "4"))
+
+# --- Bulk Embedding Configuration ---
+# Accept type that asks /generate-embeddings to stream NDJSON (same as stream=true)
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Query embeddings of concurrent requests are sent in shared batches; with the
+# embedding cache enabled, recently embedded texts are also kept in process
+embedding_batcher = EmbeddingBatcher(
+    generate_embeddings,
+    cache_size=EMBEDDING_CACHE_SIZE if ENABLE_EMBEDDING_CACHE else 0
+) if EmbeddingBatcher else None
+
+async def embed_query_texts(texts: List[str]) -> List[Optional[List[float]]]:
+    """Embed query texts through the micro-batcher (directly if it is unavailable)."""
+    if embedding_batcher is not None:
+        return await embedding_batcher.embed_many(texts)
+    embeddings = await asyncio.to_thread(generate_embeddings, texts)
+    return embeddings if embeddings else [None] * len(texts)
 
 # Cache for query responses
 class QueryCache:
@@ -90,17 +115,20 @@ class QueryCache:
         self.max_size = max_size
         self.keys_by_access_time = []
     
-    def _get_key(self, query_text: str, num_results: int, simple_mode: bool) -> str:
-        """Generate a deterministic cache key from the query parameters."""
-        key_data = f"{query_text}:{num_results}:{simple_mode}".encode('utf-8')
+    def _get_key(self, query_text: str, num_results: int, simple_mode: bool,
+                 options: Optional[Dict[str, bool]] = None) -> str:
+        """Generate a deterministic cache key from the query parameters and the retrieval options."""
+        option_data = ",".join(f"{name}={value}" for name, value in sorted((options or {}).items()))
+        key_data = f"{query_text}:{num_results}:{simple_mode}:{option_data}".encode('utf-8')
         return hashlib.md5(key_data).hexdigest()
     
-    def get(self, query_text: str, num_results: int, simple_mode: bool) -> Optional[Dict[str, Any]]:
+    def get(self, query_text: str, num_results: int, simple_mode: bool,
+            options: Optional[Dict[str, bool]] = None) -> Optional[Dict[str, Any]]:
         """Get a cached query result if it exists."""
         if not ENABLE_QUERY_CACHE:
             return None
             
-        key = self._get_key(query_text, num_results, simple_mode)
+        key = self._get_key(query_text, num_results, simple_mode, options)
         result = self.cache.get(key)
         
         if result:
@@ -112,12 +140,13 @@ class QueryCache:
             
         return result
     
-    def set(self, query_text: str, num_results: int, simple_mode: bool, result: Dict[str, Any]) -> None:
+    def set(self, query_text: str, num_results: int, simple_mode: bool, result: Dict[str, Any],
+            options: Optional[Dict[str, bool]] = None) -> None:
         """Store a query result in the cache."""
         if not ENABLE_QUERY_CACHE:
             return
             
-        key = self._get_key(query_text, num_results, simple_mode)
+        key = self._get_key(query_text, num_results, simple_mode, options)
         
         # If cache is full, remove least recently used item
         if len(self.cache) >= self.max_size and self.keys_by_access_time:
@@ -159,6 +188,28 @@ async def lifespan(app: FastAPI):
         logger.error("FATAL: Vertex AI Initialization failed on startup. Embedding endpoint will not work.")
         # Depending on requirements, you might want to exit here or let it run degraded
     
+    # Choose the vector store backend; "auto" sizes it for the corpus (in memory or memory-mapped)
+    if settings:
+        configure_vector_store(
+            settings.vector_db.store_backend,
+            memory_budget_mb=settings.vector_db.memory_budget_mb,
+            remote_settings={
+                "project_id": settings.gcp.project_id,
+                "region": settings.gcp.region,
+                "index_id": settings.vector_db.index_id,
+                "index_endpoint_id": settings.vector_db.index_endpoint_id
+            }
+        )
+    
+    # Load the first index snapshot before serving so no query pays for it
+    try:
+        import asyncio
+        snapshot = await asyncio.to_thread(get_index_snapshot)
+        if snapshot is not None:
+            logger.info(f"Index snapshot {snapshot.version} ready with {len(snapshot)} chunks")
+    except Exception as e:
+        logger.error(f"Failed to load index snapshot on startup: {e}", exc_info=True)
+    
     # Initialize data source integration service
     if data_integration_service:
         logger.info("Initializing data source integration service...")
@@ -218,14 +269,25 @@ async def generic_exception_handler(request: Request, exc: Exception):
     )
 
 # --- Enhanced API Models ---
+class SearchFilters(BaseModel):
+    source_type: Optional[List[str]] = None  # e.g. ["official_website"]; values of one field are OR-ed
+    document_type: Optional[List[str]] = None
+    source_name: Optional[List[str]] = None
+    updated_after: Optional[str] = None  # ISO 8601 date; undated chunks are excluded
+    structured_data: Optional[bool] = None  # Only (True) or no (False) structured data entries
+
 class QueryRequest(BaseModel):
     query_text: str
     num_results: int = 5 # Default to 5 neighbors
     use_hybrid_search: bool = True  # Enable hybrid search by default
+    use_hierarchical_search: bool = False  # Select top documents first, then their chunks (grouped per document)
     use_reranking: bool = True  # Enable reranking by default
+    use_diversification: bool = True  # Drop duplicate and near-duplicate chunks (MMR) before reranking
+    use_context_expansion: bool = True  # Merge the best chunks with their neighbors into contiguous passages
     use_enhanced_prompts: bool = True  # Enable enhanced prompt engineering
     use_additional_sources: bool = True  # Enable additional data sources
     user_session_id: Optional[str] = None  # For tracking user sessions
+    filters: Optional[SearchFilters] = None  # Metadata filters applied before scoring; fields are AND-ed
 
 class NeighborResult(BaseModel):
     chunk_id: str
@@ -242,6 +304,7 @@ class QueryResponse(BaseModel):
     response_format: Optional[str] = None  # Used response format
     sources_used: Optional[List[str]] = None  # Data sources used
     prompt_metadata: Optional[Dict[str, Any]] = None  # Prompt engineering metadata
+    index_version: Optional[str] = None  # Index snapshot the answer was retrieved from
 
 class FeedbackRequest(BaseModel):
     query_text: str
@@ -261,6 +324,9 @@ class CacheStatsResponse(BaseModel):
     query_cache_enabled: bool
     query_cache_size: int 
     query_cache_max_size: int
+    index_memory: Optional[Dict[str, Any]] = None
+    persistent_embedding_cache: Optional[Dict[str, Any]] = None  # Shared on-disk cache behind generate_embeddings
+    embedding_batcher: Optional[Dict[str, Any]] = None  # Batch sizes and coalescing of query embeddings
 
 # --- Helper Function ---
 def construct_llm_prompt(query: str, context_chunks: List[Dict[str, Any]], use_enhanced_prompts: bool = True) -> tuple[str, Dict[str, Any]]:
@@ -315,26 +381,33 @@ async def health_check():
             "feedback_service": feedback_service is not None,
             "prompt_service": prompt_service is not None,
             "data_integration_service": data_integration_service is not None
-        }
+        },
+        "index_version": get_index_version(),
+        "vector_store": getattr(get_vector_store(), "backend", None)
     }
 
 @app.get("/cache-stats")
 async def cache_stats():
     """Get cache statistics."""
+    persistent_cache = get_embedding_cache()
+    batcher_stats = embedding_batcher.stats() if embedding_batcher else None
     return CacheStatsResponse(
         embedding_cache_enabled=ENABLE_EMBEDDING_CACHE,
-        embedding_cache_size=cached_generate_embeddings.cache_info().currsize if ENABLE_EMBEDDING_CACHE else 0,
+        embedding_cache_size=batcher_stats["cache_size"] if batcher_stats else 0,
         embedding_cache_max_size=EMBEDDING_CACHE_SIZE,
         query_cache_enabled=ENABLE_QUERY_CACHE,
         query_cache_size=len(query_cache.cache),
-        query_cache_max_size=QUERY_CACHE_SIZE
+        query_cache_max_size=QUERY_CACHE_SIZE,
+        index_memory=get_index_memory_usage(),
+        persistent_embedding_cache=persistent_cache.stats() if persistent_cache else None,
+        embedding_batcher=batcher_stats
     )
 
 @app.post("/clear-cache")
 async def clear_cache():
-    """Clear all caches."""
-    if ENABLE_EMBEDDING_CACHE:
-        cached_generate_embeddings.cache_clear()
+    """Clear all in-process caches (the persistent embedding cache is keyed by model, so it never goes stale)."""
+    if embedding_batcher:
+        embedding_batcher.clear_cache()
     
     query_cache.clear()
     
@@ -459,12 +532,21 @@ async def perform_query(request: QueryRequest):
     enhanced prompt engineering, feedback integration, and multi-source data.
     """
     logger.info(f"Received enhanced query: '{request.query_text}', num_results: {request.num_results}")
-    logger.info(f"Options: hybrid_search={request.use_hybrid_search}, reranking={request.use_reranking}, enhanced_prompts={request.use_enhanced_prompts}, additional_sources={request.use_additional_sources}")
+    logger.info(f"Options: hybrid_search={request.use_hybrid_search}, hierarchical_search={request.use_hierarchical_search}, reranking={request.use_reranking}, diversification={request.use_diversification}, context_expansion={request.use_context_expansion}, enhanced_prompts={request.use_enhanced_prompts}, additional_sources={request.use_additional_sources}")
     
     query_start_time = time.time()
     
-    # Check cache first 
-    cached_result = query_cache.get(request.query_text, request.num_results, False)
+    filters = request.filters.dict(exclude_none=True) if request.filters else None
+    if filters:
+        logger.info(f"Search filters: {filters}")
+    
+    # Check cache first (the cache key does not cover filters, so filtered queries bypass it)
+    cache_options = {
+        "hierarchical_search": request.use_hierarchical_search,
+        "diversification": request.use_diversification,
+        "context_expansion": request.use_context_expansion
+    }
+    cached_result = query_cache.get(request.query_text, request.num_results, False, cache_options) if not filters else None
     if cached_result:
         return QueryResponse(**cached_result)
 
@@ -477,51 +559,70 @@ async def perform_query(request: QueryRequest):
         expanded_queries = [request.query_text]
         keywords = request.query_text.lower().split()
 
-    # 2. Generate embeddings for expanded queries
-    all_embeddings = []
-    for query in expanded_queries[:3]:  # Limit to first 3 expansions for efficiency
-        if ENABLE_EMBEDDING_CACHE:
-            query_embedding = cached_generate_embeddings(query)
-        else:
-            query_embedding_list = generate_embeddings([query])
-            query_embedding = query_embedding_list[0] if query_embedding_list and query_embedding_list[0] is not None else None
-        
-        if query_embedding:
-            all_embeddings.append(query_embedding)
+    # 2. Generate embeddings for expanded queries (limited to the first 3), batched
+    # together with the query texts of concurrent requests
+    query_embeddings = await embed_query_texts(expanded_queries[:3])
+    all_embeddings = [embedding for embedding in query_embeddings if embedding]
 
     if not all_embeddings:
         logger.error(f"Failed to generate any embeddings for query: '{request.query_text}'")
         raise HTTPException(status_code=500, detail="Failed to generate query embedding.")
 
-    # Use the first embedding as primary (original query)
+    # The first embedding is the original query; the others are its expansions
     primary_embedding = all_embeddings[0]
 
     # 3. Perform search (hybrid or vector-only)
+    index_version = get_index_version()
     search_results = []
     sources_used = []
     
+    # Classify the query so hybrid search can start with its topic partitions
+    query_type = prompt_service.classify_query_type(request.query_text).value if prompt_service else None
+    
+    # Candidates searched for; diversification narrows them to 2 * num_results for reranking
+    rerank_candidates = request.num_results * 2
+    search_count = request.num_results * DIVERSITY_POOL_FACTOR if request.use_diversification else rerank_candidates
+    
     # Primary search in vector database
-    if request.use_hybrid_search:
-        # Hybrid search combining vector and keyword
-        primary_results = hybrid_search(
-            query_embedding=primary_embedding,
-            keywords=keywords,
-            num_results=request.num_results * 2  # Get more for reranking
-        )
-        search_method = "hybrid"
-    else:
-        # Traditional vector-only search
-        primary_results = find_neighbors(
-            query_embedding=primary_embedding,
-            num_neighbors_override=request.num_results * 2
-        )
-        search_method = "vector"
+    try:
+        if request.use_hierarchical_search:
+            # Document-first search; at most a few chunks per page reach the prompt
+            primary_results = hierarchical_search(
+                query_embedding=primary_embedding,
+                keywords=keywords,
+                num_results=search_count,  # Get more for reranking
+                query_embeddings=all_embeddings,
+                filters=filters
+            )
+            search_method = "hierarchical"
+        elif request.use_hybrid_search:
+            # Hybrid search combining vector and keyword
+            primary_results = hybrid_search(
+                query_embedding=primary_embedding,
+                keywords=keywords,
+                num_results=search_count,  # Get more for reranking
+                query_embeddings=all_embeddings,  # Score every expansion in one pass
+                query_type=query_type,
+                filters=filters
+            )
+            search_method = "hybrid"
+        else:
+            # Traditional vector-only search over all expansions
+            primary_results = find_neighbors_multi(
+                query_embeddings=all_embeddings,
+                num_neighbors_override=search_count,
+                filters=filters
+            )
+            search_method = "vector"
+    except ValueError as e:
+        # Invalid filter expression
+        raise HTTPException(status_code=400, detail=str(e))
     
     search_results.extend(primary_results)
     sources_used.append("primary_vector_db")
     
-    # Additional sources search
-    if request.use_additional_sources and data_integration_service:
+    # Additional sources search (their content carries no index metadata, so not with filters)
+    if request.use_additional_sources and data_integration_service and not filters:
         try:
             additional_content = data_integration_service.get_content_for_query(
                 request.query_text, 
@@ -531,14 +632,29 @@ async def perform_query(request: QueryRequest):
             if additional_content:
                 logger.info(f"Found {len(additional_content)} additional content items")
                 # Convert additional content to search result format
+                additional_chunks = []
                 for item in additional_content:
                     # Create a pseudo chunk ID for additional content
                     chunk_id = f"additional_{hashlib.md5(item['url'].encode()).hexdigest()[:8]}"
                     search_results.append((chunk_id, 0.8))  # Give it a good similarity score
                     sources_used.append(item.get('source_name', 'additional_source'))
+                    additional_chunks.append({
+                        'id': chunk_id,
+                        'content': item['content'],
+                        'url': item['url'],
+                        'title': item.get('title', ''),
+                        'source_type': 'additional'
+                    })
+                
+                # Register so the chunk lookup below resolves the additional_* ids
+                register_additional_chunks(additional_chunks)
         except Exception as e:
             logger.warning(f"Failed to get additional sources: {e}")
 
+    # Collapse duplicate and near-duplicate chunks so the reranker and the prompt see diverse candidates
+    if request.use_diversification and search_results:
+        search_results = diversify_results(search_results, rerank_candidates)
+
     if not search_results:
         logger.warning(f"No results found for query: '{request.query_text}'")
         
@@ -570,42 +686,27 @@ Answer:"""
             "query_type": prompt_metadata.get("query_type"),
             "response_format": prompt_metadata.get("response_format"),
             "sources_used": sources_used,
-            "prompt_metadata": prompt_metadata
+            "prompt_metadata": prompt_metadata,
+            "index_version": index_version
         }
         
         # Cache the result
-        query_cache.set(request.query_text, request.num_results, False, result)
+        if not filters:
+            query_cache.set(request.query_text, request.num_results, False, result, cache_options)
         
         return QueryResponse(**result)
 
     # 4. Get chunk IDs and retrieve content
     chunk_ids = [result[0] for result in search_results]
-    similarity_scores = [result[1] for result in search_results]
     
-    # Retrieve chunk content
+    # Retrieve chunk content (primary, structured and additional chunks in one lookup)
     chunks = get_chunks_by_ids(chunk_ids)
     
-    # Add additional source content if available
-    if request.use_additional_sources and data_integration_service:
-        try:
-            additional_content = data_integration_service.get_content_for_query(
-                request.query_text, 
-                max_sources=2
-            )
-            
-            for item in additional_content:
-                chunk_id = f"additional_{hashlib.md5(item['url'].encode()).hexdigest()[:8]}"
-                if chunk_id in chunk_ids:
-                    # Add the additional content as a chunk
-                    chunks.append({
-                        'id': chunk_id,
-                        'content': item['content'],
-                        'url': item['url'],
-                        'title': item.get('title', ''),
-                        'source_type': 'additional'
-                    })
-        except Exception as e:
-            logger.warning(f"Failed to add additional content: {e}")
+    # Keep similarity scores aligned with the chunks that were actually found
+    score_by_id = {}
+    for chunk_id, score in search_results:
+        score_by_id.setdefault(chunk_id, score)
+    similarity_scores = [score_by_id[chunk['id']] for chunk in chunks]
     
     if not chunks:
         logger.error(f"Failed to retrieve content for any chunk IDs: {chunk_ids}")
@@ -635,11 +736,13 @@ Answer:"""
             "query_type": prompt_metadata.get("query_type"),
             "response_format": prompt_metadata.get("response_format"),
             "sources_used": sources_used,
-            "prompt_metadata": prompt_metadata
+            "prompt_metadata": prompt_metadata,
+            "index_version": index_version
         }
         
         # Cache the result
-        query_cache.set(request.query_text, request.num_results, False, result)
+        if not filters:
+            query_cache.set(request.query_text, request.num_results, False, result, cache_options)
         
         return QueryResponse(**result)
 
@@ -661,6 +764,10 @@ Answer:"""
         final_chunks = chunks[:request.num_results]
         final_chunk_ids = [chunk['id'] for chunk in final_chunks]
 
+    # Merge the best hits with the chunks before and after them into contiguous passages
+    if request.use_context_expansion:
+        final_chunks = expand_chunk_context(final_chunks)
+
     # 6. Construct Enhanced Prompt and Query LLM
     prompt, prompt_metadata = construct_llm_prompt(request.query_text, final_chunks, request.use_enhanced_prompts)
     logger.debug(f"Generated LLM Prompt with {len(final_chunks)} chunks using {prompt_metadata.get('template_used', 'basic')} template")
@@ -685,11 +792,13 @@ Answer:"""
         "query_type": prompt_metadata.get("query_type"),
         "response_format": prompt_metadata.get("response_format"),
         "sources_used": list(set(sources_used)),  # Remove duplicates
-        "prompt_metadata": prompt_metadata
+        "prompt_metadata": prompt_metadata,
+        "index_version": index_version
     }
     
     # Cache the result
-    query_cache.set(request.query_text, request.num_results, False, result)
+    if not filters:
+        query_cache.set(request.query_text, request.num_results, False, result, cache_options)
     
     return QueryResponse(**result)
 
@@ -758,29 +867,62 @@ Answer:"""
         }
 
 @app.post("/generate-embeddings", response_model=List[Optional[List[float]]])
-async def get_embeddings(texts: List[str] = Body(..., embed=True, description="List of texts to embed.")):
+async def get_embeddings(
+    http_request: Request,
+    texts: List[str] = Body(..., embed=True, description="List of texts to embed."),
+    stream: bool = Body(False, description="Stream NDJSON lines as batches complete (also with Accept: application/x-ndjson)."),
+    dtype: str = Body("float32", description="float32 or float16; applies to the binary and base64 encodings.")
+):
     """
     Generates vector embeddings for a list of input texts using Vertex AI.
+    
+    Cached embeddings are looked up first; the remaining texts are deduplicated
+    and embedded in parallel batches. The response is a JSON list in text
+    order. Streaming is opt-in (stream=true or Accept: application/x-ndjson):
+    NDJSON with one {"index", "embedding"} line per text in completion order,
+    then a {"done", "count", "failed"} line.
+    
+    With Accept: application/octet-stream the embeddings come back in the
+    binary format of embedding_codec; with Accept: BASE64_MEDIA_TYPE as that
+    payload base64-encoded in a JSON object. Neither is streamed.
     """
     logger.info(f"Received request to generate embeddings for {len(texts)} text(s).")
     if not texts:
         raise HTTPException(status_code=400, detail="No texts provided.")
 
-    # Handle multiple texts by using cached_generate_embeddings for each text
-    if ENABLE_EMBEDDING_CACHE:
-        embeddings = []
-        for text in texts:
-            emb = cached_generate_embeddings(text)
-            embeddings.append(emb)
-    else:
-        embeddings = generate_embeddings(texts)
+    accept = http_request.headers.get("accept", "")
+    encoding = "binary" if BINARY_MEDIA_TYPE in accept else "base64" if BASE64_MEDIA_TYPE in accept else "json"
+    if encoding != "json" and dtype not in EMBEDDING_DTYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported dtype '{dtype}' (use {', '.join(EMBEDDING_DTYPES)})")
+
+    if encoding == "json" and (stream or NDJSON_MEDIA_TYPE in accept):
+        def ndjson_lines():
+            failed_count = 0
+            for indices, embeddings in stream_embeddings(texts):
+                for index, embedding in zip(indices, embeddings):
+                    failed_count += embedding is None
+                    yield json.dumps({"index": index, "embedding": embedding}) + "\n"
+            if failed_count > 0:
+                logger.warning(f"Embedding failed for {failed_count}/{len(texts)} input texts.")
+            yield json.dumps({"done": True, "count": len(texts), "failed": failed_count}) + "\n"
+        
+        # Starlette iterates the generator in its thread pool, so batches never block the event loop
+        return StreamingResponse(ndjson_lines(), media_type=NDJSON_MEDIA_TYPE)
 
-    if embeddings is None:
-        # This indicates a failure within generate_embeddings, likely logged already
-        raise HTTPException(status_code=500, detail="Failed to generate embeddings. Check server logs.")
+    def collect() -> List[Optional[List[float]]]:
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        for indices, embeddings in stream_embeddings(texts):
+            for index, embedding in zip(indices, embeddings):
+                results[index] = embedding
+        return results
+
+    embeddings = await asyncio.to_thread(collect)
 
     # Check if any individual embedding failed (returned as None in the list)
     failed_count = sum(1 for emb in embeddings if emb is None)
+    if failed_count == len(texts):
+        # This indicates a failure within the embedding service, likely logged already
+        raise HTTPException(status_code=500, detail="Failed to generate embeddings. Check server logs.")
     if failed_count > 0:
          logger.warning(f"Embedding failed for {failed_count}/{len(texts)} input texts.")
          # Decide response: you could return partial results or raise an error.
@@ -788,7 +930,11 @@ async def get_embeddings(texts: List[str] = Body(..., embed=True, description="L
          # raise HTTPException(status_code=507, detail=f"Embedding failed for {failed_count} texts.")
 
 
-    logger.info(f"Successfully processed embedding request. Returning {len(embeddings)} results.")
+    logger.info(f"Successfully processed embedding request. Returning {len(embeddings)} results ({encoding}).")
+    if encoding == "binary":
+        return Response(content=encode_embeddings(embeddings, dtype), media_type=BINARY_MEDIA_TYPE)
+    if encoding == "base64":
+        return JSONResponse(content=encode_base64_response(embeddings, dtype))
     return embeddings
 
 # Add script entry point to run directly
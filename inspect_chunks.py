@@ -7,6 +7,8 @@ import requests
 import json
 import sys
 
+from backend.app.services.corpus_artifact import load_corpus_artifact
+
 BACKEND_URL = "https://eidbi-backend-service-5geiseeama-uc.a.run.app"
 
 def get_chunk_content(chunk_id):
@@ -21,6 +23,13 @@ def get_chunk_content(chunk_id):
     ]
     
     for path in possible_paths:
+        # Prefer the columnar corpus artifact: look the id up without parsing every line
+        artifact = load_corpus_artifact(path)
+        if artifact is not None:
+            row = artifact.find_row(chunk_id)
+            if row is not None:
+                return artifact.chunk(row)
+            continue
         if os.path.exists(path):
             with open(path, 'r', encoding='utf-8') as f:
                 for line in f:
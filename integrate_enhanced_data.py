@@ -12,12 +12,16 @@ import os
 from datetime import datetime
 from typing import List, Dict, Any
 
+from backend.app.services.corpus_artifact import artifact_path_for, build_corpus_artifact, build_search_index
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 def load_jsonl_file(file_path: str) -> List[Dict[str, Any]]:
     """Load chunks from a JSONL file"""
+    # Always parse the JSONL: the chunks are written back to the corpus, and the
+    # artifact holds normalized float32 embeddings, not the stored ones
     chunks = []
     if not os.path.exists(file_path):
         logger.warning(f"File not found: {file_path}")
@@ -182,6 +186,15 @@ def integrate_enhanced_data():
         if save_jsonl_file(unique_chunks, output_file):
             success_count += 1
     
+    # Rebuild the artifact the backend loads instead of parsing the JSONL, with the
+    # side index of the configured search engine (the rebuild drops the old one)
+    try:
+        artifact_path = build_corpus_artifact("local_scraped_data_with_embeddings.jsonl")
+        build_search_index(artifact_path, os.getenv("VECTOR_SEARCH_ENGINE", "exact").lower())
+        logger.info(f"📦 Corpus artifact written to {artifact_path_for('local_scraped_data_with_embeddings.jsonl')}")
+    except Exception as e:
+        logger.warning(f"Could not build corpus artifact: {e}")
+    
     if success_count > 0:
         logger.info("✅ Enhanced data integration completed successfully!")
         logger.info(f"📁 Integrated data saved to {success_count} files")
@@ -25,6 +25,8 @@ import re
 import time
 from collections import defaultdict
 
+from backend.app.services.corpus_artifact import artifact_path_for, read_chunks
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -395,21 +397,13 @@ class KnowledgeBaseAuditor:
         
         # Load current knowledge base
         kb_file = Path("local_scraped_data_with_embeddings.jsonl")
-        if not kb_file.exists():
+        if not kb_file.exists() and not Path(artifact_path_for(str(kb_file))).exists():
             logger.warning("Knowledge base file not found")
             return {"chunks": [], "total_chunks": 0}
         
-        chunks = []
         try:
-            with open(kb_file, 'r', encoding='utf-8') as f:
-                for line_num, line in enumerate(f, 1):
-                    if line.strip():
-                        try:
-                            chunk = json.loads(line)
-                            chunks.append(chunk)
-                        except json.JSONDecodeError as e:
-                            logger.warning(f"Error parsing line {line_num}: {e}")
-                            continue
+            # Reads the columnar corpus artifact when present; embeddings are not needed here
+            chunks = read_chunks(str(kb_file), include_embedding=False)
         except Exception as e:
             logger.error(f"Error reading knowledge base: {e}")
             return {"chunks": [], "total_chunks": 0}
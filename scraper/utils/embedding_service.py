@@ -2,15 +2,55 @@ import logging
 import numpy as np
 from typing import List, Optional
 import os
+import sys
 
 logger = logging.getLogger(__name__)
 
+# Same model as the backend, so both share cached embeddings
+EMBEDDING_MODEL_NAME = "textembedding-gecko@003"
+
+# The embedding modules shared with the backend are imported as backend.app.services.*
+# from the project root, like scripts/ and config.settings
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+# Persistent embedding cache shared with the backend (backend/app/services/embedding_cache.py)
+try:
+    from backend.app.services.embedding_cache import get_embedding_cache
+except ImportError as e:
+    logger.warning(f"Persistent embedding cache unavailable: {e}")
+    get_embedding_cache = lambda: None
+
+# Local CPU embedding backend of the backend (backend/app/services/local_embedding.py)
+try:
+    from backend.app.services.local_embedding import generate_local_embeddings
+except ImportError as e:
+    logger.warning(f"Local embedding backend unavailable: {e}")
+    generate_local_embeddings = None
+
+# Binary client for a running backend's /generate-embeddings (backend/app/services/embedding_codec.py)
+try:
+    from backend.app.services.embedding_codec import request_embeddings
+except ImportError as e:
+    logger.warning(f"Embedding service client unavailable: {e}")
+    request_embeddings = None
+
+# Backend to embed through (e.g. http://localhost:8000) instead of calling Vertex AI here
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL")
+# float32, or float16 for half the transfer size
+EMBEDDING_TRANSPORT_DTYPE = os.getenv("EMBEDDING_TRANSPORT_DTYPE", "float32")
+
 def generate_embeddings(texts: List[str]) -> Optional[List[Optional[List[float]]]]:
     """
     Generate embeddings for the given texts.
     
-    Uses real Vertex AI embeddings if available and configured,
-    otherwise falls back to mock embeddings for testing.
+    With EMBEDDING_SERVICE_URL set, texts are embedded by that backend over
+    the binary embedding transport. Otherwise uses real Vertex AI embeddings
+    if available and configured, the local hashed n-gram backend with
+    EMBEDDING_BACKEND=local, and otherwise falls back to
+    EMBEDDING_FALLBACK_BACKEND (local, or mock for random vectors).
+    Real embeddings are read from and added to the persistent embedding cache.
     
     Args:
         texts: List of text strings to generate embeddings for.
@@ -22,8 +62,15 @@ def generate_embeddings(texts: List[str]) -> Optional[List[Optional[List[float]]
     try:
         # Check if we should use mock embeddings
         use_mock = os.getenv("USE_MOCK_EMBEDDINGS", "false").lower() == "true"
+        backend = "mock" if use_mock else os.getenv("EMBEDDING_BACKEND", "vertex").lower()
         
-        if not use_mock:
+        if EMBEDDING_SERVICE_URL and request_embeddings is not None and not use_mock:
+            try:
+                return request_embeddings(EMBEDDING_SERVICE_URL, texts, EMBEDDING_TRANSPORT_DTYPE)
+            except Exception as e:
+                logger.warning(f"Failed to get embeddings from {EMBEDDING_SERVICE_URL}: {e}")
+        
+        if backend == "vertex":
             # Try to use real Vertex AI embeddings
             try:
                 from google.cloud import aiplatform
@@ -32,25 +79,34 @@ def generate_embeddings(texts: List[str]) -> Optional[List[Optional[List[float]]
                 logger.info(f"Generating real embeddings for {len(texts)} texts using Vertex AI")
                 
                 # Initialize the embedding model - use the same model as backend
-                model = TextEmbeddingModel.from_pretrained("textembedding-gecko@003")
+                model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME)
                 
-                # Generate embeddings in batches to handle API limits
-                embeddings = []
-                batch_size = 5  # Conservative batch size
-                
-                for i in range(0, len(texts), batch_size):
-                    batch = texts[i:i + batch_size]
-                    batch_embeddings = model.get_embeddings(batch)
+                def embed(uncached: List[str]) -> List[List[float]]:
+                    # Generate embeddings in batches to handle API limits
+                    embeddings = []
+                    batch_size = 5  # Conservative batch size
+                    
+                    for i in range(0, len(uncached), batch_size):
+                        batch = uncached[i:i + batch_size]
+                        batch_embeddings = model.get_embeddings(batch)
+                        
+                        for embedding in batch_embeddings:
+                            embeddings.append(embedding.values)
                     
-                    for embedding in batch_embeddings:
-                        embeddings.append(embedding.values)
+                    logger.info(f"Successfully generated {len(embeddings)} real embeddings")
+                    return embeddings
                 
-                logger.info(f"Successfully generated {len(embeddings)} real embeddings")
-                return embeddings
+                cache = get_embedding_cache()
+                return cache.get_or_generate(EMBEDDING_MODEL_NAME, texts, embed) if cache is not None else embed(texts)
                 
             except Exception as e:
                 logger.warning(f"Failed to generate real embeddings: {e}")
-                logger.info("Falling back to mock embeddings")
+                backend = os.getenv("EMBEDDING_FALLBACK_BACKEND", "local").lower()
+                logger.info(f"Falling back to {backend} embeddings")
+        
+        if backend == "local" and generate_local_embeddings is not None:
+            logger.info(f"Generating local embeddings for {len(texts)} texts")
+            return generate_local_embeddings(texts)
         
         # Generate mock embeddings (fallback or when USE_MOCK_EMBEDDINGS=true)
         logger.info(f"Generating mock embeddings for {len(texts)} texts")
@@ -0,0 +1,113 @@
+# eidbi-query-system/scripts/matching_engine_standin.py
+
+"""
+Local stand-in for the Vertex AI Matching Engine REST methods used by
+MatchingEngineVectorStore, backed by an in-memory NumpyVectorStore.
+
+Serves:
+    POST .../indexEndpoints/<id>:findNeighbors
+    POST .../indexes/<id>:upsertDatapoints
+    POST .../indexes/<id>:removeDatapoints
+    GET  .../indexes/<id>
+
+Usage:
+    python scripts/matching_engine_standin.py --port 8085 [--load local_scraped_data_with_embeddings.jsonl]
+    VECTOR_DB_STORE_BACKEND=matching_engine VECTOR_DB_API_ENDPOINT=http://localhost:8085 ...
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+from backend.app.services.corpus_artifact import read_chunks
+from backend.app.services.vector_index import VectorIndex
+from backend.app.services.vector_store import NumpyVectorStore
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def make_handler(store: NumpyVectorStore):
+    """Request handler class bound to a store; requests run in threads but use the store one at a time."""
+    # NumpyVectorStore's growable buffer and swap-delete are not thread-safe
+    store_lock = threading.Lock()
+
+    class StandinHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: dict) -> None:
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _count(self) -> int:
+            with store_lock:
+                return len(store)
+
+        def do_GET(self):
+            self._send_json(200, {
+                "name": self.path,
+                "indexStats": {"vectorsCount": str(self._count()), "shardsCount": 1}
+            })
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b'{}')
+            except json.JSONDecodeError:
+                self._send_json(400, {"error": "invalid JSON"})
+                return
+
+            if self.path.endswith(':findNeighbors'):
+                neighbors = []
+                for query in request.get('queries', []):
+                    datapoint = query.get('datapoint', {})
+                    with store_lock:
+                        hits = store.search(datapoint.get('feature_vector', []), int(query.get('neighbor_count', 10)))
+                    neighbors.append({
+                        "id": datapoint.get('datapoint_id'),
+                        "neighbors": [{"datapoint": {"datapointId": chunk_id}, "distance": score} for chunk_id, score in hits]
+                    })
+                self._send_json(200, {"nearestNeighbors": neighbors})
+            elif self.path.endswith(':upsertDatapoints'):
+                with store_lock:
+                    store.upsert([(point['datapointId'], point['featureVector']) for point in request.get('datapoints', [])])
+                self._send_json(200, {})
+            elif self.path.endswith(':removeDatapoints'):
+                with store_lock:
+                    store.delete(request.get('datapointIds', []))
+                self._send_json(200, {})
+            else:
+                self._send_json(404, {"error": f"unknown method {self.path}"})
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return StandinHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Matching Engine REST API.")
+    parser.add_argument("--port", type=int, default=8085, help="Port to listen on.")
+    parser.add_argument("--dimension", type=int, default=768, help="Embedding dimension of the empty index.")
+    parser.add_argument("--load", help="JSONL corpus whose embeddings are preloaded.", default=None)
+    args = parser.parse_args()
+
+    if args.load:
+        store = NumpyVectorStore.from_chunks(read_chunks(args.load))
+    else:
+        store = NumpyVectorStore(VectorIndex([], np.zeros((0, args.dimension), dtype=np.float32), normalized=True))
+
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), make_handler(store))
+    logger.info(f"Matching Engine stand-in with {len(store)} vectors listening on port {args.port}")
+    server.serve_forever()
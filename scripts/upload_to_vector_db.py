@@ -17,8 +17,8 @@ try:
     # if SCRAPER_UTILS_PATH not in sys.path:
     #     sys.path.append(SCRAPER_UTILS_PATH)
     from config.settings import settings
-    # Import vector DB service ONLY if direct upsert were feasible/implemented
-    # from backend.app.services.vector_db_service import upsert_embeddings 
+    from backend.app.services.vector_store import MatchingEngineVectorStore
+    from backend.app.services.embedding_codec import request_embeddings
 except ImportError as e:
     print(f"Error importing modules in upload_to_vector_db.py: {e}")
     print("Ensure config/settings.py exists relative to the project root.")
@@ -28,8 +28,11 @@ except ImportError as e:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s')
 logger = logging.getLogger(__name__)
 
-def load_chunks_from_jsonl(file_path: str) -> List[Dict[str, Any]]:
-    """Loads chunk data from a JSON Lines file."""
+# Texts per /generate-embeddings request when embedding through the backend
+EMBEDDING_REQUEST_SIZE = 500
+
+def load_chunks_from_jsonl(file_path: str, require_embedding: bool = True) -> List[Dict[str, Any]]:
+    """Loads chunk data from a JSON Lines file (chunks without an embedding need content unless require_embedding)."""
     chunks = []
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
@@ -37,7 +40,7 @@ def load_chunks_from_jsonl(file_path: str) -> List[Dict[str, Any]]:
                 if line.strip():
                     try:
                         chunk = json.loads(line)
-                        if 'id' in chunk and 'embedding' in chunk:
+                        if 'id' in chunk and ('embedding' in chunk or (not require_embedding and chunk.get('content'))):
                             chunks.append(chunk)
                         else:
                             logger.warning(f"Skipping line in {file_path} due to missing 'id' or 'embedding': {line.strip()[:100]}...")
@@ -49,10 +52,34 @@ def load_chunks_from_jsonl(file_path: str) -> List[Dict[str, Any]]:
         logger.error(f"Error reading file {file_path}: {e}", exc_info=True)
     return chunks
 
-def main(input_jsonl_path: str, index_id: str):
-    """Main function to load data and prepare for upsert (placeholder)."""
+def embed_missing_chunks(chunks: List[Dict[str, Any]], service_url: str, dtype: str = "float32") -> List[Dict[str, Any]]:
+    """Embed the content of chunks without an embedding through a running backend (binary transport); drops chunks that fail."""
+    missing = [chunk for chunk in chunks if 'embedding' not in chunk]
+    if not missing:
+        return chunks
+    logger.info(f"Embedding {len(missing)} chunks through {service_url} ({dtype})")
+    for start in range(0, len(missing), EMBEDDING_REQUEST_SIZE):
+        batch = missing[start:start + EMBEDDING_REQUEST_SIZE]
+        try:
+            embeddings = request_embeddings(service_url, [chunk['content'] for chunk in batch], dtype)
+        except Exception as e:
+            logger.error(f"Embedding request for chunks {start}-{start + len(batch) - 1} failed: {e}")
+            continue
+        for chunk, embedding in zip(batch, embeddings):
+            if embedding is not None:
+                chunk['embedding'] = embedding
+    embedded = [chunk for chunk in chunks if 'embedding' in chunk]
+    if len(embedded) < len(chunks):
+        logger.warning(f"Skipping {len(chunks) - len(embedded)} chunks that could not be embedded")
+    return embedded
+
+def main(input_jsonl_path: str, index_id: str, api_endpoint: str = None,
+         embedding_service_url: str = None, embedding_dtype: str = "float32"):
+    """Main function to load data and upsert it into the Matching Engine index."""
     logger.info(f"Loading chunks from: {input_jsonl_path}")
-    chunks_data = load_chunks_from_jsonl(input_jsonl_path)
+    chunks_data = load_chunks_from_jsonl(input_jsonl_path, require_embedding=not embedding_service_url)
+    if chunks_data and embedding_service_url:
+        chunks_data = embed_missing_chunks(chunks_data, embedding_service_url, embedding_dtype)
 
     if not chunks_data:
         logger.error("No valid chunks with IDs and embeddings found in the input file. Exiting.")
@@ -66,43 +93,29 @@ def main(input_jsonl_path: str, index_id: str):
         for chunk in chunks_data
     ]
 
-    logger.warning("--- Placeholder for Vector DB Upsert --- ")
-    logger.warning("Matching Engine Index updates are typically done via batch update jobs.")
-    logger.warning("This script currently only loads data and shows what would be upserted.")
-    logger.info(f"Target Index ID: {index_id}")
-    logger.info(f"Number of datapoints prepared for upsert: {len(datapoints)}")
-
-    # --- Placeholder for calling an upsert function or generating batch files ---
-    # Option 1: Call direct upsert (if implemented and suitable)
-    # success = upsert_embeddings(datapoints=datapoints, index_id_override=index_id)
-    # if success:
-    #      logger.info("Upsert operation submitted successfully (actual update is asynchronous).")
-    # else:
-    #      logger.error("Upsert operation failed.")
-
-    # Option 2: Generate JSON file(s) for batch update
-    # You would need to format datapoints according to:
-    # https://cloud.google.com/vertex-ai/docs/matching-engine/update-rebuild-index#console
-    # and upload these files to GCS, then trigger a batch update via gcloud or console.
-    # Example formatting:
-    # batch_update_data = [
-    #     {"id": dp_id, "embedding": vector} for dp_id, vector in datapoints
-    # ]
-    # batch_filename = f"batch_update_{os.path.basename(input_jsonl_path)}"
-    # with open(batch_filename, 'w', encoding='utf-8') as f_batch:
-    #     for item in batch_update_data:
-    #         json.dump(item, f_batch)
-    #         f_batch.write('\n')
-    # logger.info(f"Generated batch update file: {batch_filename}")
-    # logger.info("Upload this file to GCS and use `gcloud ai indexes update ...`")
-    # --------------------------------------------------------------------------
-
-    logger.info("Script finished (Placeholder Upsert).")
+    # Streaming upserts through the same adapter the backend queries with
+    # (the index must be created with streaming updates enabled)
+    store = MatchingEngineVectorStore.from_settings(
+        project_id=settings.gcp.project_id,
+        region=settings.gcp.region,
+        index_id=index_id,
+        index_endpoint_id=settings.vector_db.index_endpoint_id or "",
+        api_endpoint=api_endpoint
+    )
+    logger.info(f"Upserting {len(datapoints)} datapoints into {store.index_url}")
+    try:
+        written = store.upsert(datapoints)
+        logger.info(f"Upserted {written} datapoints.")
+    except Exception as e:
+        logger.error(f"Upsert failed: {e}", exc_info=True)
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Load embeddings from JSONL and prepare for Vector DB upsert.")
+    parser = argparse.ArgumentParser(description="Load embeddings from JSONL and upsert them into the Vector DB index.")
     parser.add_argument("input_file", help="Path to the input JSON Lines file generated by the scraper (containing IDs and embeddings).")
     parser.add_argument("-i", "--index-id", help="Target Vertex AI Matching Engine Index ID (overrides config).", default=settings.vector_db.index_id)
+    parser.add_argument("--api-endpoint", help="API base URL, e.g. http://localhost:8085 for a local stand-in (default: https://<region>-aiplatform.googleapis.com).", default=None)
+    parser.add_argument("--embedding-service-url", help="Backend URL, e.g. http://localhost:8000, to embed chunks that have content but no embedding.", default=os.getenv("EMBEDDING_SERVICE_URL"))
+    parser.add_argument("--embedding-dtype", choices=["float32", "float16"], help="Precision of embeddings fetched from the backend (float16 halves the transfer).", default="float32")
 
     args = parser.parse_args()
 
@@ -111,4 +124,5 @@ if __name__ == "__main__":
     elif not os.path.exists(args.input_file):
         logger.error(f"Error: Input file not found: {args.input_file}")
     else:
-        main(input_jsonl_path=args.input_file, index_id=args.index_id) 
\ No newline at end of file
+        main(input_jsonl_path=args.input_file, index_id=args.index_id, api_endpoint=args.api_endpoint,
+             embedding_service_url=args.embedding_service_url, embedding_dtype=args.embedding_dtype) 
\ No newline at end of file